@@ -0,0 +1,123 @@
+#Engagement-aware feed rates
+#A pocket's first pass is a full-width slot, later passes only take off a
+#stepover's worth, and the inside corners of those passes take more. Running
+#all of them at one feed is either too slow for the light cuts or too hard
+#on the tool for the heavy ones.
+#This estimates how wide each segment's cut is (its radial engagement) from
+#the paths cut before it: the distance to the nearest of them is how much
+#material is left in the way, up to the tool diameter for a slot. The feed for
+#each segment is then scaled by speedfeed.feedScale for that width, relative
+#to the stepover the user's feed was chosen for, and clamped to limits.
+#Curves have to be fed in the order they're cut. Only the XY shape matters,
+#so each curve's scales are worked out once and reused at every depth.
+
+import math
+import speedfeed
+from areautil import flattenList
+
+DEFAULT_MIN_SCALE = 0.5
+DEFAULT_MAX_SCALE = 1.5
+#Scales are rounded to this, so the feed doesn't change on every line
+SCALE_STEP = 0.05
+
+
+#Parses "MIN,MAX" feed multipliers (eg, from the command line)
+#Raises ValueError with a message saying what's wrong
+def parseLimits(s):
+	try:
+		(lo, hi) = [float(v) for v in s.split(",")]
+	except ValueError:
+		raise ValueError("expected MIN,MAX (eg " + str(DEFAULT_MIN_SCALE) + "," + str(DEFAULT_MAX_SCALE) + "), got " + s)
+	if lo <= 0 or hi < lo:
+		raise ValueError("MIN must be positive and no bigger than MAX, got " + s)
+	return (lo, hi)
+
+
+def _segDist(px, py, seg):
+	(x0, y0, x1, y1) = seg[:4]
+	(dx, dy) = (x1 - x0, y1 - y0)
+	l2 = dx * dx + dy * dy
+	if l2 == 0:
+		return math.hypot(px - x0, py - y0)
+	t = max(0., min(1., ((px - x0) * dx + (py - y0) * dy) / l2))
+	return math.hypot(px - (x0 + t * dx), py - (y0 + t * dy))
+
+
+class Engagement(object):
+	#toolD and stepover in mm; minScale/maxScale limit the feed scale
+	def __init__(self, toolD, stepover, minScale=DEFAULT_MIN_SCALE, maxScale=DEFAULT_MAX_SCALE):
+		self.toolD = toolD
+		self.minScale = minScale
+		self.maxScale = maxScale
+		self.nominal = speedfeed.feedScale(toolD, stepover)
+		#Grid of everything cut so far, in toolD cells, as pieces no longer
+		#than a cell: (x0, y0, x1, y1, curve number, path length at the end)
+		self.grid = {}
+		self.curves = 0
+	
+	def _cell(self, x, y):
+		return (int(math.floor(x / self.toolD)), int(math.floor(y / self.toolD)))
+	
+	def _insert(self, x0, y0, x1, y1, curve, along0, along1):
+		n = max(1, int(math.ceil(math.hypot(x1 - x0, y1 - y0) / self.toolD)))
+		for k in range(n):
+			(a, b) = (float(k) / n, float(k + 1) / n)
+			piece = (x0 + (x1 - x0) * a, y0 + (y1 - y0) * a, x0 + (x1 - x0) * b, y0 + (y1 - y0) * b, curve, along0 + (along1 - along0) * b)
+			(cx0, cy0) = self._cell(min(piece[0], piece[2]), min(piece[1], piece[3]))
+			(cx1, cy1) = self._cell(max(piece[0], piece[2]), max(piece[1], piece[3]))
+			for ix in range(cx0, cx1 + 1):
+				for iy in range(cy0, cy1 + 1):
+					self.grid.setdefault((ix, iy), []).append(piece)
+	
+	#Width of cut (up to toolD) for the tool at (x, y), along mm into curve
+	#A curve's own path only counts once it's a couple of tool diameters
+	#back- anything closer is just the cut leading up to this point
+	def _width(self, x, y, curve, along):
+		best = self.toolD
+		(cx, cy) = self._cell(x, y)
+		for ix in range(cx - 1, cx + 2):
+			for iy in range(cy - 1, cy + 2):
+				for piece in self.grid.get((ix, iy), ()):
+					if piece[4] == curve and along - piece[5] < 2 * self.toolD:
+						continue
+					best = min(best, _segDist(x, y, piece))
+		return best
+	
+	def _scale(self, width):
+		if width <= 1e-6:
+			return self.maxScale
+		scale = round(speedfeed.feedScale(self.toolD, width) / self.nominal / SCALE_STEP) * SCALE_STEP
+		return min(self.maxScale, max(self.minScale, scale))
+	
+	#Feed scale for every vertex of a curve (list or array form- see
+	#curvearray): entry i is for the move that ends at vertex i (entry 0 is
+	#always 1). The curve is then added to what's been cut
+	#Each move is checked at its middle and its end, and gets the heavier of
+	#the two, so moves into inside corners slow down
+	def scales(self, verts):
+		curve = self.curves
+		self.curves += 1
+		scales = [1.]
+		along = 0.
+		for i in range(1, len(verts)):
+			start = [(0, verts[i - 1][1], verts[i - 1][2], 0., 0.), tuple(verts[i])]
+			pts = flattenList(start, self.toolD / 100.)
+			lengths = [math.hypot(pts[k][0] - pts[k - 1][0], pts[k][1] - pts[k - 1][1]) for k in range(1, len(pts))]
+			total = sum(lengths)
+			
+			#Middle of the move, along the path
+			(mid, run) = (pts[-1], 0.)
+			for k in range(len(lengths)):
+				if run + lengths[k] >= total / 2:
+					t = (total / 2 - run) / lengths[k] if lengths[k] > 0 else 0.
+					mid = (pts[k][0] + (pts[k + 1][0] - pts[k][0]) * t, pts[k][1] + (pts[k + 1][1] - pts[k][1]) * t)
+					break
+				run += lengths[k]
+			
+			width = max(self._width(mid[0], mid[1], curve, along + total / 2), self._width(pts[-1][0], pts[-1][1], curve, along + total))
+			scales.append(self._scale(width))
+			
+			for k in range(len(lengths)):
+				self._insert(pts[k][0], pts[k][1], pts[k + 1][0], pts[k + 1][1], curve, along, along + lengths[k])
+				along += lengths[k]
+		return scales
@@ -0,0 +1,116 @@
+#Helpers for copying, measuring and (de)serializing libarea objects
+#libarea's Area/Curve objects can't be pickled, so anything that needs to
+#cross a process boundary (or hit the disk) goes through plain lists here:
+#	curve -> [(type, x, y, cx, cy), ...]
+#	area -> [curve, curve, ...]
+#The helpers that only work on the list form don't need libarea, so this
+#still imports without it (see repost.py)
+
+import math
+
+try:
+	import area
+except ImportError:
+	area = None
+
+#Make a clone of an Area object
+def deepcopy_area(do):
+	a = area.Area()
+	for c in do.getCurves():
+		a.append(c)
+	return a
+
+
+#Turns a curve into a list of (type, x, y, cx, cy) tuples
+def curveToList(curve):
+	return [(v.type, v.p.x, v.p.y, v.c.x, v.c.y) for v in curve.getVertices()]
+
+#Rebuilds a curve from the output of curveToList
+def curveFromList(verts):
+	c = area.Curve()
+	for (t, x, y, cx, cy) in verts:
+		c.append(area.Vertex(t, area.Point(x, y), area.Point(cx, cy)))
+	return c
+
+
+#Same as above, for whole areas
+def areaToList(a):
+	return [curveToList(c) for c in a.getCurves()]
+
+def areaFromList(curves):
+	a = area.Area()
+	for verts in curves:
+		a.append(curveFromList(verts))
+	return a
+
+
+#Returns the bounding box of an area as (minx, miny, maxx, maxy), or None
+#if the area is empty (libarea hands back garbage in that case)
+def areaBox(a):
+	if a.num_curves() == 0:
+		return None
+	box = area.Box()
+	a.GetBox(box)
+	return (box.MinX(), box.MinY(), box.MaxX(), box.MaxY())
+
+#Same as areaBox, for the list form of an area
+#Arcs are boxed by their whole circle, so this may be a little too big, but
+#never too small
+def listBox(curves):
+	minx = miny = float("inf")
+	maxx = maxy = float("-inf")
+	for verts in curves:
+		for (t, x, y, cx, cy) in verts:
+			if t == 0:
+				r = 0.0
+			else:
+				r = ((x - cx)**2 + (y - cy)**2) ** 0.5
+				x = cx
+				y = cy
+			minx = min(minx, x - r)
+			miny = min(miny, y - r)
+			maxx = max(maxx, x + r)
+			maxy = max(maxy, y + r)
+	if minx > maxx:
+		return None
+	return (minx, miny, maxx, maxy)
+
+#True if two boxes (as returned by areaBox) overlap or touch
+def boxesOverlap(a, b):
+	if a == None or b == None:
+		return False
+	return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+#Turns the list form of a curve into a list of (x, y) points, breaking arcs
+#into chords that stray no more than tol from the true arc
+def flattenList(verts, tol=0.01):
+	if len(verts) == 0:
+		return []
+	pts = [(verts[0][1], verts[0][2])]
+	for i in range(1, len(verts)):
+		(t, x, y, cx, cy) = verts[i]
+		if t == 0:
+			pts.append((x, y))
+			continue
+		(sx, sy) = pts[-1]
+		r = math.hypot(sx - cx, sy - cy)
+		a0 = math.atan2(sy - cy, sx - cx)
+		a1 = math.atan2(y - cy, x - cx)
+		#1 is CCW, -1 is CW. Start == end is a full circle
+		sweep = a1 - a0
+		if t == 1:
+			if sweep <= 0:
+				sweep += 2 * math.pi
+		else:
+			if sweep >= 0:
+				sweep -= 2 * math.pi
+		if r <= tol:
+			n = 1
+		else:
+			n = int(math.ceil(abs(sweep) / (2 * math.acos(1 - tol / r))))
+		for k in range(1, n):
+			a = a0 + sweep * k / n
+			pts.append((cx + r * math.cos(a), cy + r * math.sin(a)))
+		pts.append((x, y))
+	return pts
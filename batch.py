@@ -0,0 +1,92 @@
+#Batch processing: many DXFs, one worker pool
+#Each file becomes its own pipeline.Job, run in a worker process, so the
+#interpreter and libarea only get loaded once per worker rather than once
+#per file. A failure in one file is recorded in its summary and doesn't stop
+#the others.
+
+import os
+import json
+import multiprocessing
+import traceback
+import pipeline
+
+DEFAULT_WORKERS = multiprocessing.cpu_count()
+
+
+#Turns a directory (every .dxf in it) or a manifest (a text file listing one
+#DXF per line; blank lines and lines starting with # are skipped, and
+#relative paths are relative to the manifest) into a list of DXF paths
+def findInputs(path):
+	if os.path.isdir(path):
+		names = sorted(n for n in os.listdir(path) if n.lower().endswith(".dxf"))
+		return [os.path.join(path, n) for n in names]
+	
+	if not os.path.isfile(path):
+		raise pipeline.DannyCamError("Couldn't open batch input \"" + path + "\"")
+	base = os.path.dirname(path)
+	inputs = []
+	fin = open(path, 'r')
+	try:
+		for line in fin:
+			line = line.strip()
+			if line == "" or line.startswith("#"):
+				continue
+			inputs.append(os.path.join(base, line))
+	finally:
+		fin.close()
+	return inputs
+
+
+#Where the GCode for inputfile goes: next to it, or in outdir if given
+def outputFor(inputfile, outdir=None):
+	out = pipeline.defaultOutput(inputfile)
+	if outdir != None:
+		out = os.path.join(outdir, os.path.basename(out))
+	return out
+
+
+#Pool worker: runs one job, never raises
+def _runOne(work):
+	(inputfile, outputfile, options) = work
+	try:
+		return pipeline.Job(inputfile, outputfile, verbose=False, **options).run()
+	except pipeline.DannyCamError, e:
+		return {"input": inputfile, "output": outputfile, "error": str(e)}
+	except Exception, e:
+		return {"input": inputfile, "output": outputfile, "error": str(e), "traceback": traceback.format_exc()}
+
+
+#Runs a Job for every input with up to workers processes
+#options are passed on to pipeline.Job; each job runs single-process, since
+#the parallelism is across files
+#Yields each file's summary (with an "error" key if it failed), in input
+#order, as soon as it's available
+def runBatch(inputs, outdir=None, options=None, workers=DEFAULT_WORKERS):
+	options = dict(options or {})
+	options["jobs"] = 1
+	work = [(f, outputFor(f, outdir), options) for f in inputs]
+	
+	if outdir != None and not os.path.isdir(outdir):
+		os.makedirs(outdir)
+	
+	if workers <= 1 or len(work) < 2:
+		for w in work:
+			yield _runOne(w)
+		return
+	
+	pool = multiprocessing.Pool(min(workers, len(work)))
+	try:
+		for result in pool.imap(_runOne, work):
+			yield result
+	finally:
+		pool.close()
+		pool.join()
+
+
+def writeSummary(results, path):
+	fout = open(path, 'w')
+	try:
+		json.dump(results, fout, indent=1, sort_keys=True)
+		fout.write("\n")
+	finally:
+		fout.close()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python2
+#Benchmarks for the toolpath pipeline
+#Writes synthetic DXFs of a chosen size, runs each one through the same steps
+#as a normal job (one stage at a time), and records for every stage the wall
+#and CPU time, how many curves and vertices came out of it, and the peak
+#memory use so far. Each workload runs in a fresh process, so the peaks don't
+#carry over from one to the next.
+#Results go to a JSON file; pass an older one with --compare to see how much
+#faster or slower each stage got.
+#
+#Workloads:
+#	circles: a plate with a grid of round holes
+#	islands: nested squares- alternating pockets and islands
+#	text: lots of small closed contours, like engraved text
+#	arcs: rings whose circles are written as many short LINEs, like a
+#		polyline-flattened arc
+#
+#Usage: python bench.py [-s SIZE] [-o results.json] [--compare old.json]
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import area
+import combine
+import pocket
+import gcode
+import stats
+
+WORKLOADS = ["circles", "islands", "text", "arcs"]
+DEFAULT_SIZE = 10
+DEFAULT_OUTPUT = "bench.json"
+
+#Job settings used for every workload
+TOOLD = 3.175
+STEPOVER = TOOLD / 2
+ZSAFE = 10
+ZMIN = 0
+ZMAX = 1
+ZSTEP = 0.5
+FEED = 1000
+FEEDZ = 200
+RPM = 10000
+
+
+#Minimal (R12-style) DXF writer: just an ENTITIES section
+class DxfWriter(object):
+	def __init__(self, fout):
+		self.fout = fout
+		fout.write("0\nSECTION\n2\nENTITIES\n")
+	
+	def _group(self, code, value):
+		if isinstance(value, float):
+			value = "%.6f" % value
+		self.fout.write(str(code) + "\n" + str(value) + "\n")
+	
+	def line(self, x0, y0, x1, y1):
+		self._group(0, "LINE")
+		self._group(8, "0")
+		for (code, v) in ((10, x0), (20, y0), (30, 0.), (11, x1), (21, y1), (31, 0.)):
+			self._group(code, float(v))
+	
+	def circle(self, cx, cy, r):
+		self._group(0, "CIRCLE")
+		self._group(8, "0")
+		for (code, v) in ((10, cx), (20, cy), (30, 0.), (40, r)):
+			self._group(code, float(v))
+	
+	#Angles in degrees, CCW from start to end
+	def arc(self, cx, cy, r, start, end):
+		self._group(0, "ARC")
+		self._group(8, "0")
+		for (code, v) in ((10, cx), (20, cy), (30, 0.), (40, r), (50, start), (51, end)):
+			self._group(code, float(v))
+	
+	#Closed polygon out of LINEs
+	def polygon(self, pts):
+		for i in range(len(pts)):
+			(x0, y0) = pts[i - 1]
+			(x1, y1) = pts[i]
+			self.line(x0, y0, x1, y1)
+	
+	def rect(self, x0, y0, x1, y1):
+		self.polygon([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+	
+	def close(self):
+		self.fout.write("0\nENDSEC\n0\nEOF\n")
+
+
+#A plate with size x size round holes
+def _circles(dxf, size):
+	pitch = 20.
+	dxf.rect(0, 0, size * pitch, size * pitch)
+	for i in range(size):
+		for j in range(size):
+			dxf.circle((i + 0.5) * pitch, (j + 0.5) * pitch, pitch / 4)
+
+#size nested squares, each a tool's width or so inside the last
+def _islands(dxf, size):
+	gap = 4 * TOOLD
+	for k in range(size):
+		d = k * gap
+		side = 2 * size * gap
+		dxf.rect(d, d, side - d, side - d)
+
+#size x size "letters" a few mm across: a box with a rounded bump on top,
+#and a hole
+def _text(dxf, size):
+	pitch = 12.
+	for i in range(size):
+		for j in range(size):
+			(x, y) = (i * pitch, j * pitch)
+			dxf.line(x, y, x + 8, y)
+			dxf.line(x + 8, y, x + 8, y + 10)
+			dxf.line(x + 8, y + 10, x + 6, y + 10)
+			dxf.arc(x + 4, y + 10, 2, 0, 180)
+			dxf.line(x + 2, y + 10, x, y + 10)
+			dxf.line(x, y + 10, x, y)
+			dxf.circle(x + 4, y + 4, 1.5)
+
+#size rings, each circle flattened into 50 * size LINEs
+def _arcs(dxf, size):
+	n = 50 * size
+	for k in range(size):
+		(cx, cy) = (k * 60., 0.)
+		for r in (25., 10.):
+			dxf.polygon([(cx + r * math.cos(2 * math.pi * i / n), cy + r * math.sin(2 * math.pi * i / n)) for i in range(n)])
+
+
+#Writes the named workload, at the given size, to path
+def writeWorkload(name, size, path):
+	fout = open(path, 'w')
+	try:
+		dxf = DxfWriter(fout)
+		{"circles": _circles, "islands": _islands, "text": _text, "arcs": _arcs}[name](dxf, size)
+		dxf.close()
+	finally:
+		fout.close()
+
+
+#Runs func, appending its timings and the counts of what it returned (or
+#of counted, if given) to stages
+def _stage(stages, name, func, counted=None):
+	cpu0 = time.clock()
+	wall0 = time.time()
+	result = func()
+	wall = time.time() - wall0
+	cpu = time.clock() - cpu0
+	(curves, verts) = stats.counts(counted if counted != None else result)
+	stages.append({"stage": name, "wall": wall, "cpu": cpu, "curves": curves, "vertices": verts, "maxrss": stats.maxrss()})
+	return result
+
+
+#Runs one workload through every stage; pool worker
+def runWorkload(work):
+	(name, size, workdir, jobs) = work
+	dxfPath = os.path.join(workdir, name + ".dxf")
+	ngcPath = os.path.join(workdir, name + ".ngc")
+	writeWorkload(name, size, dxfPath)
+	
+	stages = []
+	a = _stage(stages, "AreaFromDxf", lambda: area.AreaFromDxf(dxfPath))
+	_stage(stages, "Reorder", lambda: a.Reorder(), a)
+	areas = _stage(stages, "Split", lambda: a.Split())
+	combined = _stage(stages, "combine", lambda: combine.xorAll(areas, jobs, False))
+	curves = _stage(stages, "pocket", lambda: pocket.pocketRegions(combined, TOOLD, STEPOVER, jobs))
+	_stage(stages, "direction", lambda: pocket.setDirection(curves, False), curves)
+	program = _stage(stages, "generate", lambda: gcode.generate(curves, ZSAFE, ZMIN, ZSTEP, ZMAX, FEED, FEEDZ, TOOLD, STEPOVER, RPM), curves)
+	
+	def write():
+		fout = open(ngcPath, 'w')
+		try:
+			fout.write(program)
+		finally:
+			fout.close()
+	_stage(stages, "write", write, curves)
+	
+	return {
+		"workload": name,
+		"size": size,
+		"dxfBytes": os.path.getsize(dxfPath),
+		"gcodeBytes": len(program),
+		"total": sum([s["wall"] for s in stages]),
+		"stages": stages,
+	}
+
+
+#The commit being benchmarked, if this is a git checkout
+def _commit():
+	try:
+		here = os.path.dirname(os.path.abspath(__file__))
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=here, stderr=open(os.devnull, 'w')).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+#Process target for _runIsolated: runs one workload and sends back the result
+def _workloadProcess(work, conn):
+	try:
+		conn.send(runWorkload(work))
+	finally:
+		conn.close()
+
+
+#Runs one workload in a fresh process of its own, so the memory peaks don't
+#carry over from one to the next. Unlike a pool worker, it can still have
+#pools of its own for combining and pocketing
+def _runIsolated(work):
+	(parent, child) = multiprocessing.Pipe(False)
+	proc = multiprocessing.Process(target=_workloadProcess, args=(work, child))
+	proc.start()
+	child.close()
+	try:
+		try:
+			return parent.recv()
+		except EOFError:
+			raise RuntimeError("Workload " + work[0] + " failed")
+	finally:
+		parent.close()
+		proc.join()
+
+
+#Runs the named workloads (each in its own process), and returns the results
+def runAll(names, size, jobs=1, workdir=None):
+	keep = workdir != None
+	if workdir == None:
+		workdir = tempfile.mkdtemp(prefix="dannycam-bench-")
+	elif not os.path.isdir(workdir):
+		os.makedirs(workdir)
+	
+	results = []
+	try:
+		for name in names:
+			results.append(_runIsolated((name, size, workdir, jobs)))
+	finally:
+		if not keep:
+			shutil.rmtree(workdir, True)
+	
+	return {
+		"commit": _commit(),
+		"python": sys.version.split()[0],
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"size": size,
+		"jobs": jobs,
+		"results": results,
+	}
+
+
+#Text table of results; if old results are given, each stage also gets the
+#ratio new/old (above 1 means slower)
+def report(bench, old=None):
+	oldStages = {}
+	if old != None:
+		for r in old["results"]:
+			for s in r["stages"]:
+				oldStages[(r["workload"], s["stage"])] = s["wall"]
+	
+	lines = []
+	for r in bench["results"]:
+		lines.append(r["workload"] + " (size " + str(r["size"]) + ", " + str(r["dxfBytes"]) + " byte DXF): " + str("%.3f" % r["total"]) + " s")
+		for s in r["stages"]:
+			line = "\t" + s["stage"].ljust(12) + str("%9.3f" % s["wall"]) + " s  " + str(s["curves"]).rjust(7) + " curves " + str(s["vertices"]).rjust(9) + " vertices " + str(s["maxrss"]).rjust(8) + " KB"
+			key = (r["workload"], s["stage"])
+			if key in oldStages and oldStages[key] > 0:
+				line += "  x" + str("%.2f" % (s["wall"] / oldStages[key]))
+			lines.append(line)
+	return lines
+
+
+parser = argparse.ArgumentParser(description="Benchmark the toolpath pipeline on synthetic DXFs")
+parser.add_argument("-s", "--size", metavar="N", default=DEFAULT_SIZE, type=int, help=("Sets how big each workload is (eg, N x N holes). Default " + str(DEFAULT_SIZE)))
+parser.add_argument("-w", "--workloads", metavar="NAMES", default=",".join(WORKLOADS), type=str, help=("Comma-separated workloads to run. Default " + ",".join(WORKLOADS)))
+parser.add_argument("-j", "--jobs", metavar="N", default=1, type=int, help="Sets the number of worker processes for combining and pocketing. Default 1")
+parser.add_argument("-o", "--output", metavar="FILE", default=DEFAULT_OUTPUT, type=str, help=("Write results to FILE as JSON. Default " + DEFAULT_OUTPUT))
+parser.add_argument("--compare", metavar="FILE", default=None, type=str, help="Compare against earlier results in FILE")
+parser.add_argument("--keep", metavar="DIR", default=None, type=str, help="Keep the generated DXF and GCode files in DIR")
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	names = [n.strip() for n in args.workloads.split(",") if n.strip() != ""]
+	for n in names:
+		if n not in WORKLOADS:
+			print "ERROR: Unknown workload " + n + " (expected one of " + ", ".join(WORKLOADS) + ")"
+			exit(-1)
+	
+	old = None
+	if args.compare != None:
+		fin = open(args.compare, 'r')
+		try:
+			old = json.load(fin)
+		finally:
+			fin.close()
+	
+	bench = runAll(names, args.size, args.jobs, args.keep)
+	for line in report(bench, old):
+		print line
+	
+	fout = open(args.output, 'w')
+	try:
+		json.dump(bench, fout, indent=1, sort_keys=True)
+	finally:
+		fout.close()
+	print "Results written to " + args.output
@@ -0,0 +1,92 @@
+#Combines the pieces of a split area back into one area by XOR-ing them
+#together. XOR is associative and commutative, so instead of folding every
+#piece into one ever-growing accumulator, pieces are combined pairwise in a
+#balanced tree: each level halves the number of areas, and every pair on a
+#level is independent, so a level can be handed out to a process pool.
+
+import multiprocessing
+import area
+import stats
+from areautil import deepcopy_area, areaToList, areaFromList, areaBox, boxesOverlap
+
+#XOR two areas: (a | b) - (a & b)
+#If the bounding boxes don't touch, the intersection is empty, so skip
+#computing it at all
+def xorAreas(a, b):
+	union = deepcopy_area(a)
+	union.Union(b)
+	
+	if boxesOverlap(areaBox(a), areaBox(b)):
+		#Calculate parts to subtract, if any
+		intersect = deepcopy_area(a)
+		intersect.Intersect(b)
+		
+		#If there's something we should cut out, do it
+		if intersect.num_curves() > 0:
+			union.Subtract(intersect)
+	
+	return union
+
+
+#Pool worker: same as xorAreas, but on the list form of the areas (libarea
+#objects can't be pickled)
+def _xorLists(pair):
+	return areaToList(xorAreas(areaFromList(pair[0]), areaFromList(pair[1])))
+
+
+#Combines one level of the tree: pairs up neighbors, leaving the odd one
+#out (if any) for the next level
+def _reduceLevel(level, xorFunc, mapFunc):
+	pairs = [(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+	merged = mapFunc(xorFunc, pairs)
+	if len(level) % 2:
+		merged.append(level[-1])
+	return merged
+
+
+#In-process version of map for _reduceLevel, reporting each XOR to progress
+def _mapWithProgress(progress):
+	def mapFunc(f, pairs):
+		merged = []
+		for (a, b) in pairs:
+			merged.append(f(a, b))
+			if progress != None:
+				progress.advance()
+		return merged
+	return mapFunc
+
+
+#XOR all of the areas in the list together. Kind of hack-y, but should give
+#a good approximation of what was intended with the DXF
+#jobs: number of worker processes to use; 1 does everything in-process
+#verbose: report progress (with an ETA) as the XORs get done
+#Returns a single area. The input list is not modified
+def xorAll(areas, jobs=1, verbose=True):
+	if len(areas) == 0:
+		return area.Area()
+	
+	level = list(areas)
+	#Combining n areas always takes n - 1 XORs, however they're paired up
+	progress = None
+	if verbose:
+		progress = stats.Progress("Combining " + str(len(level)) + " area(s)", len(level) - 1)
+	
+	#Not worth spinning up processes for a single pair
+	if jobs <= 1 or len(level) < 4:
+		while len(level) > 1:
+			level = _reduceLevel(level, xorAreas, _mapWithProgress(progress))
+		return level[0]
+	
+	pool = multiprocessing.Pool(jobs)
+	try:
+		level = [areaToList(a) for a in level]
+		while len(level) > 1:
+			pairs = len(level) / 2
+			level = _reduceLevel(level, _xorLists, pool.map)
+			if progress != None:
+				progress.advance(pairs)
+	finally:
+		pool.close()
+		pool.join()
+	
+	return areaFromList(level[0])
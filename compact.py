@@ -0,0 +1,343 @@
+#Toolpath compaction
+#DXFs from some exporters are full of curves that have been flattened into
+#hundreds of tiny line segments, and pocketing passes them straight through.
+#This merges runs of collinear segments into single lines and fits arcs to
+#runs that follow a circle, as long as the result stays within a tolerance
+#of the original path. Arcs already in the toolpath are left alone.
+#The tolerance should be well under the GCode path tolerance (G64 P), since
+#the controller is allowed to stray that far again on top of it.
+#The same fitting also simplifies the DXF's outlines before any of the
+#boolean operations or pocketing see them (see simplifyList), where every
+#vertex saved makes the heavy libarea work cheaper.
+
+import math
+import gcode
+from areautil import curveToList, curveFromList, areaToList, areaFromList
+
+DEFAULT_TOLERANCE = gcode.pathTolerance / 2.
+
+#Anything flatter than this is a line as far as we're concerned
+MAX_RADIUS = 10000.0
+
+
+def _cross(o, a, b):
+	return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+#True if every point in pts[i..j] is within tol of the segment from pts[i]
+#to pts[j], in order
+def _lineFits(pts, i, j, tol):
+	(ax, ay) = pts[i]
+	(bx, by) = pts[j]
+	dx = bx - ax
+	dy = by - ay
+	l2 = dx*dx + dy*dy
+	if l2 < 1e-18:
+		return False
+	l = math.sqrt(l2)
+	lastT = 0.0
+	for k in range(i + 1, j):
+		(px, py) = pts[k]
+		if abs(dx * (py - ay) - dy * (px - ax)) / l > tol:
+			return False
+		#No doubling back along the line
+		t = (dx * (px - ax) + dy * (py - ay)) / l2
+		if t < lastT or t > 1.0:
+			return False
+		lastT = t
+	return True
+
+
+#Circle through three points, as (cx, cy, r), or None if they're in a line
+def _circle(a, b, c):
+	d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+	if abs(d) < 1e-12:
+		return None
+	a2 = a[0]*a[0] + a[1]*a[1]
+	b2 = b[0]*b[0] + b[1]*b[1]
+	c2 = c[0]*c[0] + c[1]*c[1]
+	cx = (a2 * (b[1] - c[1]) + b2 * (c[1] - a[1]) + c2 * (a[1] - b[1])) / d
+	cy = (a2 * (c[0] - b[0]) + b2 * (a[0] - c[0]) + c2 * (b[0] - a[0])) / d
+	return (cx, cy, math.hypot(a[0] - cx, a[1] - cy))
+
+
+#Tries to replace pts[i..j] with one arc
+#Returns (type, cx, cy) for the arc (1 = CCW, -1 = CW), or None if the
+#points don't all lie within tol of it, turning the same way
+def _arcFits(pts, i, j, tol):
+	circle = _circle(pts[i], pts[(i + j) / 2], pts[j])
+	if circle == None:
+		return None
+	(cx, cy, r) = circle
+	if r > MAX_RADIUS:
+		return None
+	turn = _cross(pts[i], pts[(i + j) / 2], pts[j])
+	sweep = 0.0
+	for k in range(i + 1, j + 1):
+		(px, py) = pts[k]
+		if abs(math.hypot(px - cx, py - cy) - r) > tol:
+			return None
+		#Every point has to keep turning the same way...
+		if k < j and _cross(pts[k - 1], pts[k], pts[k + 1]) * turn < 0:
+			return None
+		#...and the original segments can't bulge away from the arc
+		chord = math.hypot(px - pts[k - 1][0], py - pts[k - 1][1])
+		if chord >= 2 * r:
+			return None
+		if r - math.sqrt(r*r - chord*chord / 4.) > tol:
+			return None
+		sweep += 2 * math.asin(chord / (2 * r))
+	#Stay clear of full circles- start == end means something else to libarea
+	if sweep > 1.9 * math.pi:
+		return None
+	if turn > 0:
+		return (1, cx, cy)
+	return (-1, cx, cy)
+
+
+#Compacts one run of line segments through pts (pts[0] is where the run
+#starts); returns the replacement vertices
+def _compactRun(pts, tol):
+	out = []
+	i = 0
+	m = len(pts) - 1
+	while i < m:
+		#Longest straight line from here
+		j = i + 1
+		while j + 1 <= m and _lineFits(pts, i, j + 1, tol):
+			j += 1
+		
+		#Longest arc from here; only worth it over at least 3 segments
+		arcEnd = None
+		arc = None
+		k = i + 3
+		while k <= m:
+			fit = _arcFits(pts, i, k, tol)
+			if fit == None:
+				break
+			(arcEnd, arc) = (k, fit)
+			k += 1
+		
+		if arcEnd != None and arcEnd > j:
+			(t, cx, cy) = arc
+			out.append((t, pts[arcEnd][0], pts[arcEnd][1], cx, cy))
+			i = arcEnd
+		else:
+			out.append((0, pts[j][0], pts[j][1], 0.0, 0.0))
+			i = j
+	return out
+
+
+#Compacts the list form of a curve
+def compactList(verts, tol=DEFAULT_TOLERANCE):
+	if len(verts) < 3:
+		return list(verts)
+	out = [verts[0]]
+	run = [(verts[0][1], verts[0][2])]
+	for v in verts[1:]:
+		if v[0] == 0:
+			run.append((v[1], v[2]))
+			continue
+		#An arc ends the run of lines before it
+		out += _compactRun(run, tol)
+		out.append(v)
+		run = [(v[1], v[2])]
+	out += _compactRun(run, tol)
+	return out
+
+
+#Compacts every curve
+#Returns (new curves, (vertices before, vertices after), (lines before,
+#lines after))
+def compactCurves(curves, tol=DEFAULT_TOLERANCE):
+	result = []
+	vertsBefore = vertsAfter = 0
+	linesBefore = linesAfter = 0
+	for c in curves:
+		verts = curveToList(c)
+		newVerts = compactList(verts, tol)
+		vertsBefore += len(verts)
+		vertsAfter += len(newVerts)
+		linesBefore += len([v for v in verts[1:] if v[0] == 0])
+		linesAfter += len([v for v in newVerts[1:] if v[0] == 0])
+		result.append(curveFromList(newVerts))
+	return (result, (vertsBefore, vertsAfter), (linesBefore, linesAfter))
+
+
+#Distance from p to the segment from a to b
+def _segDist(p, a, b):
+	(dx, dy) = (b[0] - a[0], b[1] - a[1])
+	l2 = dx*dx + dy*dy
+	if l2 < 1e-18:
+		return math.hypot(p[0] - a[0], p[1] - a[1])
+	t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / l2))
+	return math.hypot(p[0] - (a[0] + t * dx), p[1] - (a[1] + t * dy))
+
+
+#Douglas-Peucker: the points of the polyline pts to keep so that none of
+#the others is more than tol off it
+#Returns line vertices for every kept point after the first
+def _douglasPeucker(pts, tol):
+	keep = [False] * len(pts)
+	keep[0] = keep[-1] = True
+	stack = [(0, len(pts) - 1)]
+	while stack:
+		(i, j) = stack.pop()
+		(worst, at) = (tol, None)
+		for k in range(i + 1, j):
+			d = _segDist(pts[k], pts[i], pts[j])
+			if d > worst:
+				(worst, at) = (d, k)
+		if at != None:
+			keep[at] = True
+			stack += [(i, at), (at, j)]
+	return [(0, pts[k][0], pts[k][1], 0.0, 0.0) for k in range(1, len(pts)) if keep[k]]
+
+
+#Takes out vertices within tol of the last one kept (duplicates, and the
+#ends of tiny segments), and arcs too small to be anything but a line
+#Everything dropped is within tol of a vertex that's kept, so the outline
+#never moves further than that; anything more is up to the fitting
+def _dropDegenerate(verts, tol):
+	out = [verts[0]]
+	last = len(verts) - 2
+	for (n, v) in enumerate(verts[1:]):
+		(t, x, y, cx, cy) = v
+		if t != 0 and math.hypot(x - cx, y - cy) < tol:
+			v = (0, x, y, 0.0, 0.0)
+		prev = out[-1]
+		#Can't lose the end of an arc, and the last vertex has to stay where
+		#it is, so closed curves stay closed
+		if v[0] == 0 and n < last and math.hypot(x - prev[1], y - prev[2]) < tol:
+			continue
+		out.append(v)
+	return out
+
+
+#Longest arc from pts[i] over at least 3 segments, as (end, (type, cx, cy)),
+#or (None, None). DXF outlines can have thousands of points to a curve, so
+#this doubles its way out and then bisects back, rather than trying every
+#end in turn
+def _longestArc(pts, i, tol):
+	m = len(pts) - 1
+	(good, fit) = (None, None)
+	step = 3
+	while i + step <= m:
+		f = _arcFits(pts, i, i + step, tol)
+		if f == None:
+			break
+		(good, fit) = (i + step, f)
+		step *= 2
+	if good == None:
+		return (None, None)
+	(lo, hi) = (good, min(i + step, m + 1))
+	while hi - lo > 1:
+		mid = (lo + hi) / 2
+		f = _arcFits(pts, i, mid, tol)
+		if f == None:
+			hi = mid
+		else:
+			(lo, fit) = (mid, f)
+	return (lo, fit)
+
+
+#Simplifies one run of line segments through pts: arcs are fitted to
+#stretches that follow a circle, and what's left is thinned out with
+#Douglas-Peucker
+def _simplifyRun(pts, tol):
+	out = []
+	line = [pts[0]]
+	i = 0
+	m = len(pts) - 1
+	while i < m:
+		#Longest arc from here, unless a line would do just as well
+		(arcEnd, arc) = _longestArc(pts, i, tol)
+		if arcEnd != None and not _lineFits(pts, i, arcEnd, tol):
+			(t, cx, cy) = arc
+			out += _douglasPeucker(line, tol)
+			out.append((t, pts[arcEnd][0], pts[arcEnd][1], cx, cy))
+			i = arcEnd
+			line = [pts[i]]
+		else:
+			i += 1
+			line.append(pts[i])
+	return out + _douglasPeucker(line, tol)
+
+
+#Distance from p to the list-form segment v, starting at a
+def _vertexDist(p, a, v):
+	(t, x, y, cx, cy) = v
+	if t == 0:
+		return _segDist(p, a, (x, y))
+	a0 = math.atan2(a[1] - cy, a[0] - cx)
+	a1 = math.atan2(y - cy, x - cx)
+	ap = math.atan2(p[1] - cy, p[0] - cx)
+	if t < 0:
+		(a0, a1, ap) = (-a0, -a1, -ap)
+	sweep = (a1 - a0) % (2 * math.pi) or 2 * math.pi
+	if (ap - a0) % (2 * math.pi) <= sweep:
+		return abs(math.hypot(p[0] - cx, p[1] - cy) - math.hypot(x - cx, y - cy))
+	return min(math.hypot(p[0] - a[0], p[1] - a[1]), math.hypot(p[0] - x, p[1] - y))
+
+
+#How far the furthest vertex of verts is from the outline simplified
+#The vertices mostly go along the simplified outline in order, so each is
+#first measured against the segments around where the last one was; only
+#one that would be the new furthest gets checked against all of them
+def deviation(verts, simplified):
+	segs = [((simplified[k - 1][1], simplified[k - 1][2]), simplified[k]) for k in range(1, len(simplified))]
+	if not segs:
+		return 0.0
+	worst = 0.0
+	k = 0
+	for v in verts:
+		p = (v[1], v[2])
+		best = _vertexDist(p, segs[k][0], segs[k][1])
+		while k + 1 < len(segs):
+			d = _vertexDist(p, segs[k + 1][0], segs[k + 1][1])
+			if d > best:
+				break
+			(best, k) = (d, k + 1)
+		if best > worst:
+			best = min([_vertexDist(p, a, s) for (a, s) in segs])
+			worst = max(worst, best)
+	return worst
+
+
+#Simplifies the list form of an outline, keeping it within about tol of the
+#original: near-duplicate vertices and tiny segments go, arcs are fitted to
+#flattened ones, and the remaining lines are thinned out. Arcs that were
+#already there are kept. Outlines that would collapse, or that the fitting
+#has taken further than tol from where they were, are left alone
+def simplifyList(verts, tol=DEFAULT_TOLERANCE):
+	if len(verts) < 3:
+		return list(verts)
+	#Half the budget each for moving corners and for the fitting
+	cleaned = _dropDegenerate(verts, tol / 2.)
+	out = [cleaned[0]]
+	run = [(cleaned[0][1], cleaned[0][2])]
+	for v in cleaned[1:]:
+		if v[0] == 0:
+			run.append((v[1], v[2]))
+			continue
+		out += _simplifyRun(run, tol / 2.)
+		out.append(v)
+		run = [(v[1], v[2])]
+	out += _simplifyRun(run, tol / 2.)
+	#A closed outline needs at least a start and two more points to still
+	#enclose anything
+	if len(out) < 3 or (len(out) == 3 and out[1][0] == 0 and out[2][0] == 0):
+		return list(verts)
+	if deviation(verts, out) > tol:
+		return list(verts)
+	return out
+
+
+#Simplifies every outline of an area (see simplifyList)
+#Returns (new area, (vertices before, vertices after))
+def simplifyArea(a, tol=DEFAULT_TOLERANCE):
+	curves = areaToList(a)
+	simplified = [simplifyList(verts, tol) for verts in curves]
+	before = sum([len(verts) for verts in curves])
+	after = sum([len(verts) for verts in simplified])
+	return (areaFromList(simplified), (before, after))
@@ -0,0 +1,205 @@
+#Array form of curves, for the loops that run over every vertex
+#Getting a curve out of libarea is slow- every vertex is its own SWIG object,
+#and so is every .p and .c hanging off it- so each curve is converted once,
+#into a NumPy structured array with a row per vertex: (type, x, y, cx, cy).
+#That's the same layout as the list form in areautil, so rows index the same
+#way (row[0] is the type, row[1] is x, ...) and code that walks vertices one
+#at a time works on either. Length, bounding box and flattening (for
+#previews) work on whole columns at once, as does the GCode for a path (see
+#gcode.pathCmds).
+#NumPy is optional. Without it, "arrays" are just the list form, and the same
+#functions fall back to plain loops.
+
+import math
+from areautil import curveToList, listBox, flattenList
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+#Row layout; matches areautil's list form
+VERTEX = [("type", "i1"), ("x", "f8"), ("y", "f8"), ("cx", "f8"), ("cy", "f8")]
+
+
+#True if verts is a NumPy array (as opposed to the list form)
+def isArray(verts):
+	return numpy != None and isinstance(verts, numpy.ndarray)
+
+
+#Array form of a curve in list form
+def fromList(verts):
+	if numpy == None:
+		return verts
+	return numpy.array(verts, dtype=VERTEX)
+
+#Array form of a libarea curve
+def fromCurve(curve):
+	return fromList(curveToList(curve))
+
+#Array form of a curve that may be a libarea curve, or in list or array
+#form already
+def fromAny(curve):
+	if isArray(curve):
+		return curve
+	if isinstance(curve, list):
+		return fromList(curve)
+	return fromCurve(curve)
+
+#Back to the list form
+def toList(verts):
+	if isArray(verts):
+		return verts.tolist()
+	return verts
+
+
+#True if the curve ends where it starts
+def isClosed(verts):
+	return len(verts) > 2 and verts[0][1] == verts[-1][1] and verts[0][2] == verts[-1][2]
+
+
+#Index of the vertex closest to p. The last vertex of a closed curve is the
+#same as the first, so it's skipped
+def nearest(verts, p):
+	n = len(verts)
+	if isClosed(verts):
+		n -= 1
+	(px, py) = p
+	if isArray(verts):
+		d = (verts["x"][:n] - px)**2 + (verts["y"][:n] - py)**2
+		return int(d.argmin())
+	
+	best = 0
+	bestd = float("inf")
+	for i in xrange(n):
+		d = (verts[i][1] - px)**2 + (verts[i][2] - py)**2
+		if d < bestd:
+			bestd = d
+			best = i
+	return best
+
+
+#Same curve, starting at vertex idx instead (like libarea's shiftStart)
+#Only closed curves can be shifted; anything else is returned as-is
+def shiftStart(verts, idx):
+	if idx == 0 or not isClosed(verts):
+		return verts
+	if isArray(verts):
+		shifted = numpy.concatenate((verts[idx:idx + 1], verts[idx + 1:], verts[1:idx + 1]))
+		shifted[0]["type"] = 0
+		return shifted
+	v = verts[idx]
+	return [(0, v[1], v[2], v[3], v[4])] + verts[idx + 1:] + verts[1:idx + 1]
+
+
+#Signed angle swept by an arc from angle a0 to a1: positive for CCW (type
+#1), negative for CW (-1). Start == end is a full circle
+def _sweep(t, a0, a1):
+	sweep = a1 - a0
+	if t == 1:
+		if sweep <= 0:
+			sweep += 2 * math.pi
+	else:
+		if sweep >= 0:
+			sweep -= 2 * math.pi
+	return sweep
+
+#Same as _sweep, for columns
+def _sweeps(t, a0, a1):
+	sweep = a1 - a0
+	sweep = numpy.where((t == 1) & (sweep <= 0), sweep + 2 * math.pi, sweep)
+	sweep = numpy.where((t != 1) & (sweep >= 0), sweep - 2 * math.pi, sweep)
+	return sweep
+
+
+#The arcs of a curve (array form), as columns: (mask of the rows they end
+#on, type, start x/y, end x/y, center x/y, radius, start angle, sweep)
+#Row 0 is never an arc- it's just where the curve starts
+def _arcColumns(verts):
+	arcs = numpy.zeros(len(verts), dtype=bool)
+	arcs[1:] = verts["type"][1:] != 0
+	prev = numpy.nonzero(arcs)[0] - 1
+	(sx, sy) = (verts["x"][prev], verts["y"][prev])
+	(x, y) = (verts["x"][arcs], verts["y"][arcs])
+	(cx, cy) = (verts["cx"][arcs], verts["cy"][arcs])
+	t = verts["type"][arcs]
+	r = numpy.hypot(sx - cx, sy - cy)
+	a0 = numpy.arctan2(sy - cy, sx - cx)
+	sweep = _sweeps(t, a0, numpy.arctan2(y - cy, x - cx))
+	return (arcs, t, sx, sy, x, y, cx, cy, r, a0, sweep)
+
+
+#Length of a curve
+def length(verts):
+	if len(verts) < 2:
+		return 0.0
+	if not isArray(verts):
+		total = 0.0
+		for i in range(1, len(verts)):
+			(t, x, y, cx, cy) = verts[i]
+			(sx, sy) = (verts[i - 1][1], verts[i - 1][2])
+			if t == 0:
+				total += math.hypot(x - sx, y - sy)
+			else:
+				sweep = _sweep(t, math.atan2(sy - cy, sx - cx), math.atan2(y - cy, x - cx))
+				total += math.hypot(sx - cx, sy - cy) * abs(sweep)
+		return total
+	
+	spans = numpy.zeros(len(verts))
+	spans[1:] = numpy.hypot(numpy.diff(verts["x"]), numpy.diff(verts["y"]))
+	arcCols = _arcColumns(verts)
+	spans[arcCols[0]] = arcCols[8] * numpy.abs(arcCols[10])
+	return float(spans.sum())
+
+
+#Bounding box of a curve, as (minx, miny, maxx, maxy), or None if it's
+#empty. Like areautil.listBox, arcs count as their whole circle
+def box(verts):
+	if len(verts) == 0:
+		return None
+	if not isArray(verts):
+		return listBox([verts])
+	
+	lines = verts["type"] == 0
+	px = numpy.where(lines, verts["x"], verts["cx"])
+	py = numpy.where(lines, verts["y"], verts["cy"])
+	r = numpy.where(lines, 0.0, numpy.hypot(verts["x"] - verts["cx"], verts["y"] - verts["cy"]))
+	return (float((px - r).min()), float((py - r).min()), float((px + r).max()), float((py + r).max()))
+
+
+#Flattens a curve into points, breaking arcs into chords that stray no more
+#than tol from the true arc (see areautil.flattenList)
+#Returns (xs, ys): NumPy columns for an array, lists otherwise
+def flatten(verts, tol=0.01):
+	if not isArray(verts):
+		pts = flattenList(verts, tol)
+		return ([p[0] for p in pts], [p[1] for p in pts])
+	if len(verts) == 0:
+		return (numpy.zeros(0), numpy.zeros(0))
+	
+	#How many points each vertex turns into: one for a line, one per chord
+	#for an arc
+	counts = numpy.ones(len(verts), dtype=int)
+	(arcs, t, sx, sy, x, y, cx, cy, r, a0, sweep) = _arcColumns(verts)
+	chords = numpy.ones(len(r), dtype=int)
+	big = r > tol
+	if big.any():
+		step = 2 * numpy.arccos(1 - tol / r[big])
+		chords[big] = numpy.ceil(numpy.abs(sweep[big]) / step).astype(int)
+	counts[arcs] = numpy.maximum(chords, 1)
+	
+	#Point k (1..n) of each vertex. Lines only have k == n, their end point
+	row = numpy.repeat(numpy.arange(len(verts)), counts)
+	ends = numpy.cumsum(counts)
+	k = numpy.arange(ends[-1]) - numpy.repeat(ends - counts, counts) + 1
+	xs = verts["x"][row].astype(float)
+	ys = verts["y"][row].astype(float)
+	
+	#Arc points that aren't the end point go around the circle
+	arcIndex = numpy.cumsum(arcs) - 1
+	onArc = arcs[row] & (k < counts[row])
+	j = arcIndex[row[onArc]]
+	a = a0[j] + sweep[j] * k[onArc] / counts[row[onArc]].astype(float)
+	xs[onArc] = cx[j] + r[j] * numpy.cos(a)
+	ys[onArc] = cy[j] + r[j] * numpy.sin(a)
+	return (xs, ys)
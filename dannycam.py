@@ -32,305 +32,241 @@
 #slice.purgeTouched()
 #del slice,comp,wires,shape
 
-import area
 import argparse
-import gcode
 import os.path
-import math
-#from Tkinter import Tk, Canvas, Frame, BOTH
-from Tkinter import *
-
-#Make a clone of an Area object
-def deepcopy_area(do):
-	a = area.Area()
-	for c in do.getCurves():
-		a.append(c)
-	return a
-
+import cProfile
+import pipeline
+import batch
+import toolpathcache
+import ordering
+import estimate
+import preview
+import compact
+import adaptive
+import simulate
+import watch
+import dxf
+from pipeline import DEFAULT_ZSAFE, DEFAULT_FEED, DEFAULT_TOOLD, DEFAULT_RPM, DEFAULT_JOBS, DEFAULT_ZMIN, DEFAULT_ZMAX, DEFAULT_CLEARANCE
 
 #Defaults
-DEFAULT_ZSAFE=25.4
-DEFAULT_FEED=30*25.4
-DEFAULT_TOOLD=6.35
 DEFAULT_STEPOVER=-1
 DEFAULT_CUTDEPTH=-1
-DEFAULT_RPM=10000
-screenW = 800
-screenH = 600
-
-
-#Nicely handle command-line arguments
-parser=argparse.ArgumentParser(description="Create toolpaths and (hopefully someday) GCode from DXF files")
-parser.add_argument("inputfile", metavar="IN.dxf", type=str, help="DXF file to generate toolpaths for")
-parser.add_argument("outputfile", metavar="OUT.ngc", type=str, help='GCode output file, default ${IN%%.dxf}.ngc', nargs="?")
-parser.add_argument("--climb", dest="climb", action="store_true", help="Use climb milling instead of conventional (default: conventional)")
-parser.add_argument("-c","--cutdepth", metavar="DEPTH", default=DEFAULT_CUTDEPTH, type=float, help=("Sets the cut depth of each pass (mm) for machining. Default ToolD/2 mm"))
-parser.add_argument("-f","--feed", metavar="FEED", default=DEFAULT_FEED, type=float, help=("Sets the feed rate (mm/min) for machining in the XY plane. Default " + str(DEFAULT_FEED) + " mm/min"))
-#parser.add_argument("--helix", dest="helix", action="store_true", help="Enable helical plunging (EXPERIMENTAL) (default: straight plunge)")
-parser.add_argument("-s","--stepover", metavar="STEP", default=DEFAULT_STEPOVER, type=float, help=("Sets how much lateral material is removed per pass (mm). Default ToolD/2 mm"))
-parser.add_argument("-t","--toold", metavar="DIA", default=DEFAULT_TOOLD, type=float, help=("Sets the tool diameter (mm). Default " + str(DEFAULT_TOOLD) + " mm"))
-parser.add_argument("-w","--rpm", metavar="RPM", default=DEFAULT_TOOLD, type=int, help=("Sets the spindle angular velocity (RPM). Default " + str(DEFAULT_RPM) + " RPM"))
-parser.add_argument("-z","--zsafe", metavar="HEIGHT", default=DEFAULT_ZSAFE, type=float, help=("Sets the safe height (mm) for rapid travel. Default " + str(DEFAULT_ZSAFE) + " mm"))
-args = parser.parse_args()
+DEFAULT_ADAPTIVE=str(adaptive.DEFAULT_MIN_SCALE) + "," + str(adaptive.DEFAULT_MAX_SCALE)
 
 
-#Copy arguments into useful variables
-inputfile = args.inputfile
-toold = args.toold
-feed = args.feed
-zsafe = args.zsafe
-rpm = args.rpm
-climb = args.climb
+#--adaptive's argument; see adaptive.parseLimits
+def feedLimits(s):
+	try:
+		return adaptive.parseLimits(s)
+	except ValueError, e:
+		raise argparse.ArgumentTypeError(str(e))
 
-#This may need to be handled differently if we support linear ramps
-#if args.helix:
-#	plungetype = gcode.plungeHelical
-#else:
-#	plungetype = gcode.plungeStraight
 
-#Output file may need special handling- if not passed, use input filename,
-#replacing ".dxf" with".ngc"
-#Otherwise, use argument passed
-if args.outputfile == None:
-	outputfile = inputfile.split(".dxf")[0] + ".ngc"
-else:
-	outputfile = args.outputfile
+#--array's argument: "NxM" copies (columns x rows)
+def arraySize(s):
+	try:
+		(cols, rows) = [int(v) for v in s.lower().split("x")]
+	except ValueError:
+		raise argparse.ArgumentTypeError("expected NxM (eg 3x2), got " + s)
+	if cols < 1 or rows < 1:
+		raise argparse.ArgumentTypeError("need at least one column and one row, got " + s)
+	return (cols, rows)
 
-#Before doing too much work, check to see if we can even open the requested output file
-fout = open(outputfile, 'w');
-if fout.closed:
-	print "Couldn't open output file " + outputfile + "; aborting"
-	exit(-1)
 
-#Stepover needs special handling- it can't be bigger than the tool
-if args.stepover <= 0:
-	print "Stepover either not specified or negative; using default ToolD/2 (" + str(toold/2) + " mm)"
-	stepover = toold/2
-else:
-	if args.stepover > toold:
-		print "ERROR: Specified stepover (" + str(args.stepover) + " mm) is greater than the tool diameter (" + str(toold) + " mm). Aborting!"
-		exit(-1)
-	stepover = args.stepover
+#--pitch's argument: "DX,DY" in mm
+def arrayPitch(s):
+	try:
+		(dx, dy) = [float(v) for v in s.split(",")]
+	except ValueError:
+		raise argparse.ArgumentTypeError("expected DX,DY (eg 50,30), got " + s)
+	return (dx, dy)
 
-#Similarly, cutdepth needs special handling- default based on tool size
-if args.cutdepth <= 0:
-	print "Cut depth either not specified or negative; using default ToolD/10 (" + str(toold/10) + " mm)"
-	cutdepth = toold/10
-else:
-	if args.cutdepth > toold/2:
-		print "########"
-		print "WARNING: Specified cut depth (" + str(args.cutdepth) + " mm) is greater than ToolD/2 (" + str(toold/2) + " mm). This is generally frowned upon unless you're cutting very soft materials!"
-		print "########"
-	cutdepth = args.cutdepth
 
-print ""
-print "Input file is: " + str(inputfile)
-print "Feed rate is: " + str(feed) + " mm/min"
-print "ZSafe is: " + str(zsafe) + " mm"
-print "ToolD is: " + str(toold) + " mm"
-print "Stepover is: " + str(stepover) + " mm"
-print "Spindle RPM is: " + str(rpm) + " RPM"
-print ""
+#Comma-separated names, for --layers and friends
+def nameList(s):
+	return [n for n in s.split(",") if n.strip()]
 
 
+#Nicely handle command-line arguments
+parser=argparse.ArgumentParser(description="Create toolpaths and (hopefully someday) GCode from DXF files")
+parser.add_argument("inputfile", metavar="IN.dxf", type=str, help="DXF file to generate toolpaths for (with --batch, a directory of DXFs or a file listing them)")
+parser.add_argument("outputfile", metavar="OUT.ngc", type=str, help='GCode output file, default ${IN%%.dxf}.ngc (with --batch, the output directory; default next to each input)', nargs="?")
+parser.add_argument("--climb", dest="climb", action="store_true", help="Use climb milling instead of conventional (default: conventional)")
+parser.add_argument("--accel", metavar="ACCEL", default=estimate.DEFAULT_PROFILE["accelXY"], type=float, help=("Sets the machine's XY acceleration (mm/s^2) for time estimates; Z gets half. Default " + str(estimate.DEFAULT_PROFILE["accelXY"]) + " mm/s^2"))
+parser.add_argument("--adaptive", metavar="MIN,MAX", nargs="?", const=(adaptive.DEFAULT_MIN_SCALE, adaptive.DEFAULT_MAX_SCALE), default=None, type=feedLimits, help=("Scale the XY feed for each move by how much of the tool is cutting- up for light cuts, down for full-width ones and corners- between MIN and MAX times FEED. Default " + DEFAULT_ADAPTIVE))
+parser.add_argument("--array", metavar="NxM", default=None, type=arraySize, help="Cut N x M copies of the part (N along X, M along Y). The toolpath is only worked out once, and written as a subroutine called at each copy using the G55 work offset (which gets overwritten)")
+parser.add_argument("--batch", dest="batch", action="store_true", help="Process every DXF in a directory (or listed in a file) with a pool of workers")
+parser.add_argument("--no-preview", dest="nopreview", action="store_true", help="Don't open a window showing the toolpaths (needed when there's no display)")
+parser.add_argument("--pipeline", dest="pipelined", action="store_true", help="Write the GCode a region at a time as each one is pocketed (in parallel with -j), instead of after all of them. Output starts sooner and the whole job usually finishes sooner too, but sections are only ordered and linked within their own region. Not with --rest-tool or --array")
+parser.add_argument("--preview", dest="previewfile", metavar="FILE", default=None, type=str, help="Also draw the toolpaths to FILE (.svg or .png)")
+parser.add_argument("--compact", metavar="TOL", nargs="?", const=compact.DEFAULT_TOLERANCE, default=None, type=float, help=("Merge collinear segments and fit arcs to the toolpath, staying within TOL mm of it. Default TOL " + str(compact.DEFAULT_TOLERANCE) + " mm"))
+parser.add_argument("-c","--cutdepth", metavar="DEPTH", default=DEFAULT_CUTDEPTH, type=float, help=("Sets the cut depth of each pass (mm) for machining. Default ToolD/10 mm"))
+parser.add_argument("-j","--jobs", metavar="N", default=DEFAULT_JOBS, type=int, help=("Sets the number of worker processes used for combining areas and generating toolpaths (with --batch, the number of files processed at once). Default " + str(DEFAULT_JOBS) + " (with --batch, " + str(batch.DEFAULT_WORKERS) + ")"))
+parser.add_argument("--cache-dir", dest="cachedir", metavar="DIR", default=toolpathcache.DEFAULT_CACHE_DIR, type=str, help=("Sets the directory used to cache toolpaths between runs. Default " + toolpathcache.DEFAULT_CACHE_DIR))
+parser.add_argument("--cache-size", dest="cachesize", metavar="MB", default=toolpathcache.DEFAULT_CACHE_SIZE / (1024 * 1024), type=float, help=("Sets the maximum size of the toolpath cache (MB). Default " + str(toolpathcache.DEFAULT_CACHE_SIZE / (1024 * 1024)) + " MB"))
+parser.add_argument("--no-cache", dest="nocache", action="store_true", help=("Don't read or write the toolpath cache, or the parsed-geometry sidecar (IN.dxf" + dxf.SIDECAR_SUFFIX + ") next to the DXF"))
+parser.add_argument("--entities", metavar="TYPES", default=None, type=nameList, help="Only read these DXF entity types (comma-separated, eg LINE,ARC,LWPOLYLINE). Default all that can be read")
+parser.add_argument("--exclude-layers", dest="excludelayers", metavar="NAMES", default=None, type=nameList, help="Don't read these DXF layers (comma-separated), eg dimensions or a title block")
+parser.add_argument("-f","--feed", metavar="FEED", default=DEFAULT_FEED, type=float, help=("Sets the feed rate (mm/min) for machining in the XY plane. Default " + str(DEFAULT_FEED) + " mm/min"))
+#parser.add_argument("--helix", dest="helix", action="store_true", help="Enable helical plunging (EXPERIMENTAL) (default: straight plunge)")
+parser.add_argument("--pitch", metavar="DX,DY", default=None, type=arrayPitch, help="With --array, the distance (mm) between copies along X and Y. Default the part's size plus the tool diameter")
+parser.add_argument("--profile", metavar="FILE", default=None, type=str, help="Run under cProfile and write the profile to FILE (view it with pstats). With --batch, only covers the main process")
+parser.add_argument("--order-time", dest="ordertime", metavar="SECONDS", default=ordering.DEFAULT_TIME_BUDGET, type=float, help=("Sets how long to spend ordering sections to minimize rapid travel; 0 disables. Default " + str(ordering.DEFAULT_TIME_BUDGET) + " s"))
+parser.add_argument("--layers", metavar="NAMES", default=None, type=nameList, help="Only read these DXF layers (comma-separated). Default all of them")
+parser.add_argument("--link", dest="link", action="store_true", help="Stay down between cuts in the same pocket when the move stays inside it, and only retract to the clearance height otherwise (default: retract to ZSafe between sections)")
+parser.add_argument("--rapid", metavar="FEED", default=estimate.DEFAULT_PROFILE["rapidXY"], type=float, help=("Sets the machine's XY rapid rate (mm/min) for time estimates; Z gets 40%%. Default " + str(estimate.DEFAULT_PROFILE["rapidXY"]) + " mm/min"))
+parser.add_argument("--rest-tool", dest="resttool", metavar="DIA", default=None, type=float, help="After pocketing, clean up the corners and gaps the tool couldn't reach with a smaller tool of diameter DIA (mm), in the same program after a tool change")
+parser.add_argument("--rest-stepover", dest="reststepover", metavar="STEP", default=None, type=float, help="Sets the stepover (mm) for the rest tool. Default its diameter/2")
+parser.add_argument("--rest-feed", dest="restfeed", metavar="FEED", default=None, type=float, help="Sets the XY feed rate (mm/min) for the rest tool. Default FEED")
+parser.add_argument("--rest-rpm", dest="restrpm", metavar="RPM", default=None, type=int, help="Sets the spindle speed (RPM) for the rest tool. Default RPM")
+parser.add_argument("--save-toolpath", dest="savetoolpath", metavar="FILE", default=None, type=str, help="Also save the finished toolpath to FILE, so repost.py can turn it into GCode again with different feeds, speeds or depths without redoing the geometry (not with --batch or --watch)")
+parser.add_argument("--simplify", metavar="TOL", nargs="?", const=compact.DEFAULT_TOLERANCE, default=None, type=float, help=("Clean up the DXF's outlines before using them: drop duplicate points and tiny segments, fit arcs to flattened curves and thin out the rest, staying within TOL mm of the original. Default TOL " + str(compact.DEFAULT_TOLERANCE) + " mm"))
+parser.add_argument("--simulate", metavar="RES", nargs="?", const=simulate.DEFAULT_RESOLUTION, default=None, type=float, help=("Check the program on a heightmap of the stock with cells RES mm across: reports gouges, air cuts, rapids through material and material left behind (needs NumPy). Default RES " + str(simulate.DEFAULT_RESOLUTION) + " mm"))
+parser.add_argument("-s","--stepover", metavar="STEP", default=DEFAULT_STEPOVER, type=float, help=("Sets how much lateral material is removed per pass (mm). Default ToolD/2 mm"))
+parser.add_argument("--stats-json", dest="statsjson", metavar="FILE", default=None, type=str, help="Write per-stage timings, curve/vertex counts and peak memory use to FILE as JSON (with --batch, one entry per input file)")
+parser.add_argument("--summary", metavar="FILE", default=None, type=str, help="With --batch, write a JSON summary of every file to FILE. Default summary.json in the output directory")
+parser.add_argument("--trim-air", dest="trimair", action="store_true", help="With --simulate, turn the air cuts it finds into rapids")
+parser.add_argument("-t","--toold", metavar="DIA", default=DEFAULT_TOOLD, type=float, help=("Sets the tool diameter (mm). Default " + str(DEFAULT_TOOLD) + " mm"))
+parser.add_argument("--watch", metavar="SECONDS", nargs="?", const=watch.DEFAULT_INTERVAL, default=None, type=float, help=("Keep running, and regenerate the GCode whenever the DXF changes (checking every SECONDS), recomputing only the regions that changed. Default " + str(watch.DEFAULT_INTERVAL) + " s"))
+parser.add_argument("-w","--rpm", metavar="RPM", default=DEFAULT_RPM, type=int, help=("Sets the spindle angular velocity (RPM). Default " + str(DEFAULT_RPM) + " RPM"))
+parser.add_argument("--zmin", metavar="HEIGHT", default=DEFAULT_ZMIN, type=float, help=("Sets the height (mm) of the bottom of the pocket. Default " + str(DEFAULT_ZMIN) + " mm"))
+parser.add_argument("--zmax", metavar="HEIGHT", default=DEFAULT_ZMAX, type=float, help=("Sets the height (mm) of the top of the stock. Default " + str(DEFAULT_ZMAX) + " mm"))
+parser.add_argument("--zclear", metavar="HEIGHT", default=None, type=float, help=("Sets the height (mm) for short moves between cuts. Default zmax + " + str(DEFAULT_CLEARANCE) + " mm"))
+parser.add_argument("-z","--zsafe", metavar="HEIGHT", default=DEFAULT_ZSAFE, type=float, help=("Sets the safe height (mm) for rapid travel. Default " + str(DEFAULT_ZSAFE) + " mm"))
 
 
-def lmouse_callback(event):
-	print "YAY!"
+#Turns parsed arguments into keyword arguments for pipeline.Job
+def jobOptions(args):
+	return {
+		"toold": args.toold,
+		"stepover": args.stepover,
+		"cutdepth": args.cutdepth,
+		"feed": args.feed,
+		"rpm": args.rpm,
+		"zsafe": args.zsafe,
+		"zmin": args.zmin,
+		"zmax": args.zmax,
+		"zclear": args.zclear,
+		"climb": args.climb,
+		"link": args.link,
+		"jobs": args.jobs,
+		"cache": not args.nocache,
+		"cachedir": args.cachedir,
+		"cachesize": int(args.cachesize * 1024 * 1024),
+		"ordertime": args.ordertime,
+		"compact": args.compact,
+		"adaptive": args.adaptive,
+		"resttool": args.resttool,
+		"reststepover": args.reststepover,
+		"restfeed": args.restfeed,
+		"restrpm": args.restrpm,
+		"simulate": args.simulate,
+		"trimair": args.trimair,
+		"array": args.array,
+		"pipelined": args.pipelined,
+		"layers": args.layers,
+		"excludelayers": args.excludelayers,
+		"entities": args.entities,
+		"simplify": args.simplify,
+		"pitch": args.pitch,
+		"collectstats": args.statsjson != None,
+		"machine": {"accelXY": args.accel, "accelZ": args.accel / 2., "rapidXY": args.rapid, "rapidZ": args.rapid * 0.4},
+	}
+
+
+#Processes a whole directory/manifest of DXFs
+def runBatch(args):
+	inputs = batch.findInputs(args.inputfile)
+	if len(inputs) == 0:
+		raise pipeline.DannyCamError("No DXF files found in " + args.inputfile)
 	
-def rmouse_callback(event):
-	print "BOO!"
-
-root = Tk()
-canvas = Canvas(root, width=screenW, height=screenH)
-canvas.pack()
-canvas.bind("<Button-1>", lmouse_callback);
-canvas.bind("<Button-3>", rmouse_callback);
-
-
-#Processes the segments of a curve and renders them to the screen
-#Also handles arcs
-#This has nothing to do with generating GCode
-def addLine(curve, scale=1.0):
-	lastx = 0
-	lasty = 0
-	verts = curve.getVertices();
-	lastx = verts[0].p.x * scale
-	lasty = verts[0].p.y * scale
-	i = 1;
-	while i < len(verts):
-		cx = verts[i].p.x * scale
-		cy = verts[i].p.y * scale
-		#Lines are easy- point to point
-		if verts[i].type == 0:
-			canvas.create_line(lastx, lasty, cx, cy)
-		#Arcs are a pain- find the center+radius, calculate end points, ...
-		#The directions, addition vs subtraction, start vs end points, etc. were largely trial-and-error to get right
-		#They may well be done in a logically-correct, but humanl-readably-awful manner
-		#1 is CCW, -1 is CW
-		elif verts[i].type == 1 or verts[i].type == -1:
-			centerx = verts[i].c.x * scale
-			centery = verts[i].c.y * scale
-			radius = math.sqrt((centerx - cx)**2 + (centery - cy)**2)
-			dy = cy - centery;
-			dx = cx - centerx;
-			endangle = math.atan2(-dy, dx) * 180 / math.pi
-			dy = lasty - centery;
-			dx = lastx - centerx;
-			startangle = math.atan2(-dy, dx) * 180 / math.pi
-			#print "Radius: " + str(radius) + "\tStart: " + str(startangle) + "\tStop: " + str(endangle) + "\tCenter: " + str(centerx) + "," + str(centery)
-			#wedgestyle = PIESLICE
-			wedgestyle = ARC
-			extent = endangle - startangle;
-			#print "Calculated extent: " + str(extent)
-			if extent < 0:
-				extent = startangle - endangle
-			#CCW
-			if verts[i].type == 1:
-				if startangle > endangle:
-					canvas.create_arc(centerx - radius, centery-radius, centerx+radius, centery+radius, start=endangle, extent=extent, style = wedgestyle)
-				else:
-					canvas.create_arc(centerx - radius, centery-radius, centerx+radius, centery+radius, start=endangle, extent=360-extent, style = wedgestyle)
-			#CW
-			else:
-				#print "WARNING: Clockwise arc detected! This is only loosely tested!"
-				if startangle > endangle:
-					canvas.create_arc(centerx - radius, centery-radius, centerx+radius, centery+radius, start=startangle, extent=360-extent, style = wedgestyle)
-				else:
-					canvas.create_arc(centerx - radius, centery-radius, centerx+radius, centery+radius, start=startangle, extent=extent, style = wedgestyle)
+	workers = args.jobs
+	if workers == DEFAULT_JOBS:
+		workers = batch.DEFAULT_WORKERS
+	print "Processing " + str(len(inputs)) + " file(s) with " + str(workers) + " worker(s)"
+	
+	results = []
+	failures = 0
+	for result in batch.runBatch(inputs, args.outputfile, jobOptions(args), workers):
+		results.append(result)
+		if "error" in result:
+			failures += 1
+			print "FAILED: " + result["input"] + ": " + result["error"]
 		else:
-			print "Invalid vertex type " + str(verts[i].type) + " found in vertex " + str(i)
-			exit(-1)
-		lastx = cx
-		lasty = cy
-		i += 1
-
-
-
-
-
-if not os.path.isfile(inputfile):
-	print "Couldn't open file \"" + inputfile + "\""
-	exit(-1)
-
-#set_units doesn't actually seem to do anything
-#area.set_units(1)
-newarea = area.AreaFromDxf(inputfile)
-
-#This makes sure curves are set up for climb milling
-newarea.Reorder();
-
-#One area for each polygon
-areas = newarea.Split();
-
-if len(areas) == 0:
-	print "No areas in DXF file"
-	exit(-1)
-
-print "Split read DXF into " + str(len(areas)) + " section(s). Performing XOR operations"
-
-
-#XOR all of the sub-areas. Kind of hack-y, but should give a good approximation
-#of what was intended with the DXF
-if(len(areas) > 1):
-	j = 1;
-	count = len(areas)
-	while j < count:
-		#Flush the buffer so we know something is happening without waiting for newline
-		print str(j) + " / " + str(count - 1)
-		sys.stdout.flush()
-		if type(areas[j]) == None:
-			print "NoneType... continue!"
-			continue
-		
-		#First add to the existing area
-		union = deepcopy_area(areas[j])
-		union.Union(areas[0])
-		#print "Len union: " + str(len(union.getCurves()))
-		
-		#Calculate parts to subtract, if any
-		intersect = deepcopy_area(areas[j])
-		intersect.Intersect(areas[0])
-		#print "Len intersect: " + str(len(intersect.getCurves()))
-		
-		#If there's something we should cut out, do it
-		if len(intersect.getCurves()) > 0:
-			union.Subtract(intersect)
-		
-		areas[0] = union
-		
-		j += 1
-
-
-#Returns a list of curves that form the pocket. Args:
-#	cutter radius- mm
-#	extra material- mm?
-#	stepover- mm
-#	from center (bool)- doesn't seem to do anything
-#	pocket mode (bool?) (true = zig_zag, false=spiral)
-#	zig angle
-#Each part of the returned list is a disjoint chunk of the path
-#The first element in the array is the one we XOR'd everything with to get the final result
-
-print "Generating toolpaths"
-
-curvelist = areas[0].MakePocketToolpath(toold/2., 0.0, stepover, False, False, 0.0)
-
-#Make sure curves go in the direction we want
-#We're either cutting full-width slots OR reducing profiles- thus CLOCKWISE
-#is CLIMB milling, and COUNTERCLOCKWISE is CONVENTIONAL milling
-for c in curvelist:
-	if(climb):
-		if not c.IsClockwise():
-			c.Reverse()
-	else:
-		if c.IsClockwise():
-			c.Reverse()
-
-#print type(curvelist[0])
-print "Found " + str(len(curvelist)) + " discrete section(s) to machine"
-
-
-pathlength = 0
-
-#Calculates the total length of all segments in the curve
-def sumLength(curve):
-	length = 0
-	for span in curve.GetSpans():
-		length += span.Length()
-	return length
-
-for p in curvelist:
-	#print "Curvelist iteration"
-	addLine(p,2)
-	pathlength += sumLength(p)
-
-
-
-#Generate actual gcode listing
-print "Generating gcode"
-#def generate(curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm):
-cmds = gcode.generate(curvelist, zsafe, 0, 0.5, 1, feed, 50, toold, stepover, rpm)
-
-#Write it out to a file
-print "Writing file"
-fout.write(cmds)
-fout.close()
-
-
-
-#Print out some useful information about the job
-minutes = pathlength / feed
-hours = int(minutes) / 60
-minutes -= hours * 60
-
-print ""
-print "Total path length: " + str("%.2f" % pathlength) + "mm\tCut time at " + str(feed) + "mm/min is " + str("%.2f" % (pathlength/feed)) + " min (" + str(hours) + "h " + str(int(minutes+0.5)) + "m)"
-box = area.Box()
-newarea.GetBox(box);
-print "Bounding box: " + str("%.2f" % (box.MaxX() - box.MinX())) + " x " + str("%.2f" % (box.MaxY() - box.MinY())) + "mm, LL corner at (" + str("%.2f" % box.MinX()) + ", " + str("%.2f" % box.MinY()) + ") mm"
-print ""
-
-
-#Show plot of generated toolpaths
-root.mainloop();
+			print result["input"] + " -> " + result["output"] + " (" + str(result["sections"]) + " section(s), " + estimate.formatTime(result["time"]) + ")"
+	
+	summaryfile = args.summary
+	if summaryfile == None:
+		summaryfile = os.path.join(args.outputfile or os.path.dirname(inputs[0]), "summary.json")
+	batch.writeSummary(results, summaryfile)
+	if args.statsjson != None:
+		batch.writeSummary(dict([(r["input"], r["stats"]) for r in results if "stats" in r]), args.statsjson)
+	print ""
+	print str(len(results) - failures) + " of " + str(len(results)) + " file(s) succeeded; summary written to " + summaryfile
+	return failures == 0
+
+
+#Regenerates the GCode for one DXF every time it changes, until interrupted
+def runWatch(args):
+	watcher = watch.Watcher(args.inputfile, args.outputfile, jobOptions(args), args.watch, args.previewfile)
+	try:
+		watcher.run()
+	except KeyboardInterrupt:
+		print ""
+	return True
+
+
+#Processes one DXF, printing as it goes
+def runSingle(args):
+	job = pipeline.Job(args.inputfile, args.outputfile, savetoolpath=args.savetoolpath, **jobOptions(args))
+	job.run()
+	
+	if job.stats != None:
+		print ""
+		for line in job.stats.report():
+			print line
+		job.stats.write(args.statsjson)
+		print "Stats written to " + args.statsjson
+	
+	#Save a picture of the toolpaths, if asked for
+	if args.previewfile != None:
+		print "Writing preview to " + args.previewfile
+		preview.render(job.curves + (job.restCurves or []), args.previewfile)
+	
+	#Print out some useful information about the job
+	print ""
+	print "Total XY path length (one layer): " + str("%.2f" % job.pathLength()) + "mm"
+	for line in estimate.report(job.times):
+		print line
+	(minx, miny, maxx, maxy) = job.bbox
+	print "Bounding box: " + str("%.2f" % (maxx - minx)) + " x " + str("%.2f" % (maxy - miny)) + "mm, LL corner at (" + str("%.2f" % minx) + ", " + str("%.2f" % miny) + ") mm"
+	print ""
+	
+	#Show plot of generated toolpaths
+	if not args.nopreview:
+		preview.showTk(job.curves + (job.restCurves or []))
+	return True
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	profiler = None
+	if args.profile != None:
+		profiler = cProfile.Profile()
+		profiler.enable()
+	try:
+		if args.batch:
+			ok = runBatch(args)
+		elif args.watch != None:
+			ok = runWatch(args)
+		else:
+			ok = runSingle(args)
+	except pipeline.DannyCamError, e:
+		print "ERROR: " + str(e) + ". Aborting!"
+		ok = False
+	if profiler != None:
+		profiler.disable()
+		profiler.dump_stats(args.profile)
+		print "Profile written to " + args.profile
+	if not ok:
+		exit(-1)
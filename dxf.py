@@ -0,0 +1,453 @@
+#DXF reader
+#libarea's AreaFromDxf reads everything in the file, on every layer-
+#dimensions, title blocks, construction lines- and all of it then goes
+#through Reorder, Split and the XOR loop. This reads the ENTITIES section a
+#group at a time instead, keeps only the layers and entity types asked for,
+#and chains what's left into closed curves (in the list form from
+#areautil), converted to mm from the file's $INSUNITS.
+#Understood: LINE, ARC, CIRCLE, LWPOLYLINE and POLYLINE (2D, with bulges).
+#Annotations (text, dimensions, ...) are left out, since they're never
+#outlines; anything else (SPLINE, ELLIPSE, INSERT, ...) is counted and
+#skipped- see read() for what the caller can do about that.
+#The curves from each DXF are also kept in a binary sidecar file next to it
+#(see loadSidecar), so reading it again doesn't parse any text at all, as
+#long as the DXF hasn't changed.
+
+import os
+import sys
+import math
+import json
+import struct
+import array
+import hashlib
+
+#Entity types we can turn into geometry
+SUPPORTED = ["LINE", "ARC", "CIRCLE", "LWPOLYLINE", "POLYLINE"]
+#Entity types that are never part of the geometry
+ANNOTATIONS = ["TEXT", "MTEXT", "DIMENSION", "LEADER", "MLEADER", "TOLERANCE", "POINT", "HATCH", "ATTDEF", "ATTRIB", "VIEWPORT"]
+
+#mm per unit, by $INSUNITS code. Unitless (0) files are taken to be in mm
+UNITS = {0: 1.0, 1: 25.4, 2: 304.8, 4: 1.0, 5: 10.0, 6: 1000.0, 8: 25.4e-6, 9: 0.0254, 10: 914.4, 14: 100.0}
+
+#Ends closer than this (mm) are joined when chaining
+CHAIN_TOLERANCE = 1e-3
+
+SIDECAR_SUFFIX = ".dcgeom"
+SIDECAR_MAGIC = "DCGEOM\0\0"
+SIDECAR_VERSION = 1
+
+
+#Group code/value pairs from a DXF file, as (int, str)
+def _groups(fin):
+	lines = iter(fin)
+	for code in lines:
+		value = next(lines, "")
+		try:
+			yield (int(code), value.strip())
+		except ValueError:
+			#Blank lines at the end of the file, or something that isn't a
+			#DXF at all
+			return
+
+
+#Segment from (x0, y0) to (x1, y1); t is 0 for a line, 1 for a CCW arc and
+#-1 for CW, around (cx, cy)
+def _segment(x0, y0, x1, y1, t=0, cx=0.0, cy=0.0):
+	return [(0, x0, y0, 0.0, 0.0), (t, x1, y1, cx, cy)]
+
+
+#Arc from p0 to p1 with the given bulge (tan of a quarter of its sweep,
+#positive for CCW), as used by polylines
+def _bulgeSegment(p0, p1, bulge):
+	if abs(bulge) < 1e-12:
+		return _segment(p0[0], p0[1], p1[0], p1[1])
+	(dx, dy) = (p1[0] - p0[0], p1[1] - p0[1])
+	chord = math.hypot(dx, dy)
+	if chord < 1e-12:
+		return None
+	#The center's off the middle of the chord, to the left for CCW
+	d = (1 - bulge * bulge) / (4 * bulge)
+	cx = (p0[0] + p1[0]) / 2. - dy * d
+	cy = (p0[1] + p1[1]) / 2. + dx * d
+	t = 1
+	if bulge < 0:
+		t = -1
+	return _segment(p0[0], p0[1], p1[0], p1[1], t, cx, cy)
+
+
+#Joins polyline points (x, y, bulge) into one curve
+def _polyline(points, closed):
+	if closed and len(points) > 1:
+		points = points + [(points[0][0], points[0][1], 0.0)]
+	verts = None
+	for k in range(1, len(points)):
+		seg = _bulgeSegment(points[k - 1], points[k], points[k - 1][2])
+		if seg == None:
+			continue
+		if verts == None:
+			verts = seg
+		else:
+			verts.append(seg[1])
+	return verts
+
+
+#A full circle, as two half arcs
+def _circle(cx, cy, r):
+	return [(0, cx + r, cy, 0.0, 0.0), (1, cx - r, cy, cx, cy), (1, cx + r, cy, cx, cy)]
+
+
+#Mirrors a curve in X- for entities drawn with their extrusion direction
+#pointing down, whose coordinates are in a flipped frame
+def _mirror(verts):
+	return [(-t, -x, y, -cx, cy) if t != 0 else (0, -x, y, 0.0, 0.0) for (t, x, y, cx, cy) in verts]
+
+
+#Turns one entity's groups into a curve (list form, in drawing units), or
+#None if there's nothing to it
+def _entityCurve(kind, groups, vertices):
+	first = {}
+	for (code, value) in groups:
+		first.setdefault(code, value)
+	num = lambda code, default=0.0: float(first.get(code, default))
+	
+	verts = None
+	if kind == "LINE":
+		if math.hypot(num(11) - num(10), num(21) - num(20)) > 0:
+			verts = _segment(num(10), num(20), num(11), num(21))
+	elif kind == "CIRCLE":
+		if num(40) > 0:
+			verts = _circle(num(10), num(20), num(40))
+	elif kind == "ARC":
+		(cx, cy, r) = (num(10), num(20), num(40))
+		(a0, a1) = (math.radians(num(50)), math.radians(num(51)))
+		if r <= 0:
+			return None
+		if abs((math.degrees(a1 - a0) + 360) % 360) < 1e-9:
+			verts = _circle(cx, cy, r)
+		else:
+			verts = _segment(cx + r * math.cos(a0), cy + r * math.sin(a0), cx + r * math.cos(a1), cy + r * math.sin(a1), 1, cx, cy)
+	elif kind == "LWPOLYLINE":
+		points = []
+		for (code, value) in groups:
+			if code == 10:
+				points.append([float(value), 0.0, 0.0])
+			elif code == 20 and points:
+				points[-1][1] = float(value)
+			elif code == 42 and points:
+				points[-1][2] = float(value)
+		verts = _polyline(points, int(num(70, 0)) & 1)
+	elif kind == "POLYLINE":
+		#3D meshes and polyface meshes aren't outlines
+		flags = int(num(70, 0))
+		if flags & (16 | 64):
+			return None
+		verts = _polyline(vertices, flags & 1)
+	
+	if verts != None and num(230, 1) < 0:
+		verts = _mirror(verts)
+	return verts
+
+
+#Reverses the list form of a curve
+def _reverse(verts):
+	out = [(0, verts[-1][1], verts[-1][2], 0.0, 0.0)]
+	for k in range(len(verts) - 1, 0, -1):
+		(t, x, y, cx, cy) = verts[k]
+		out.append((-t, verts[k - 1][1], verts[k - 1][2], cx, cy))
+	return out
+
+
+def _closed(verts, tol):
+	return len(verts) > 2 and math.hypot(verts[-1][1] - verts[0][1], verts[-1][2] - verts[0][2]) <= tol
+
+
+#Chains pieces (open curves, in list form) end to end into closed curves
+#Returns (closed curves, number of chains left open)
+def chain(pieces, tol=CHAIN_TOLERANCE):
+	#Ends are looked up in a grid of cells tol across, so only nearby ones
+	#are ever compared
+	grid = {}
+	def cell(x, y):
+		return (int(math.floor(x / tol)), int(math.floor(y / tol)))
+	def add(k, end):
+		(x, y) = end
+		grid.setdefault(cell(x, y), []).append(k)
+	for (k, verts) in enumerate(pieces):
+		add(k, verts[0][1:3])
+		add(k, verts[-1][1:3])
+	used = [False] * len(pieces)
+	
+	#Finds an unused piece with an end at (x, y); returns it oriented to
+	#start there, or None
+	def take(x, y):
+		(i, j) = cell(x, y)
+		for di in (-1, 0, 1):
+			for dj in (-1, 0, 1):
+				for k in grid.get((i + di, j + dj), []):
+					if used[k]:
+						continue
+					verts = pieces[k]
+					if math.hypot(verts[0][1] - x, verts[0][2] - y) <= tol:
+						used[k] = True
+						return verts
+					if math.hypot(verts[-1][1] - x, verts[-1][2] - y) <= tol:
+						used[k] = True
+						return _reverse(verts)
+		return None
+	
+	curves = []
+	unclosed = 0
+	for k in range(len(pieces)):
+		if used[k]:
+			continue
+		used[k] = True
+		verts = list(pieces[k])
+		while not _closed(verts, tol):
+			nextPiece = take(verts[-1][1], verts[-1][2])
+			if nextPiece == None:
+				break
+			verts += nextPiece[1:]
+		if _closed(verts, tol):
+			#Make it exactly closed
+			(t, x, y, cx, cy) = verts[-1]
+			verts[-1] = (t, verts[0][1], verts[0][2], cx, cy)
+			curves.append(verts)
+		else:
+			unclosed += 1
+	return (curves, unclosed)
+
+
+#Reads a DXF's closed outlines
+#layers: names of the layers to keep (None: all of them); excludeLayers:
+#layers to leave out; types: entity types to keep (None: all of SUPPORTED).
+#Layer and type names are case-insensitive
+#Returns (curves, info): curves are in the list form, in mm; info is a dict
+#	units: mm per drawing unit
+#	layers: every layer that had an entity on it
+#	kept: number of entities used, by type
+#	filtered: number left out by layers/excludeLayers/types
+#	unsupported: number of entities of types we can't read, by type
+#	open: number of chains that didn't close (and were left out)
+#Raises ValueError, saying where, if a number in it can't be read (eg, a
+#file that's only half saved)
+def read(path, layers=None, excludeLayers=None, types=None):
+	layers = _names(layers)
+	excludeLayers = _names(excludeLayers) or []
+	types = _names(types)
+	info = {"units": 1.0, "layers": set(), "kept": {}, "filtered": 0, "unsupported": {}, "open": 0}
+	closed = []
+	pieces = []
+	
+	def entity(kind, groups, vertices):
+		if kind in ("VERTEX", "SEQEND", "EOF", "ENDSEC"):
+			return
+		layer = "0"
+		for (code, value) in groups:
+			if code == 8:
+				layer = value.upper()
+				break
+		info["layers"].add(layer)
+		if (layers != None and layer not in layers) or layer in excludeLayers or (types != None and kind not in types):
+			info["filtered"] += 1
+			return
+		if kind in ANNOTATIONS:
+			return
+		if kind not in SUPPORTED:
+			info["unsupported"][kind] = info["unsupported"].get(kind, 0) + 1
+			return
+		verts = _entityCurve(kind, groups, vertices)
+		if verts == None:
+			return
+		info["kept"][kind] = info["kept"].get(kind, 0) + 1
+		if _closed(verts, 0):
+			closed.append(verts)
+		else:
+			pieces.append(verts)
+	
+	fin = open(path, "rU")
+	try:
+		section = None
+		#The entity being read: its type and groups; a POLYLINE also
+		#collects its VERTEX entities' points
+		kind = None
+		groups = []
+		polyline = None
+		expect = None
+		for (n, (code, value)) in enumerate(_groups(fin)):
+			#Each group is two lines, so this one's code is on line 2n + 1
+			try:
+				if code == 0:
+					if kind == "VERTEX" and polyline != None:
+						_addVertex(polyline, groups)
+					elif kind == "POLYLINE":
+						polyline = (groups, [])
+					elif kind == "SEQEND" and polyline != None:
+						entity("POLYLINE", polyline[0], polyline[1])
+						polyline = None
+					elif kind != None and section == "ENTITIES":
+						entity(kind, groups, None)
+					(kind, groups) = (value.upper(), [])
+					if kind == "ENDSEC":
+						(section, kind) = (None, None)
+					elif kind == "SECTION":
+						(section, kind) = ("?", None)
+					elif section != "ENTITIES":
+						kind = None
+					continue
+				if section == "?" and code == 2:
+					section = value.upper()
+				elif section == "HEADER":
+					if code == 9:
+						expect = value.upper()
+					elif expect == "$INSUNITS" and code == 70:
+						info["units"] = UNITS.get(int(value), 1.0)
+				elif kind != None:
+					groups.append((code, value))
+			except ValueError, e:
+				#Entities are only turned into geometry once the next one
+				#starts, so that's where the line number points
+				where = "at line " + str(2 * n + 1)
+				if code == 0 and kind != None:
+					where = "in the " + kind + " ending at line " + str(2 * n + 1)
+				raise ValueError("Malformed DXF " + path + " (" + where + "): " + str(e))
+	finally:
+		fin.close()
+	
+	(chained, info["open"]) = chain(pieces, CHAIN_TOLERANCE / info["units"])
+	scale = info["units"]
+	curves = closed + chained
+	if scale != 1.0:
+		curves = [[(t, x * scale, y * scale, cx * scale, cy * scale) for (t, x, y, cx, cy) in verts] for verts in curves]
+	info["layers"] = sorted(info["layers"])
+	return (curves, info)
+
+
+def _addVertex(polyline, groups):
+	first = {}
+	for (code, value) in groups:
+		first.setdefault(code, value)
+	#Spline frame control points aren't on the outline
+	if int(float(first.get(70, 0))) & 16:
+		return
+	polyline[1].append((float(first.get(10, 0)), float(first.get(20, 0)), float(first.get(42, 0))))
+
+
+#Layer or type names, normalized and sorted; None stays None
+def _names(names):
+	if names == None:
+		return None
+	return sorted(set([n.strip().upper() for n in names]))
+
+
+#Hash of a file's contents
+def fileHash(path):
+	h = hashlib.sha1()
+	fin = open(path, "rb")
+	try:
+		while True:
+			block = fin.read(1 << 20)
+			if not block:
+				break
+			h.update(block)
+	finally:
+		fin.close()
+	return h.hexdigest()
+
+
+def sidecarPath(path):
+	return path + SIDECAR_SUFFIX
+
+
+#Saves what read() returned to a sidecar next to the DXF. The header says
+#which version of the DXF (size, mtime, hash) and which filters it's for;
+#the curves follow as raw arrays- vertex counts, types and coordinates
+#(x, y, cx, cy)- in this machine's byte order
+#Failing to write it isn't an error; it just won't be there next time
+def saveSidecar(path, filters, curves, info, digest=None):
+	st = os.stat(path)
+	counts = array.array("i", [len(verts) for verts in curves])
+	types = array.array("b", [v[0] for verts in curves for v in verts])
+	coords = array.array("d", [c for verts in curves for v in verts for c in v[1:]])
+	header = {
+		"version": SIDECAR_VERSION,
+		"byteorder": sys.byteorder,
+		"size": st.st_size,
+		"mtime": st.st_mtime,
+		"hash": digest or fileHash(path),
+		"filters": filters,
+		"info": info,
+		"lengths": [len(counts), len(types), len(coords)],
+	}
+	text = json.dumps(header)
+	try:
+		fout = open(sidecarPath(path), "wb")
+		try:
+			fout.write(SIDECAR_MAGIC)
+			fout.write(struct.pack("<I", len(text)))
+			fout.write(text)
+			for a in (counts, types, coords):
+				a.tofile(fout)
+		finally:
+			fout.close()
+	except (IOError, OSError):
+		pass
+
+
+#Loads a DXF's curves from its sidecar, if there is one for this version of
+#the file and these filters. A sidecar whose size and mtime match is taken
+#as it is; otherwise, it's still used if the file's contents hash the same
+#(eg, the file was only touched), and refreshed
+#Returns (curves, info) like read(), or None
+def loadSidecar(path, filters):
+	try:
+		fin = open(sidecarPath(path), "rb")
+	except IOError:
+		return None
+	try:
+		if fin.read(len(SIDECAR_MAGIC)) != SIDECAR_MAGIC:
+			return None
+		(length,) = struct.unpack("<I", fin.read(4))
+		header = json.loads(fin.read(length))
+		if header.get("version") != SIDECAR_VERSION or header.get("byteorder") != sys.byteorder or header.get("filters") != filters:
+			return None
+		st = os.stat(path)
+		refresh = False
+		if header["size"] != st.st_size or header["mtime"] != st.st_mtime:
+			if header["size"] != st.st_size or header["hash"] != fileHash(path):
+				return None
+			refresh = True
+		arrays = []
+		for (code, n) in zip(("i", "b", "d"), header["lengths"]):
+			a = array.array(code)
+			a.fromfile(fin, n)
+			arrays.append(a)
+	except (IOError, OSError, EOFError, ValueError, KeyError, struct.error):
+		return None
+	finally:
+		fin.close()
+	
+	(counts, types, coords) = arrays
+	curves = []
+	k = 0
+	for n in counts:
+		curves.append([(types[j], coords[4 * j], coords[4 * j + 1], coords[4 * j + 2], coords[4 * j + 3]) for j in xrange(k, k + n)])
+		k += n
+	info = header["info"]
+	if refresh:
+		saveSidecar(path, filters, curves, info, header["hash"])
+	return (curves, info)
+
+
+#read(), going through the sidecar: loaded from it if it's up to date,
+#otherwise read and saved to it (if cache)
+#Returns (curves, info, True if it came from the sidecar)
+def readCached(path, layers=None, excludeLayers=None, types=None, cache=True):
+	filters = [_names(layers), _names(excludeLayers), _names(types)]
+	if cache:
+		loaded = loadSidecar(path, filters)
+		if loaded != None:
+			return (loaded[0], loaded[1], True)
+	(curves, info) = read(path, layers, excludeLayers, types)
+	if cache:
+		saveSidecar(path, filters, curves, info)
+	return (curves, info, False)
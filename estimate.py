@@ -0,0 +1,324 @@
+#Cycle time estimation
+#Walks a GCode program (as written by gcode.py) and works out how long a
+#machine with limited acceleration actually takes to run it, instead of just
+#dividing path length by feed rate. Each move gets a trapezoidal velocity
+#profile; the speed carried through a corner is limited the same way most
+#controllers do it (junction deviation), arcs are limited by centripetal
+#acceleration, and short moves that never reach the programmed feed are
+#accounted for. Jerk, if given, is approximated by a fixed penalty per
+#acceleration phase.
+#Everything is in mm; speeds in the profile are mm/min (like F words),
+#accelerations mm/s^2 and jerk mm/s^3. Times come out in seconds.
+
+import math
+import re
+
+#A middle-of-the-road hobby router
+DEFAULT_PROFILE = {
+	"rapidXY": 5000.0,
+	"rapidZ": 2000.0,
+	"accelXY": 500.0,
+	"accelZ": 250.0,
+	"jerk": 0.0,
+	"junctionDeviation": 0.01,
+}
+
+#Move types, as reported in the breakdown
+moveRapid = "rapid"
+moveFeed = "feed"
+movePlunge = "plunge"
+moveRamp = "ramp"
+moveArc = "arc"
+moveHelix = "helix"
+
+_wordRe = re.compile(r"([A-Z])\s*([-+]?[0-9]*\.?[0-9]+)")
+_sectionRe = re.compile(r"\(Section ([0-9]+)")
+_commentRe = re.compile(r"\([^)]*\)")
+
+_subRe = re.compile(r"^O([0-9]+)\s+(SUB|ENDSUB|CALL)\b")
+_placementRe = re.compile(r"^G10\s*L2\s*P2\s*X\[#5221([-+][0-9.]+)\]\s*Y\[#5222([-+][0-9.]+)\]")
+_axisRe = re.compile(r"([XY])\s*([-+]?[0-9]*\.?[0-9]+)")
+
+_eps = 1e-9
+
+
+#Fills in anything missing from a profile with the defaults
+def makeProfile(profile=None):
+	p = dict(DEFAULT_PROFILE)
+	if profile != None:
+		p.update(profile)
+	return p
+
+
+def _unit(dx, dy, dz):
+	l = math.sqrt(dx*dx + dy*dy + dz*dz)
+	if l < _eps:
+		return (0.0, 0.0, 0.0)
+	return (dx / l, dy / l, dz / l)
+
+
+#The fastest speed (mm/s) and acceleration (mm/s^2) along direction u,
+#given per-axis limits
+def _axisLimit(u, xy, z):
+	lxy = math.hypot(u[0], u[1])
+	lim = float("inf")
+	if lxy > _eps:
+		lim = xy / lxy
+	if abs(u[2]) > _eps:
+		lim = min(lim, z / abs(u[2]))
+	return lim
+
+
+#Turns GCode lines into a list of moves:
+#	[type, section, length, max speed, accel, entry direction, exit direction]
+#Directions are unit vectors; speeds mm/s
+def parseMoves(lines, profile=None):
+	p = makeProfile(profile)
+	rapidXY = p["rapidXY"] / 60.
+	rapidZ = p["rapidZ"] / 60.
+	
+	moves = []
+	pos = [None, None, None]
+	mode = 0
+	#Until there's been an F word, feed moves are only held back by the axes
+	feedLimit = float("inf")
+	section = None
+	for line in lines:
+		m = _sectionRe.search(line)
+		if m:
+			section = int(m.group(1))
+		line = _commentRe.sub("", line.upper())
+		words = _wordRe.findall(line)
+		if not words:
+			continue
+		
+		target = list(pos)
+		offset = [0.0, 0.0]
+		moved = False
+		for (letter, value) in words:
+			v = float(value)
+			if letter == "G":
+				if v in (0, 1, 2, 3):
+					mode = int(v)
+			elif letter == "F":
+				feedLimit = v / 60.
+			elif letter in "XYZ":
+				target["XYZ".index(letter)] = v
+				moved = True
+			elif letter == "I":
+				offset[0] = v
+			elif letter == "J":
+				offset[1] = v
+		if not moved:
+			continue
+		
+		#The first time we hear about an axis, we don't know where it
+		#was- treat it as not having moved
+		start = [pos[k] if pos[k] != None else target[k] for k in range(3)]
+		pos = target
+		(dx, dy, dz) = [target[k] - start[k] if target[k] != None else 0.0 for k in range(3)]
+		
+		if mode == 2 or mode == 3:
+			(cx, cy) = (start[0] + offset[0], start[1] + offset[1])
+			r = math.hypot(start[0] - cx, start[1] - cy)
+			a0 = math.atan2(start[1] - cy, start[0] - cx)
+			a1 = math.atan2(target[1] - cy, target[0] - cx)
+			sweep = a1 - a0
+			#Start == end is a full circle
+			if mode == 3:
+				if sweep <= _eps:
+					sweep += 2 * math.pi
+			else:
+				if sweep >= -_eps:
+					sweep -= 2 * math.pi
+			arcLen = abs(sweep) * r
+			length = math.hypot(arcLen, dz)
+			if length < _eps:
+				continue
+			#Tangents at either end
+			sgn = 1 if mode == 3 else -1
+			kz = dz / length
+			kxy = arcLen / length
+			uIn = (-sgn * math.sin(a0) * kxy, sgn * math.cos(a0) * kxy, kz)
+			uOut = (-sgn * math.sin(a1) * kxy, sgn * math.cos(a1) * kxy, kz)
+			vmax = min(feedLimit, _axisLimit(uIn, rapidXY, rapidZ))
+			accel = _axisLimit(uIn, p["accelXY"], p["accelZ"])
+			#Centripetal acceleration
+			if r > _eps:
+				vmax = min(vmax, math.sqrt(accel * r))
+			kind = moveHelix if abs(dz) > _eps else moveArc
+		else:
+			length = math.sqrt(dx*dx + dy*dy + dz*dz)
+			if length < _eps:
+				continue
+			uIn = uOut = _unit(dx, dy, dz)
+			accel = _axisLimit(uIn, p["accelXY"], p["accelZ"])
+			vmax = _axisLimit(uIn, rapidXY, rapidZ)
+			if mode == 0:
+				kind = moveRapid
+			else:
+				vmax = min(vmax, feedLimit)
+				if abs(dz) < _eps:
+					kind = moveFeed
+				elif abs(dx) < _eps and abs(dy) < _eps:
+					kind = movePlunge
+				else:
+					kind = moveRamp
+		moves.append([kind, section, length, vmax, accel, uIn, uOut])
+	return moves
+
+
+#Fastest speed the tool can carry from move a into move b
+def _junctionSpeed(a, b, deviation):
+	#Never blend between rapids and cutting moves
+	if (a[0] == moveRapid) != (b[0] == moveRapid):
+		return 0.0
+	u = a[6]
+	w = b[5]
+	cosTheta = -(u[0]*w[0] + u[1]*w[1] + u[2]*w[2])
+	if cosTheta > 0.999999:
+		#Reversing direction
+		return 0.0
+	if cosTheta < -0.999999:
+		#Straight through
+		return float("inf")
+	sinHalf = math.sqrt(0.5 * (1.0 - cosTheta))
+	accel = min(a[4], b[4])
+	return math.sqrt(accel * deviation * sinHalf / (1.0 - sinHalf))
+
+
+#Extra time S-curve acceleration takes over a straight ramp for a change in
+#speed of dv
+def _jerkPenalty(dv, accel, jerk):
+	if jerk <= 0 or dv <= _eps:
+		return 0.0
+	if dv >= accel * accel / jerk:
+		return accel / jerk
+	return 2 * math.sqrt(dv / jerk) - dv / accel
+
+
+#Time for one move with a trapezoidal profile from v0 to v1
+def _moveTime(length, v0, v1, vmax, accel, jerk):
+	d1 = (vmax*vmax - v0*v0) / (2 * accel)
+	d3 = (vmax*vmax - v1*v1) / (2 * accel)
+	if d1 + d3 <= length:
+		peak = vmax
+		t = (vmax - v0) / accel + (vmax - v1) / accel + (length - d1 - d3) / vmax
+	else:
+		#Never gets to full speed
+		peak = math.sqrt(max((2 * accel * length + v0*v0 + v1*v1) / 2., 0.0))
+		t = (peak - v0) / accel + (peak - v1) / accel
+	return t + _jerkPenalty(peak - v0, accel, jerk) + _jerkPenalty(peak - v1, accel, jerk)
+
+
+#Inlines the subroutine calls in a program for an array of copies (see
+#gcode.arrayToFile), so every copy gets counted: each call is replaced with
+#the subroutine's lines, with X and Y moved to wherever its G55 offset says.
+#Only the forms gcode.py writes are understood; anything else goes through
+#as it is
+def expandCalls(lines):
+	subs = {}
+	body = None
+	offset = (0.0, 0.0)
+	shift = None
+	for line in lines:
+		if line[:1] in "oO":
+			m = _subRe.match(line.upper())
+			if m:
+				(n, word) = m.groups()
+				if word == "SUB":
+					body = subs[n] = []
+				elif word == "ENDSUB":
+					body = None
+				elif n in subs:
+					for l in subs[n]:
+						if shift != None and l[:1] != "(":
+							l = _axisRe.sub(lambda w: w.group(1) + repr(float(w.group(2)) + shift["XY".index(w.group(1))]), l)
+						yield l
+				continue
+		if body != None:
+			body.append(line)
+			continue
+		if line.startswith("G10"):
+			m = _placementRe.match(line)
+			if m:
+				offset = (float(m.group(1)), float(m.group(2)))
+				continue
+		elif line.startswith("G55"):
+			shift = offset
+		elif line.startswith("G54"):
+			shift = None
+		yield line
+
+
+#Times a list of moves from parseMoves
+#Returns a dict with the total time, plus time/length/count per move type
+#and time per section
+def estimateMoves(moves, profile=None):
+	p = makeProfile(profile)
+	n = len(moves)
+	
+	#Speed limit at the start of each move (and 0 at the very end)
+	limit = [0.0] * (n + 1)
+	for i in range(1, n):
+		limit[i] = min(_junctionSpeed(moves[i - 1], moves[i], p["junctionDeviation"]), moves[i][3], moves[i - 1][3])
+	
+	#Backward pass: make sure we can always stop in time
+	entry = list(limit)
+	for i in range(n - 1, -1, -1):
+		m = moves[i]
+		entry[i] = min(entry[i], math.sqrt(entry[i + 1]**2 + 2 * m[4] * m[2]))
+	#Forward pass: make sure we can actually get up to speed
+	entry[0] = 0.0
+	for i in range(n):
+		m = moves[i]
+		entry[i + 1] = min(entry[i + 1], math.sqrt(entry[i]**2 + 2 * m[4] * m[2]))
+	
+	total = 0.0
+	byType = {}
+	bySection = {}
+	for i in range(n):
+		m = moves[i]
+		t = _moveTime(m[2], entry[i], entry[i + 1], m[3], m[4], p["jerk"])
+		total += t
+		stats = byType.setdefault(m[0], {"time": 0.0, "length": 0.0, "count": 0})
+		stats["time"] += t
+		stats["length"] += m[2]
+		stats["count"] += 1
+		if m[1] != None:
+			bySection[m[1]] = bySection.get(m[1], 0.0) + t
+	
+	return {"total": total, "byType": byType, "bySection": bySection}
+
+
+#Estimates run time for GCode lines (any iterable, eg an open file)
+def estimate(lines, profile=None):
+	return estimateMoves(parseMoves(expandCalls(lines), profile), profile)
+
+def estimateFile(path, profile=None):
+	fin = open(path, 'r')
+	try:
+		return estimate(fin, profile)
+	finally:
+		fin.close()
+
+
+#Formats seconds as "1h 02m 03s"
+def formatTime(seconds):
+	seconds = int(seconds + 0.5)
+	return str(seconds / 3600) + "h " + str("%02d" % ((seconds / 60) % 60)) + "m " + str("%02d" % (seconds % 60)) + "s"
+
+
+#Human-readable summary of an estimate, as a list of lines
+#Only the slowest few sections are listed
+def report(result, sections=5):
+	lines = ["Estimated run time: " + formatTime(result["total"])]
+	for kind in sorted(result["byType"].keys(), key=lambda k: -result["byType"][k]["time"]):
+		stats = result["byType"][kind]
+		lines.append("\t" + kind + ": " + formatTime(stats["time"]) + " (" + str(stats["count"]) + " moves, " + str("%.1f" % stats["length"]) + " mm)")
+	slowest = sorted(result["bySection"].items(), key=lambda s: -s[1])[:sections]
+	if slowest:
+		lines.append("Slowest sections:")
+		for (section, t) in slowest:
+			lines.append("\tSection " + str(section) + ": " + formatTime(t))
+	return lines
@@ -2,328 +2,880 @@
 #All of them are basically macros to output a GCode sequence
 
 import math
-import area
-
-#Default to None, since these all should be set before making GCode
-feedxy = None
-feedz = None
-zsafe = None
-
-#Sets the XY or Z feed rates, in mm/min
-def setFeedXY(f):
-	global feedxy
-	feedxy = f
-
-def setFeedZ(f):
-	global feedz
-	feedz = f
-
-	
-#Perform a rapid move
-def rapid(x=None, y=None, z=None):
-	retstr = "G00"
-	if (x != None) or (y != None) or (z != None):
-		if (x != None):
-			retstr += " X" + str("%.3f" % x)
-		if (y != None):
-			retstr += " Y" + str("%.3f" % y)
-		if (z != None):
-			retstr += " Z" + str("%.3f" % z)
-	else:
-		return ""
-	return retstr + "\n"
+import collections
+import linking
+import curvearray
+import adaptive
+from areautil import curveToList
 
-#Going to ZSafe might as well have its own function, save some typing
-def goZsafe():
-	return "G00 F" + str("%.3f" % feedz) + " Z" + str("%.3f" % zsafe) + "\n"
+#Finding plunge sites needs libarea, but generating code for a toolpath
+#that's already been planned (eg, reposting a saved one- see repost.py)
+#doesn't
+try:
+	import area
+except ImportError:
+	area = None
 
-def setZsafe(z):
-	global zsafe
-	zsafe = z
+#Stands in for area.Point without libarea
+_Point = collections.namedtuple("_Point", ["x", "y"])
 
+#area.Point(x, y), or something with the same x and y without libarea
+def _point(x, y):
+	if area == None:
+		return _Point(x, y)
+	return area.Point(x, y)
 
-#Perform a linear feed
-def feed(x=None, y=None, z=None):
-	global feedxy
-	retstr = "G01 F"
-	if(x == None) and (y == None):
-		retstr += str("%.3f" % feedz)
-	else:
-		retstr += str("%.3f" % feedxy)
-	
-	if (x != None) or (y != None) or (z != None):
-		if (x != None):
-			retstr += " X" + str("%.3f" % x)
-		if (y != None):
-			retstr += " Y" + str("%.3f" % y)
-		if (z != None):
-			retstr += " Z" + str("%.3f" % z)
-	else:
-		return ""
-	return retstr + "\n"
+#Path blending tolerance (mm) given to the controller with G64. Anything that
+#approximates the toolpath (eg, flattening arcs) can use this as its budget
+pathTolerance = 0.01
 
+#Formats a coordinate or feed: fixed point, 3 decimal places, without
+#trailing zeros (or a trailing decimal point)
+def fmt(x):
+	s = ("%.3f" % x).rstrip("0").rstrip(".")
+	if s == "-0":
+		return "0"
+	return s
 
-#Perform an arc
-#Assumes XY plane or helix around Z
-#Don't worry about starting Z- assume that's dealt with elsewhere
-def arc(cx, cy, sx, sy, ex, ey, ez=None, ccw=False):
-	#If start/end radii aren't within eps, abort
-	eps = 0.01
-	if (math.sqrt((cx - sx)**2 + (cy - sy)**2) - math.sqrt((cx - ex)**2 + (cy - ey)**2)) >= eps:
-		print "ERROR: Illegal arc: Stand and end radii not equal"
-		return ""
-	
-	#Set [C]CW and feed
-	retstr = ""
-	if ccw:
-		retstr += "G03 F"
-	else:
-		retstr += "G02 F"
-	retstr += str(feedxy)
-	
-	#End location
-	retstr += " X" + str("%.3f" % ex) + " Y" + str("%.3f" % ey)
-	
-	#Helix if requested
-	if ez != None:
-		retstr += " Z" + str("%.3f" % ez)
-	
-	#Append center offsets
-	retstr += " I" + str("%.3f" % (cx - sx)) + " J" + str("%.3f" % (cy - sy))
-	
-	return retstr + "\n"
 
+#Writes GCode moves
+#Keeps track of the modal state of the controller- motion mode, feed rate
+#and position- and leaves out any word that wouldn't change it. Positions
+#are compared after formatting, so "unchanged" means unchanged as far as the
+#controller can tell
+#With modal=False, every line is written out in full
+class Emitter(object):
+	def __init__(self, feedxy, feedz, zsafe, modal=True):
+		self.feedxy = fmt(feedxy)
+		self.feedz = fmt(feedz)
+		self.zsafe = zsafe
+		self.modal = modal
+		self.forget()
+	
+	#Forget everything we know about the controller's state
+	def forget(self):
+		self.mode = None
+		self.f = None
+		self.x = None
+		self.y = None
+		self.z = None
+	
+	#Snapshot of the modal state, for setState
+	def state(self):
+		return (self.mode, self.f, self.x, self.y, self.z)
+	
+	def setState(self, state):
+		(self.mode, self.f, self.x, self.y, self.z) = state
+	
+	#A new emitter that only knows the tool is at (x, y)- for generating a
+	#piece of code that can be dropped in wherever the tool is there (see
+	#splice)
+	def fork(self, x, y):
+		e = Emitter(0, 0, 0, self.modal)
+		(e.feedxy, e.feedz, e.zsafe) = (self.feedxy, self.feedz, self.zsafe)
+		e.x = fmt(x)
+		e.y = fmt(y)
+		return e
+	
+	#Code from a fork() of this emitter, to drop in where the tool is now
+	#A fork doesn't know the mode or feed, so the first line it writes starts
+	#with both; whichever of them are already in effect here are left out
+	def splice(self, code):
+		if not self.modal or code == "":
+			return code
+		(line, rest) = code.split("\n", 1)
+		words = line.split(" ")
+		keep = 0
+		if words[0] == self.mode:
+			words.pop(0)
+		else:
+			keep = 1
+		if self.f != None and len(words) > keep and words[keep] == "F" + self.f:
+			words.pop(keep)
+		return " ".join(words) + "\n" + rest
+	
+	#Builds a line from the motion mode, feed and axis words that changed
+	#Returns "" if nothing would move. With full, X and Y are always written
+	def _line(self, mode, f, x, y, z, extra="", full=False):
+		words = []
+		if x != None:
+			x = fmt(x)
+			if x != self.x or full or not self.modal:
+				words.append("X" + x)
+				self.x = x
+		if y != None:
+			y = fmt(y)
+			if y != self.y or full or not self.modal:
+				words.append("Y" + y)
+				self.y = y
+		if z != None:
+			z = fmt(z)
+			if z != self.z or not self.modal:
+				words.append("Z" + z)
+				self.z = z
+		if not words:
+			return ""
+		
+		prefix = []
+		if mode != self.mode or not self.modal:
+			prefix.append(mode)
+			self.mode = mode
+		if f != None and (f != self.f or not self.modal):
+			prefix.append("F" + f)
+			self.f = f
+		return " ".join(prefix + words) + extra + "\n"
+	
+	#Perform a rapid move
+	def rapid(self, x=None, y=None, z=None):
+		return self._line("G00", None, x, y, z)
+	
+	#Going to ZSafe might as well have its own function, save some typing
+	def goZsafe(self):
+		return self._line("G00", None, None, None, self.zsafe)
+	
+	#Perform a linear feed; Z-only moves use the Z feed rate
+	#f: feed rate for this move, if it isn't the usual one
+	def feed(self, x=None, y=None, z=None, f=None):
+		if f != None:
+			f = fmt(f)
+		elif x == None and y == None:
+			f = self.feedz
+		else:
+			f = self.feedxy
+		return self._line("G01", f, x, y, z)
+	
+	#Perform an arc
+	#Assumes XY plane or helix around Z
+	#Don't worry about starting Z- assume that's dealt with elsewhere
+	def arc(self, cx, cy, sx, sy, ex, ey, ez=None, ccw=False, f=None):
+		#If start/end radii aren't within eps, abort
+		eps = 0.01
+		if abs(math.sqrt((cx - sx)**2 + (cy - sy)**2) - math.sqrt((cx - ex)**2 + (cy - ey)**2)) >= eps:
+			print "ERROR: Illegal arc: Stand and end radii not equal"
+			return ""
+		
+		if ccw:
+			mode = "G03"
+		else:
+			mode = "G02"
+		#Always give the end point- a full circle ends where it started, and
+		#the controller needs at least one axis word. Center offsets aren't
+		#modal, so they always go in too
+		if f == None:
+			f = self.feedxy
+		else:
+			f = fmt(f)
+		return self._line(mode, f, ex, ey, ez, " I" + fmt(cx - sx) + " J" + fmt(cy - sy), True)
 
 
-#Attempts to find a suitable location to helically plunge
-#curve: a curve to find a plunge location for- this is a TOOLPATH, so we can touch the outside if we have to
-#toolD: the diameter of the cutter to plunge with. Assume space needed is a circle ~2*toolD
-#Returns: area.Point of the center of the plunge
-def helixPos(curve, toolD):
-	#Turn the milling curve into an area
+#Where a helix fits inside a curve, as (x, y), or None if it doesn't
+#verts is the curve in list or array form (see curvearray), to save
+#converting it again
+#The helix is 2 toolD in diameter and the curve is already toolD/2 from the
+#edge of the pocket, so there has to be room to shrink the curve by another
+#toolD/2- which can't happen if it's narrower than toolD. That's checked
+#first, since offsetting is the slow part
+def _helixCenter(curve, verts, toolD):
+	box = curvearray.box(verts)
+	if box == None or box[2] - box[0] < toolD or box[3] - box[1] < toolD:
+		return None
+	
+	#Turn the milling curve into an area, and shrink it
 	curveArea = area.Area()
 	curveArea.append(curve)
-	
-	#Offset- "curveArea" is already at the limits of what we can machine-
-	#toolD/2 from the edge. Since the helix is 2 toolD in diameter, we
-	#need to be toolD from the edge of the pocket, or another toolD/2 from
-	#the milling path.
 	curveArea.Offset(toolD * 0.5)
 	
 	#Presumably this will be null if we can't shrink it enough
 	if curveArea.num_curves() == 0:
 		return None
 	
-	#Otherwise, it's all good, and we can just return the first point
-	helixPt = curveArea.getCurves()[0].getVertices()[0].p
-	
-	#We'll also need to find the index of the original curve that's closest
-	#to our helix so we don't end up machining a line to the old starting
-	#point
-	
-	#Find the closest point... or one close enough
-	i = 0;
-	bestd = 1000000000
-	nv = curve.getNumVertices()
-	verts = curve.getVertices()
-	bestidx = 0
-	while i < nv:
-		d = verts[i].p.dist(helixPt)
-		if d < toolD/2.:
-			bestidx = i
-			break
-		elif d < bestd:
-			bestd = d
-			bestidx = i
-		i += 1
-	
-	#Adjust the curve to start at that point
-	#setCurveStart(curve, bestidx)
-	curve.shiftStart(bestidx)
-	verts = curve.getVertices()
+	#Otherwise, it's all good, and we can just use the first point
+	p = curveArea.getCurves()[0].getVertices()[0].p
+	return (p.x, p.y)
+
+
+#Attempts to find a suitable location to helically plunge
+#curve: a curve to find a plunge location for- this is a TOOLPATH, so we can touch the outside if we have to
+#toolD: the diameter of the cutter to plunge with. Assume space needed is a circle ~2*toolD
+#Shifts the start of the curve to the vertex closest to the helix
+#Returns: area.Point of the center of the plunge
+def helixPos(curve, toolD):
+	verts = curveToList(curve)
+	center = _helixCenter(curve, verts, toolD)
+	if center == None:
+		return None
 	
-	return helixPt
+	#Adjust the curve to start at the closest vertex, so we don't end up
+	#machining a line to the old starting point
+	idx = curvearray.nearest(verts, center)
+	if idx != 0:
+		curve.shiftStart(idx)
+	return area.Point(center[0], center[1])
+
+
+#Helix centers for a whole list of curves at once: (x, y) for each curve, or
+#None where there's no room to helix
+#These only depend on the shape of each curve (not where it starts, or the
+#feeds and depths), so they can be worked out once and stored with the
+#toolpath- see planPlunges
+def helixCenters(curves, toolD):
+	return [_helixCenter(c, curveToList(c), toolD) for c in curves]
 
 
 #Returns code to helically plunge, if possible
 #destZ is the milling level
 #startZ is the height we can safely feed down to before helix-ing
-def helicalPlunge(curve, toolD, rampangle, destZ, startZ):
-	helixCmds = ""
-	plungePos = helixPos(curve, toolD)
+#plungePos is the helix center from helixPos; if not given, it's found here
+#(which may shift the start of the curve)
+#em: the Emitter to write through
+def helicalPlunge(curve, toolD, rampangle, destZ, startZ, em, plungePos=None):
+	if(plungePos == None):
+		plungePos = helixPos(curve, toolD)
 	if(plungePos == None):
 		return None
 	
-	#FIXME: Want this fudge-factor in there? Constant offset? Variable?
-	#Probably want SOMETHING so that we don't end up with a little chunk left in the middle
-	fudge = 0.95
-	helixX = plungePos.x + toolD/2. * fudge
-	helixY = plungePos.y;
+	return helixCmds(plungePos, curve.getVertices()[0].p, toolD, rampangle, destZ, startZ, em)
+
+
+#Code for a helical plunge around center, ending with a feed to start (the
+#start of the curve being cut)
+#If approach is False, the tool is assumed to already be at helixStart(),
+#at startZ
+def helixCmds(center, start, toolD, rampangle, destZ, startZ, em, approach=True):
+	helixCmds = ""
+	
+	(helixX, helixY) = helixStart(center, toolD)
 	
-	helixCirc = math.pi * toolD * fudge
+	helixCirc = math.pi * toolD * helixFudge
 	dzPerRev = math.sin(rampangle/180. * math.pi) * helixCirc
-
+	
 	#Go to the start of the helix position
-	helixCmds += rapid(helixX, helixY)
-	helixCmds += rapid(z=startZ)
+	if approach:
+		helixCmds += em.rapid(helixX, helixY)
+		helixCmds += em.rapid(z=startZ)
 	
 	#Helix as required to get to the requested depth
 	curZ = max(startZ-dzPerRev, destZ)
 	done = False
 	while not done:
 		done = (curZ == destZ)
-		helixCmds += arc(plungePos.x, plungePos.y, helixX, helixY, helixX, helixY, ez = curZ, ccw=True)
+		helixCmds += em.arc(center.x, center.y, helixX, helixY, helixX, helixY, ez = curZ, ccw=True)
 		curZ = max(curZ - dzPerRev, destZ)
 	
 	#Feed back to the start of the curve. This shouldn't be far
-	helixCmds += feed(curve.getVertices()[0].p.x, curve.getVertices()[0].p.y)
+	helixCmds += em.feed(start.x, start.y)
 	
 	return helixCmds
 
 
-def rampPlunge(curve, toolD, rampangle, destZ, startZ):	
-	#How long our desired ramp is
-	rampLen = toolD #FIXME: Should have this configurable
-	
+#FIXME: Want this fudge-factor in there? Constant offset? Variable?
+#Probably want SOMETHING so that we don't end up with a little chunk left in the middle
+helixFudge = 0.95
+
+#Where a helix around center starts (and ends), as (x, y)
+def helixStart(center, toolD):
+	return (center.x + toolD/2. * helixFudge, center.y)
+
+
+#True if the first segment of the curve is long enough to ramp along
+#FIXME: This is dumb
+def canRamp(curve, toolD):
+	if curve.getNumVertices() < 2:
+		return False
 	verts = curve.getVertices()
-	
+	return verts[0].p.dist(verts[1].p) >= toolD
+
+
+def rampPlunge(curve, toolD, rampangle, destZ, startZ, em):	
 	#If the first segment isn't long enough, give up
-	#FIXME: This is dumb
-	dist = verts[0].p.dist(verts[1].p)
-	if dist < toolD:
+	if not canRamp(curve, toolD):
 		print "FIXME: Ramp failure for stupid reasons"
 		return None
 	
-	startP = verts[0].p
+	return rampCmds(curveToList(curve), toolD, rampangle, destZ, startZ, em)
+
+
+#Code for a ramp back and forth along the first segment of verts (list or
+#array form- see curvearray), which canRamp must have OK'd
+#If approach is False, the tool is assumed to already be at the start of
+#verts, at startZ
+def rampCmds(verts, toolD, rampangle, destZ, startZ, em, approach=True):
+	#How long our desired ramp is
+	rampLen = toolD #FIXME: Should have this configurable
+	
+	(sx, sy) = (verts[0][1], verts[0][2])
 	
 	#Otherwise, iterate back and forth along the path
 	#Want to ramp by toolD, so normalize vector
-	vect = verts[1].p - verts[0].p
-	vect.normalize()
-	vect *= toolD
-	
-	endP = startP + vect
+	(dx, dy) = (verts[1][1] - sx, verts[1][2] - sy)
+	d = math.hypot(dx, dy)
+	
+	(ex, ey) = (sx + dx / d * toolD, sy + dy / d * toolD)
+	#Along an arc, the end has to be on the arc too, toolD along it (canRamp
+	#made sure the chord is at least that long, so the arc is as well)
+	if verts[1][0] != 0:
+		(t, cx, cy) = (verts[1][0], verts[1][3], verts[1][4])
+		r = math.hypot(sx - cx, sy - cy)
+		angle = math.atan2(sy - cy, sx - cx) + t * toolD / r
+		(ex, ey) = (cx + r * math.cos(angle), cy + r * math.sin(angle))
 	
 	dzPerRamp = math.sin(rampangle/180. * math.pi) * rampLen
 	
 	cmd = ""
 	
 	#Start by rapid-moving to the start location
-	cmd += rapid(startP.x, startP.y)
-	cmd += rapid(z=startZ)
-	
-	#Rapid down most of the way to the cut
+	if approach:
+		cmd += em.rapid(sx, sy)
+		cmd += em.rapid(z=startZ)
 	
+	#Ramp down to the cut, including the last pass that reaches destZ
 	curZ = max(startZ-dzPerRamp, destZ)
-	while curZ > destZ:
+	done = False
+	while not done:
+		done = (curZ == destZ)
 		#Linear feed
-		if verts[1].type == 0:
-			cmd += feed(endP.x, endP.y, curZ)
-			cmd += feed(startP.x, startP.y)
+		if verts[1][0] == 0:
+			cmd += em.feed(ex, ey, curZ)
+			cmd += em.feed(sx, sy)
 		#CCW arc
 		else:
-			t = verts[1].type
-			cmd += arc(verts[1].c.x, verts[1].c.y, startP.x, startP.y, endP.x, endP.y, ez=curZ, ccw=(t == 1))
-			cmd += arc(verts[1].c.x, verts[1].c.y, endP.x, endP.y, startP.x, startP.y, ccw=(t == -1))
+			(t, cx, cy) = (verts[1][0], verts[1][3], verts[1][4])
+			cmd += em.arc(cx, cy, sx, sy, ex, ey, ez=curZ, ccw=(t == 1))
+			cmd += em.arc(cx, cy, ex, ey, sx, sy, ccw=(t == -1))
 			
 		curZ = max(curZ - dzPerRamp, destZ)
 	
 	return cmd
+
+
+#Plunge types, as returned by planPlunge
+plungeHelical = 0
+plungeRamp = 1
+plungeStraight = 2
+
+#Decides how to get into the material for a curve. This only depends on the
+#XY shape of the curve, so it's done once and reused at every depth
+#May shift the start of the curve (to put it next to the helix)
+#Returns (plunge type, helix center or None)
+def planPlunge(curve, toolD):
+	helixPt = helixPos(curve, toolD)
+	if helixPt != None:
+		return (plungeHelical, helixPt)
+	if canRamp(curve, toolD):
+		return (plungeRamp, None)
+	return (plungeStraight, None)
+
+
+#planPlunge for a whole list of curves, converting each curve (to array form-
+#see curvearray) only once. Curves already in list or array form are fine too
+#centers: helix centers from helixCenters, if they're already known (eg,
+#from the toolpath cache); otherwise they're found here
+#The curves themselves are left alone; instead, each one comes back in array
+#form, starting wherever the plan wants it to: for a helix, the vertex
+#closest to helixStart, which is what ordering.orderCurves is given as the
+#curve's entry too
+#Returns a list of (plan, verts), one per curve
+def planPlunges(curves, toolD, centers=None):
+	plans = []
+	for (i, c) in enumerate(curves):
+		verts = curvearray.fromAny(c)
+		if centers != None:
+			center = centers[i]
+		else:
+			center = _helixCenter(c, verts, toolD)
+		
+		if center != None:
+			center = _point(center[0], center[1])
+			verts = curvearray.shiftStart(verts, curvearray.nearest(verts, helixStart(center, toolD)))
+			plan = (plungeHelical, center)
+		#Same test as canRamp
+		elif len(verts) >= 2 and math.hypot(verts[1][1] - verts[0][1], verts[1][2] - verts[0][2]) >= toolD:
+			plan = (plungeRamp, None)
+		else:
+			plan = (plungeStraight, None)
+		plans.append((plan, verts))
+	return plans
+
+
+#Code to get from startZ down to destZ at the start of verts, as decided by
+#planPlunge
+#If approach is False, the tool is assumed to already be at plungeXY(), at
+#startZ
+def plungeCmds(plan, verts, toolD, destZ, startZ, em, approach=True):
+	(ptype, center) = plan
+	if ptype == plungeHelical:
+		return helixCmds(center, _point(verts[0][1], verts[0][2]), toolD, 5, destZ, startZ, em, approach)
+	elif ptype == plungeRamp:
+		return rampCmds(verts, toolD, 5, destZ, startZ, em, approach)
+	
+	#Straight plunge
+	cmds = ""
+	if approach:
+		cmds += em.rapid(verts[0][1], verts[0][2])
+		cmds += em.rapid(z=startZ)
+	cmds += em.feed(z=destZ)
+	return cmds
+
+
+#Where the plunge for a plan starts, as (x, y)
+def plungeXY(plan, verts, toolD):
+	(ptype, center) = plan
+	if ptype == plungeHelical:
+		return helixStart(center, toolD)
+	return (verts[0][1], verts[0][2])
+
+
+#The Z levels to cut at, from the top down: one every zstep below zmax,
+#finishing exactly at zmin
+def depthLevels(zmin, zstep, zmax):
+	levels = []
+	n = 1
+	while zmax - n * zstep > zmin + 1e-6:
+		levels.append(zmax - n * zstep)
+		n += 1
+	levels.append(zmin)
+	return levels
+
+
+#Code for the XY moves along a curve (list or array form- see curvearray),
+#after the plunge has put the tool at the first vertex. Returns None if the
+#curve has a vertex we don't understand
+#feeds: feed rate for the move to each vertex (see adaptive.py); the first
+#is ignored. Everything goes at feedxy without it
+def pathCmds(verts, em, feeds=None):
+	if curvearray.isArray(verts) and em.modal:
+		cmds = _pathCmdsArray(verts, em, feeds)
+		if cmds != None:
+			return cmds
+	
+	cmds = []
+	i = 1
+	while i < len(verts):
+		(t, x, y, cx, cy) = verts[i]
+		f = None
+		if feeds != None:
+			f = feeds[i]
+		#Linear feed
+		if t == 0:
+			cmds.append(em.feed(x, y, f=f))
+		#Arc; CCW = 1, CW = -1
+		elif abs(t) == 1:
+			cmds.append(em.arc(cx, cy, verts[i-1][1], verts[i-1][2], x, y, ccw=(t == 1), f=f))
+		#No idea... abort
+		else:
+			print "Unknown vertex type found: " + str(t)
+			return None
+		i += 1
+	return "".join(cmds)
+
+
+#The first vertex type in verts (list or array form) that pathCmds doesn't
+#understand, or None if they're all fine
+def unknownVertexType(verts):
+	if curvearray.isArray(verts):
+		t = verts["type"][1:]
+		bad = t[(t != 0) & (t != 1) & (t != -1)]
+		if len(bad) > 0:
+			return int(bad[0])
+		return None
+	for v in verts[1:]:
+		if v[0] not in (0, 1, -1):
+			return v[0]
+	return None
+
+
+#Formats a whole column (NumPy array) of numbers like fmt. Returns an
+#object array, so the strings can be added to like Python strings
+def fmtColumn(values):
+	numpy = curvearray.numpy
+	s = numpy.char.rstrip(numpy.char.rstrip(numpy.char.mod("%.3f", values), "0"), ".")
+	s[s == "-0"] = "0"
+	return s.astype(object)
+
+
+#pathCmds for the array form, a column at a time: every coordinate is
+#formatted in one go, and the words that need writing (the same ones the
+#emitter would pick) are worked out with masks
+#Returns None for anything it doesn't handle (unknown vertex types, bad
+#arcs), so pathCmds can go the slow way and complain about it
+def _pathCmdsArray(verts, em, feeds=None):
+	numpy = curvearray.numpy
+	if len(verts) < 2:
+		return ""
+	t = verts["type"][1:]
+	if not numpy.all((t == 0) | (t == 1) | (t == -1)):
+		return None
+	(x, y, cx, cy) = (verts["x"], verts["y"], verts["cx"][1:], verts["cy"][1:])
+	arcs = t != 0
+	if numpy.any(numpy.abs(numpy.hypot(cx - x[:-1], cy - y[:-1]) - numpy.hypot(cx - x[1:], cy - y[1:]))[arcs] >= 0.01):
+		return None
 	
+	xs = fmtColumn(x)
+	ys = fmtColumn(y)
+	prevX = numpy.concatenate(([em.x], xs[1:-1])).astype(object)
+	prevY = numpy.concatenate(([em.y], ys[1:-1])).astype(object)
+	xs = xs[1:]
+	ys = ys[1:]
+	#Arcs always give their end point
+	writeX = arcs | (xs != prevX)
+	writeY = arcs | (ys != prevY)
+	written = writeX | writeY
+	if not numpy.any(written):
+		return ""
 	
+	#Each line's mode only needs writing if it's different from the last
+	#line actually written
+	modes = numpy.where(t == 0, "G01", numpy.where(t == 1, "G03", "G02")).astype(object)
+	n = len(t)
+	lastWritten = numpy.maximum.accumulate(numpy.where(written, numpy.arange(n), -1))
+	before = numpy.concatenate(([-1], lastWritten[:-1]))
+	prevModes = numpy.where(before >= 0, modes[numpy.maximum(before, 0)], em.mode)
+	writeMode = written & (modes != prevModes)
+	#Same for the feed
+	if feeds == None:
+		fs = numpy.array([em.feedxy] * n, dtype=object)
+	else:
+		fs = fmtColumn(numpy.asarray(feeds[1:], dtype=float))
+	prevF = numpy.where(before >= 0, fs[numpy.maximum(before, 0)], em.f)
+	writeF = written & (fs != prevF)
+	
+	empty = numpy.array([""] * n, dtype=object)
+	lines = numpy.where(writeMode, " " + modes, empty)
+	lines = lines + numpy.where(writeF, " F" + fs, empty)
+	lines = lines + numpy.where(writeX, " X" + xs, empty)
+	lines = lines + numpy.where(writeY, " Y" + ys, empty)
+	if numpy.any(arcs):
+		ij = " I" + fmtColumn(cx - x[:-1]) + " J" + fmtColumn(cy - y[:-1])
+		lines = lines + numpy.where(arcs, ij, empty)
+	
+	em.mode = modes[lastWritten[-1]]
+	em.f = fs[lastWritten[-1]]
+	em.x = xs[-1]
+	em.y = ys[-1]
+	return "".join([l[1:] + "\n" for l in lines[written]])
+	
+	
+#Tool change to tool number tool (of diameter toolD), picking up its length
+#offset and spindle speed
+def toolChange(tool, toolD, rpm):
+	cmds = ""
+	cmds += "T" + str(tool) + " M6\t(Tool change: " + str(toolD) + " mm)\n"
+	cmds += "G43 H" + str(tool) + "\t(Tool length offset)\n"
+	cmds += "G97 S" + str(rpm) + "\t(Set spindle speed)\n"
+	cmds += "\n"
+	return cmds
+
+
+#Start of the program: modes and units
+def preamble(rpm):
+	cmds = ""
+	cmds += "G90\t(Absolute mode)\n"
+	cmds += "G91.1\t(Relative arc offsets)\n"
+	cmds += "G94\t(Units/minute mode)\n"
+	cmds += "G97 S" + str(rpm) + "\t(Set spindle speed)\n"
+	cmds += "G21\t(units are mm)\n"
+	cmds += "G40\t(no cutter comp)\n"
+	cmds += "G64 P" + str(pathTolerance) + "\t(set path tolerance)\n"
+	cmds += "G17\t(Use XY plane for arcs)\n"
+	cmds += "\n"
+	return cmds
+
+
 #Function that calls all the others- parses a bunch of libarea curves denoting
 #GCode paths, and generates the actual calls for them
+#This is a generator: it yields the preamble, then GCode a curve (and layer)
+#at a time, then the end of the program, so callers never need to hold the
+#whole program in memory. Yields nothing if the sanity checks fail- the
+#curves are checked too, before anything is yielded, so a caller never ends
+#up with half a program.
+#Each curve is cut in layers from zmax (top of stock) down to zmin, zstep at
+#a time; its plunge and XY path are worked out once and replayed per layer
+#regions: if given (a list of areas, eg from Split()), turns on stay-down
+#linking. Curves in the same region are cut together a layer at a time, and
+#the tool feeds across between them whenever that stays inside the region:
+#at depth if it only goes through what that layer's cuts have already
+#cleared, otherwise on the floor of the layer above (see linking.py). The
+#zones linking.safeZones builds from them can be given instead (eg, from a
+#saved toolpath- see toolpathfile.py)
+#zclear: height for short hops between cuts; should be a bit above zmax.
+#Defaults to zmax. Without regions, moving between curves still goes to zsafe
+#centers: helix centers for curves from helixCenters, if already known
+#feedLimits: (min, max) multipliers for feedxy; if given, each move's feed is
+#scaled to how much the tool is engaged along it (see adaptive.py)
+#tool: tool number; if given, the cuts start with a change to that tool
+#start/end: whether to write the start and end of the program, so that one
+#program can be put together from a call per tool; sections are numbered
+#from sectionBase + 1
+#em: the Emitter to write through, if carrying on from code it already wrote
+#(eg, when a program is written a few curves at a time, as they're ready);
+#by default, a fresh one
 #NOTE: Some parameters are kind of redundant- like toolD. They're kept for
 #future use (eg, for safely ramping or running sanity checks)
-def generate(curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm):
+def generateIter(curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm, regions=None, zclear=None, centers=None, feedLimits=None, tool=None, start=True, end=True, sectionBase=0, em=None):
 	#Do some basic sanity checks
 	if(feedxy <= 0):
 		print "ERROR: FeedXY must be positive."
-		return ""
+		return
 	if(feedz <= 0):
 		print "ERROR: FeedXY must be positive."
-		return ""
+		return
 	if(zsafe <= zmax):
 		print "ERROR: ZSafe must be above milling height. ZSafe=" + str(zsafe) + ", zmax=" + str(zmax)
-		return ""
+		return
+	if(zmin >= zmax):
+		print "ERROR: zmin must be below zmax. zmin=" + str(zmin) + ", zmax=" + str(zmax)
+		return
+	if(zstep <= 0):
+		print "ERROR: Z step must be positive."
+		return
+	if(zclear == None):
+		zclear = zmax
+	if(zclear < zmax or zclear > zsafe):
+		print "ERROR: Clearance height must be between zmax and ZSafe. zclear=" + str(zclear)
+		return
 	if(stepover > toolD):
 		print "ERROR: Stepover should be less than the tool diameter! Tool: " + str(toolD) + ", stepover: " + str(stepover)
-		return ""
+		return
 	#Don't try to check IPT or zstep relative to toolD- assume user knows
 	#what they're doing. We don't know their setup or material
 	
-	setZsafe(zsafe)
-	setFeedXY(feedxy)
-	setFeedZ(feedz)
-	cmds = ""
-	
-	#Preamble
-	cmds += "G90\t(Absolute mode)\n"
-	cmds += "G91.1\t(Relative arc offsets)\n"
-	cmds += "G94\t(Units/minute mode)\n"
-	cmds += "G97 S" + str(rpm) + "\t(Set spindle speed)\n"
-	cmds += "G21\t(units are mm)\n"
-	cmds += "G40\t(no cutter comp)\n"
-	cmds += "G64 P0.01\t(set path tolerance)\n"
-	cmds += "G17\t(Use XY plane for arcs)\n"
-	cmds += "\n"
+	#Work out every curve's plunge first- it may change where the curve
+	#starts. From here on, curves are only looked at in array form
+	plans = planPlunges(list(curves), toolD, centers)
+	arrays = [verts for (plan, verts) in plans]
+	for verts in arrays:
+		t = unknownVertexType(verts)
+		if t != None:
+			print "Unknown vertex type found: " + str(t)
+			print "Aborting"
+			return
+	
+	#Everything goes through one emitter, so words the controller already
+	#has (mode, feed, unchanged axes) aren't repeated
+	if em == None:
+		em = Emitter(feedxy, feedz, zsafe)
+	
+	if start:
+		yield preamble(rpm)
+	if tool != None:
+		yield toolChange(tool, toolD, rpm)
 	
 	#FIXME: Add M[345] spindle control commands
-	#FIXME: Make path tolerance an argument
-	
 	
-	
-	#FIXME: Will need to iterate over this- well, maybe  INSIDE the curve loop
-	workZ = max(zmax - zstep, zmin)
-	for c in curves:
-		verts = c.getVertices()
-		#Stupid version of safety: Move to Zsafe before starting any curve
-		#FIXME: A better version would check if that's actually necessary first
-		cmds += goZsafe()
-		
-		#Set our starting "previous" point
-		last = verts[0].p
-		
-		#Helical plunge- good! Assuming there's space to do it...
-		#FIXME: This "zmax" bit will probably need to change...
-		plungeCmds = helicalPlunge(c, toolD, 5, workZ, zmax)
-		
-		#If helix feed doesn't work, try linear ramp
-		if(plungeCmds == None):
-			plungeCmds = rampPlunge(c, toolD, 5, workZ, zmax)
-
+	zones = regions
+	if regions != None and not linking.isZones(regions):
+		zones = linking.safeZones(regions, toolD, pathTolerance)
+	
+	levels = depthLevels(zmin, zstep, zmax)
+	
+	engagement = None
+	if feedLimits != None:
+		engagement = adaptive.Engagement(toolD, stepover, feedLimits[0], feedLimits[1])
+	
+	#Where the tool is, as (x, y, z, zone), while it's down in the material;
+	#None when it's been retracted
+	down = None
+	first = True
+	for (zone, group) in linking.groupCurves(enumerate(arrays), zones):
+		#The XY part of the path is the same at every depth, so it's
+		#generated once, from the first vertex, and the state it leaves the
+		#controller in is kept to pick up from after each replay
+		cuts = []
+		for (section, verts) in group:
+			plan = plans[section][0]
+			pathEm = em.fork(verts[0][1], verts[0][2])
+			#Curves have to go past the engagement estimate in the order
+			#they're cut
+			feeds = None
+			if engagement != None:
+				feeds = [feedxy * s for s in engagement.scales(verts)]
+			path = pathCmds(verts, pathEm, feeds)
+			cuts.append((section, plan, verts, path, pathEm.state()))
 		
-		#if linear ramp fails for some reason, default to straight plunge
-		if(plungeCmds == None):
-			plungeCmds = rapid(verts[0].p.x, verts[0].p.y)
-			plungeCmds += rapid(z=zmax) #FIXME: zmax will need to change
-			plungeCmds += feed(z=workZ)
+		#Feeding across at depth is only safe through what this layer's
+		#cuts have already swept- no more than a stepover from their paths
+		swept = None
+		if zone != None:
+			swept = linking.Swept([verts for (section, plan, verts, path, pathEnd) in cuts], min(stepover, toolD / 2.), pathTolerance)
 		
-		#Add the plunge to the command list
-		cmds += plungeCmds
-		
-		i = 1
-		#Get a fresh copy of vertices- we've (maybe) tweaked them with plunges!
-		#FIXME: There has to be a better way to do this
-		verts = c.getVertices()
-		while i < len(verts):
-			#Linear feed
-			if verts[i].type == 0:
-				cmds += feed(verts[i].p.x, verts[i].p.y)
-			#Arc; CCW = 1, CW = -1
-			elif abs(verts[i].type) == 1:
-				ccw = (verts[i].type == 1)
-				cmds += arc(verts[i].c.x, verts[i].c.y, verts[i-1].p.x, verts[i-1].p.y, verts[i].p.x, verts[i].p.y, ccw=ccw)
-			#No idea... abort
-			else:
-				print "Unknown vertex type found: " + str(vert[i].type)
-				print "Aborting"
-				return ""
-			i += 1
+		#Each layer only has to plunge through the material left by the
+		#layer above it; the first one starts at the top of the stock
+		startZ = zmax
+		for workZ in levels:
+			for (k, (section, plan, verts, path, pathEnd)) in enumerate(cuts):
+				#Collect lines in a list and join once- only one curve's worth
+				#of GCode is ever held at a time
+				#Label each cut, so the program can be related back to the
+				#toolpath (and timed per section)
+				cmds = ["(Section " + str(sectionBase + section + 1) + ", Z=" + str("%.3f" % workZ) + ")\n"]
+				start = (verts[0][1], verts[0][2])
+				plungeAt = plungeXY(plan, verts, toolD)
+				sameZone = (down != None and zone != None and down[3] == zone)
+				
+				#Already at this depth and can feed straight over, through
+				#what the cuts before this one have cleared- no plunge
+				if sameZone and down[2] == workZ and linking.segmentInZone(down[:2], start, zones[zone]) and swept.covers(down[:2], start, k):
+					cmds.append(em.feed(start[0], start[1]))
+				#On the floor of the layer above, or can go straight up to it
+				#(what's above the cut just finished is clear); feed over to
+				#the plunge. On the first layer, that floor is just the top of
+				#the stock, so there's nothing to gain over retracting
+				elif sameZone and (down[2] == startZ or (down[2] == workZ and startZ < zmax)) and linking.segmentInZone(down[:2], plungeAt, zones[zone]):
+					if down[2] != startZ:
+						cmds.append(em.rapid(z=startZ))
+					cmds.append(em.feed(plungeAt[0], plungeAt[1]))
+					cmds.append(plungeCmds(plan, verts, toolD, workZ, startZ, em, approach=False))
+				#Have to get out of the material first
+				else:
+					if first:
+						cmds.append(em.goZsafe())
+						first = False
+					elif down != None:
+						#Stupid version of safety: Move to Zsafe before starting
+						#any curve, unless we're linking
+						if zones == None and workZ == levels[0]:
+							cmds.append(em.goZsafe())
+						else:
+							cmds.append(em.rapid(z=zclear))
+					cmds.append(plungeCmds(plan, verts, toolD, workZ, startZ, em))
+				
+				#The path only moves in XY, so Z is still workZ afterwards.
+				#It was generated knowing nothing of the mode or feed, so it
+				#sets them both, unless they're set already
+				cmds.append(em.splice(path))
+				(mode, f, x, y, z) = pathEnd
+				em.setState((mode or em.mode, f or em.f, x, y, em.z))
+				down = (verts[-1][1], verts[-1][2], workZ, zone)
+				yield "".join(cmds)
+			startZ = workZ
 	#At the end of the code, retract
-	cmds += goZsafe()
+	cmds = em.goZsafe()
 	
 	#Add "end of program
-	cmds += "\nM2\n"
-			
+	if end:
+		cmds += "\nM2\n"
+	
+	yield cmds
+
+
+#Builds the whole program as a single string. Fine for small jobs; use
+#generateToFile for big ones. Arguments are the same as generateIter
+def generate(curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm, regions=None, zclear=None, centers=None, feedLimits=None, tool=None, start=True, end=True, sectionBase=0):
+	return "".join(generateIter(curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm, regions, zclear, centers, feedLimits, tool, start, end, sectionBase))
+
+
+#Streams GCode straight into fout (anything with a write() method) as each
+#curve is processed. Returns the number of characters written
+#progress: a stats.Progress to advance as each chunk (one curve at one
+#depth) is written
+def generateToFile(fout, curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm, regions=None, zclear=None, centers=None, progress=None, feedLimits=None, tool=None, start=True, end=True, sectionBase=0):
+	written = 0
+	for chunk in generateIter(curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm, regions, zclear, centers, feedLimits, tool, start, end, sectionBase):
+		fout.write(chunk)
+		written += len(chunk)
+		if progress != None:
+			progress.advance()
+	return written
+
+
+#Writes a program for one or more tools to fout. parts is a list of
+#(curves, toolD, stepover, zstep, feedxy, rpm, regions, centers), one per
+#tool; with more than one, each part starts with a change to tool 1, 2, ...
+#and sections are numbered right through. The other arguments are as for
+#generateIter
+#placements: (x, y) offsets to cut the whole thing at, eg from
+#arrayPlacements; see arrayToFile
+#Returns the number of characters written, or 0 if any part failed its
+#sanity checks
+def partsToFile(fout, parts, zsafe, zmin, zmax, feedz, zclear=None, progress=None, feedLimits=None, placements=None):
+	if placements != None:
+		return arrayToFile(fout, parts, placements, zsafe, zmin, zmax, feedz, zclear, progress, feedLimits)
+	written = 0
+	sections = 0
+	for (n, part) in enumerate(parts):
+		(curves, toolD, stepover, zstep, feedxy, rpm, regions, centers) = part
+		tool = None
+		if len(parts) > 1:
+			tool = n + 1
+		chunk = generateToFile(fout, curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm, regions, zclear, centers, progress, feedLimits, tool, n == 0, n == len(parts) - 1, sections)
+		if chunk == 0:
+			return 0
+		written += chunk
+		sections += len(curves)
+	return written
+
+
+#Offsets for cols x rows copies of a part, pitch (dx, dy) apart, starting
+#from (0, 0). They go back and forth along the rows, so every copy is next to
+#the one before it
+def arrayPlacements(cols, rows, dx, dy):
+	placements = []
+	for j in range(rows):
+		order = range(cols)
+		if j % 2 == 1:
+			order.reverse()
+		placements += [(i * dx, j * dy) for i in order]
+	return placements
+
+
+#Moves the G55 work offset to (x, y) from G54's, and switches to it
+def placementCmds(x, y):
+	def shift(param, v):
+		if v < 0:
+			return "[#" + param + "-" + fmt(-v) + "]"
+		return "[#" + param + "+" + fmt(v) + "]"
+	cmds = ""
+	cmds += "G10 L2 P2 X" + shift("5221", x) + " Y" + shift("5222", y) + " Z#5223\t(Copy at X" + fmt(x) + " Y" + fmt(y) + ")\n"
+	cmds += "G55\n"
 	return cmds
+
+
+#Subroutine number for each tool's part of an array (the first tool's is
+#SUB_BASE, the next one's SUB_BASE + 1, ...)
+SUB_BASE = 100
+
+
+#partsToFile for many copies of the same part: each tool's cuts are written
+#once, as an O-word subroutine in the part's own coordinates, and called at
+#each of placements with the G55 work offset moved there (so G55's own
+#setting is overwritten). Every tool visits the placements in turn, each one
+#in the opposite order to the last, so a tool change doesn't send it back
+#across the sheet
+#Returns the number of characters written, or 0 if any part failed its
+#sanity checks
+def arrayToFile(fout, parts, placements, zsafe, zmin, zmax, feedz, zclear=None, progress=None, feedLimits=None):
+	cmds = preamble(parts[0][5])
+	cmds += "(" + str(len(placements)) + " copies; each tool's cuts are a subroutine called once per copy)\n\n"
+	fout.write(cmds)
+	written = len(cmds)
+	
+	#Subroutines have to be defined before they're called
+	sections = 0
+	for (n, part) in enumerate(parts):
+		(curves, toolD, stepover, zstep, feedxy, rpm, regions, centers) = part
+		sub = "o" + str(SUB_BASE + n)
+		fout.write(sub + " sub\n")
+		body = generateToFile(fout, curves, zsafe, zmin, zstep, zmax, feedxy, feedz, toolD, stepover, rpm, regions, zclear, centers, progress, feedLimits, None, False, False, sections)
+		if body == 0:
+			return 0
+		cmds = sub + " endsub\n\n"
+		fout.write(cmds)
+		written += len(sub + " sub\n") + body + len(cmds)
+		sections += len(curves)
+	
+	order = list(placements)
+	for (n, part) in enumerate(parts):
+		cmds = ""
+		if len(parts) > 1:
+			cmds += toolChange(n + 1, part[1], part[5])
+		for (x, y) in order:
+			cmds += placementCmds(x, y)
+			cmds += "o" + str(SUB_BASE + n) + " call\n"
+		fout.write(cmds)
+		written += len(cmds)
+		order.reverse()
+	
+	cmds = "G54\t(Back to the usual work offset)\n"
+	cmds += "\nM2\n"
+	fout.write(cmds)
+	return written + len(cmds)
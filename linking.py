@@ -0,0 +1,225 @@
+#Decides when the tool can stay down between cuts
+#A "zone" is one pocket region, along with the area the tool's center can
+#travel through without touching the region's walls (the region shrunk by
+#the tool radius). Within a zone, curves are cut a layer at a time, so once
+#the tool has finished a layer, the whole zone has been cleared down to it:
+#if the straight line to the next cut stays inside the zone's tool-center
+#area, the tool can feed across on that floor instead of retracting.
+#At the depth it's cutting, only what the cuts so far on this layer have
+#swept is clear (see Swept); the tool can only feed across there if the line
+#stays within that, too.
+#Arcs are flattened into chords for all of this; the slack for that comes
+#out of the tolerance passed in (normally the GCode path tolerance).
+
+import math
+import curvearray
+from areautil import deepcopy_area, curveToList, flattenList
+
+
+#Flattens every curve of an area into a polygon (list of (x, y))
+def _areaPolys(a, tol):
+	return [flattenList(curveToList(c), tol) for c in a.getCurves()]
+
+
+def polysBox(polys):
+	xs = [p[0] for poly in polys for p in poly]
+	ys = [p[1] for poly in polys for p in poly]
+	return (min(xs), min(ys), max(xs), max(ys))
+
+
+#Builds a zone for each region
+#Returns a list of (region polygons, region box, tool-center polygons); the
+#tool-center list is empty if the tool doesn't fit in the region at all
+def safeZones(regions, toolD, tol):
+	zones = []
+	for r in regions:
+		if r.num_curves() == 0:
+			continue
+		polys = _areaPolys(r, tol)
+		
+		#Keep the chord error from eating into the wall clearance
+		inner = deepcopy_area(r)
+		inner.Offset(toolD/2. - tol)
+		if inner.num_curves() > 0:
+			safe = _areaPolys(inner, tol / 2.)
+		else:
+			safe = []
+		zones.append((polys, polysBox(polys), safe))
+	return zones
+
+
+#True if x is a list of zones from safeZones, rather than of regions
+def isZones(x):
+	return len(x) > 0 and isinstance(x[0], tuple)
+
+
+#Even-odd point in polygon test against all of polys at once, so holes
+#come out right
+def pointInPolys(p, polys):
+	(x, y) = p
+	inside = False
+	for poly in polys:
+		j = len(poly) - 1
+		for i in range(len(poly)):
+			(xi, yi) = poly[i]
+			(xj, yj) = poly[j]
+			if (yi > y) != (yj > y):
+				if x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+					inside = not inside
+			j = i
+	return inside
+
+
+def _orient(a, b, c):
+	return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+#True if segments ab and cd properly cross each other
+def _crosses(a, b, c, d):
+	d1 = _orient(c, d, a)
+	d2 = _orient(c, d, b)
+	d3 = _orient(a, b, c)
+	d4 = _orient(a, b, d)
+	return ((d1 > 0 and d2 < 0) or (d1 < 0 and d2 > 0)) and ((d3 > 0 and d4 < 0) or (d3 < 0 and d4 > 0))
+
+
+#True if the tool's center can move in a straight line from p0 to p1 while
+#staying inside the zone's tool-center area
+def segmentInZone(p0, p1, zone):
+	safe = zone[2]
+	if len(safe) == 0:
+		return False
+	if not pointInPolys(p0, safe) or not pointInPolys(p1, safe):
+		return False
+	
+	minx = min(p0[0], p1[0])
+	maxx = max(p0[0], p1[0])
+	miny = min(p0[1], p1[1])
+	maxy = max(p0[1], p1[1])
+	for poly in safe:
+		for i in range(1, len(poly)):
+			a = poly[i - 1]
+			b = poly[i]
+			#Cheap rejection before doing the real test
+			if max(a[0], b[0]) < minx or min(a[0], b[0]) > maxx or max(a[1], b[1]) < miny or min(a[1], b[1]) > maxy:
+				continue
+			if _crosses(p0, p1, a, b):
+				return False
+	return True
+
+
+def _segDist(p, x0, y0, x1, y1):
+	(dx, dy) = (x1 - x0, y1 - y0)
+	l2 = dx*dx + dy*dy
+	t = 0.0
+	if l2 > 1e-18:
+		t = max(0.0, min(1.0, ((p[0] - x0) * dx + (p[1] - y0) * dy) / l2))
+	return math.hypot(p[0] - (x0 + t * dx), p[1] - (y0 + t * dy))
+
+
+#What the tool has swept on one layer of a zone, a cut at a time
+#paths: the tool-center paths of the zone's cuts (list or array form), in
+#the order they're cut, which is the same on every layer. A point counts as
+#swept by the cuts so far if it's within reach of one of their paths; reach
+#should be no more than a stepover, so a link through swept ground never has
+#the tool take more than a normal pass would. tol is the slack for
+#flattening arcs
+#The paths are put in a grid the first time it's needed, for every layer
+class Swept(object):
+	def __init__(self, paths, reach, tol):
+		self.paths = paths
+		self.reach = reach + tol
+		self.tol = tol
+		self.grid = None
+	
+	def _cell(self, x, y):
+		return (int(math.floor(x / self.reach)), int(math.floor(y / self.reach)))
+	
+	#Each flattened segment goes in every cell within reach of it, so one
+	#cell has everything that could cover a point in it
+	def _build(self):
+		self.grid = {}
+		r = self.reach
+		for (n, verts) in enumerate(self.paths):
+			(xs, ys) = curvearray.flatten(verts, self.tol)
+			(xs, ys) = ([float(x) for x in xs], [float(y) for y in ys])
+			for i in range(1, len(xs)):
+				seg = (n, xs[i - 1], ys[i - 1], xs[i], ys[i])
+				(cx0, cy0) = self._cell(min(xs[i - 1], xs[i]) - r, min(ys[i - 1], ys[i]) - r)
+				(cx1, cy1) = self._cell(max(xs[i - 1], xs[i]) + r, max(ys[i - 1], ys[i]) + r)
+				for ix in range(cx0, cx1 + 1):
+					for iy in range(cy0, cy1 + 1):
+						self.grid.setdefault((ix, iy), []).append(seg)
+	
+	#Distance from p to the nearest path of the first cuts cuts, if it's
+	#within reach; otherwise something further
+	def _dist(self, p, cuts):
+		best = float("inf")
+		for (n, x0, y0, x1, y1) in self.grid.get(self._cell(p[0], p[1]), ()):
+			if n < cuts:
+				best = min(best, _segDist(p, x0, y0, x1, y1))
+		return best
+	
+	#True if the straight line from p0 to p1 only goes through ground the
+	#first cuts cuts have swept
+	#No point on a line of length l is further from the paths than (d0 + d1
+	#+ l) / 2, where d0 and d1 are its ends' distances; it's split in half
+	#until that's within reach everywhere, or some point isn't
+	def covers(self, p0, p1, cuts):
+		if cuts <= 0:
+			return False
+		if self.grid == None:
+			self._build()
+		stack = [(p0, self._dist(p0, cuts), p1, self._dist(p1, cuts))]
+		while stack:
+			(a, da, b, db) = stack.pop()
+			if da > self.reach or db > self.reach:
+				return False
+			l = math.hypot(b[0] - a[0], b[1] - a[1])
+			if (da + db + l) / 2. <= self.reach or l < self.tol:
+				continue
+			m = ((a[0] + b[0]) / 2., (a[1] + b[1]) / 2.)
+			dm = self._dist(m, cuts)
+			stack += [(a, da, m, dm), (m, dm, b, db)]
+		return True
+
+
+#Index of the zone whose region contains point p, or None
+def zoneOf(p, zones):
+	for (i, (polys, box, safe)) in enumerate(zones):
+		if p[0] < box[0] or p[0] > box[2] or p[1] < box[1] or p[1] > box[3]:
+			continue
+		if pointInPolys(p, polys):
+			return i
+	return None
+
+
+#Groups curves by the zone they're in, so each zone can be cut a layer at a
+#time. Groups come out in the order their first curve appeared, and curves
+#keep their order within a group. Curves outside every zone (and all curves,
+#if zones is None) get a group to themselves
+#items: (section number, curve) pairs, eg enumerate(curves). Curves are in
+#list or array form (see curvearray)
+#Yields (zone index or None, [(section number, curve), ...]). Without zones
+#this doesn't need to see every curve up front
+def groupCurves(items, zones):
+	if zones == None:
+		for item in items:
+			yield (None, [item])
+		return
+	
+	groups = []
+	byZone = {}
+	for item in items:
+		c = item[1]
+		idx = None
+		if len(c) > 0:
+			idx = zoneOf((c[0][1], c[0][2]), zones)
+		if idx == None:
+			groups.append((None, [item]))
+		elif idx in byZone:
+			byZone[idx][1].append(item)
+		else:
+			byZone[idx] = (idx, [item])
+			groups.append(byZone[idx])
+	for g in groups:
+		yield g
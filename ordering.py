@@ -0,0 +1,245 @@
+#Ordering of toolpath sections to cut down on rapid travel
+#libarea hands back pocket sections in whatever order it found them, which
+#often means crossing the sheet and back between neighbors. This reorders
+#them with a nearest-neighbor pass followed by 2-opt (for as long as the time
+#budget allows), and picks the start point of each closed curve to be the
+#vertex closest to wherever the tool is coming from.
+#Curves that are plunged into somewhere other than their start (a helix) can
+#be given that entry point; they're then started at the vertex closest to it,
+#which is where the plunge leaves the tool.
+#Open curves are never reversed- that would flip climb/conventional milling.
+
+import math
+import time
+
+#Closed curves with more vertices than this only consider this many
+#(evenly spaced) start points
+MAX_CANDIDATES = 64
+
+DEFAULT_TIME_BUDGET = 1.0
+
+
+def _dist(a, b):
+	return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+#Pulls out what ordering needs from a curve: its vertex positions, whether
+#it's closed, which vertex indices it could start at, and where the tool
+#enters it (None: at the start vertex)
+def _curveInfo(c, entry=None):
+	pts = [(v.p.x, v.p.y) for v in c.getVertices()]
+	closed = len(pts) > 2 and _dist(pts[0], pts[-1]) < 1e-6
+	if closed and entry != None:
+		n = len(pts) - 1
+		cands = [min(range(n), key=lambda idx: _dist(entry, pts[idx]))]
+	elif closed:
+		n = len(pts) - 1
+		step = max(1, n / MAX_CANDIDATES)
+		cands = range(0, n, step)
+	else:
+		cands = [0]
+	return (pts, closed, cands, entry)
+
+
+#Where the tool enters and leaves a curve if it starts at vertex idx
+def _entry(info, idx):
+	if info[3] != None:
+		return info[3]
+	return info[0][idx]
+
+def _exit(info, idx):
+	if info[1]:
+		return info[0][idx]
+	return info[0][-1]
+
+
+#Total rapid distance between consecutive sections, given each curve's
+#start index
+def _rapidLength(infos, order, starts):
+	total = 0.0
+	for k in range(1, len(order)):
+		a = order[k - 1]
+		b = order[k]
+		total += _dist(_exit(infos[a], starts[a]), _entry(infos[b], starts[b]))
+	return total
+
+
+#Total rapid distance between the sections of curves, in the order given and
+#with their current start points
+def rapidLength(curves):
+	infos = [_curveInfo(c) for c in curves]
+	return _rapidLength(infos, range(len(infos)), [0] * len(infos))
+
+
+#The grid cells exactly ring cells away from (cx, cy), leaving out any
+#outside the grid (0..gw, 0..gh)
+def _ringCells(cx, cy, ring, gw, gh):
+	if ring == 0:
+		return [(cx, cy)]
+	cells = []
+	xs = range(max(cx - ring, 0), min(cx + ring, gw) + 1)
+	ys = range(max(cy - ring + 1, 0), min(cy + ring - 1, gh) + 1)
+	for (iy, inside) in ((cy - ring, cy - ring >= 0), (cy + ring, cy + ring <= gh)):
+		if inside:
+			cells += [(ix, iy) for ix in xs]
+	for (ix, inside) in ((cx - ring, cx - ring >= 0), (cx + ring, cx + ring <= gw)):
+		if inside:
+			cells += [(ix, iy) for iy in ys]
+	return cells
+
+
+#Nearest-neighbor tour, using a grid over every candidate start point so
+#each step only looks at nearby curves
+#If it runs past deadline, whatever's left goes on the end in the order
+#given
+#Returns (order, start index of each curve)
+def _nearestNeighbor(infos, deadline):
+	n = len(infos)
+	starts = [info[2][0] for info in infos]
+	
+	allPts = []
+	for (i, info) in enumerate(infos):
+		for idx in info[2]:
+			allPts.append((_entry(info, idx), i, idx))
+	minx = min(p[0][0] for p in allPts)
+	miny = min(p[0][1] for p in allPts)
+	maxx = max(p[0][0] for p in allPts)
+	maxy = max(p[0][1] for p in allPts)
+	#About one point per cell. If the points are all in a line, that's zero
+	#area- go by the length instead, or there'd be a huge number of cells
+	cell = max(math.sqrt((maxx - minx) * (maxy - miny) / len(allPts)), max(maxx - minx, maxy - miny) / len(allPts), 1e-3)
+	
+	grid = {}
+	for entry in allPts:
+		key = (int((entry[0][0] - minx) / cell), int((entry[0][1] - miny) / cell))
+		grid.setdefault(key, []).append(entry)
+	(gw, gh) = (int((maxx - minx) / cell), int((maxy - miny) / cell))
+	
+	visited = [False] * n
+	order = []
+	#Start from whatever is closest to the origin- found directly, since the
+	#origin can be a long way from the grid
+	(p, i, idx) = min(allPts, key=lambda entry: _dist((0.0, 0.0), entry[0]))
+	(visited[i], starts[i]) = (True, idx)
+	order.append(i)
+	cur = _exit(infos[i], idx)
+	while len(order) < n:
+		if time.time() > deadline:
+			order += [i for i in range(n) if not visited[i]]
+			break
+		cx = int(math.floor((cur[0] - minx) / cell))
+		cy = int(math.floor((cur[1] - miny) / cell))
+		best = None
+		bestd = float("inf")
+		#Rings that don't reach the grid are empty (open curves can end
+		#outside it), and after the last one that does, there's nothing left
+		ring = max(0, -cx, cx - gw, -cy, cy - gh)
+		lastRing = max(cx, gw - cx, cy, gh - cy)
+		#Once something is found, keep going until the rings are further
+		#away than it is
+		while ring <= lastRing and (best == None or (ring - 1) * cell <= bestd):
+			for key in _ringCells(cx, cy, ring, gw, gh):
+				for (p, i, idx) in grid.get(key, ()):
+					if visited[i]:
+						continue
+					d = _dist(cur, p)
+					if d < bestd:
+						bestd = d
+						best = (i, idx)
+			ring += 1
+		
+		(i, idx) = best
+		visited[i] = True
+		starts[i] = idx
+		order.append(i)
+		cur = _exit(infos[i], idx)
+	
+	return (order, starts)
+
+
+#Cost of the links inside order[i..j], in the direction given
+def _innerCost(infos, order, starts, i, j, reverse):
+	total = 0.0
+	for k in range(i, j):
+		if reverse:
+			(a, b) = (order[k + 1], order[k])
+		else:
+			(a, b) = (order[k], order[k + 1])
+		total += _dist(_exit(infos[a], starts[a]), _entry(infos[b], starts[b]))
+	return total
+
+
+#2-opt: keep reversing stretches of the tour while that shortens it, until
+#nothing helps or we run out of time
+def _twoOpt(infos, order, starts, deadline):
+	n = len(order)
+	link = lambda a, b: _dist(_exit(infos[a], starts[a]), _entry(infos[b], starts[b]))
+	improved = True
+	while improved:
+		improved = False
+		for i in range(1, n - 1):
+			if time.time() > deadline:
+				return order
+			for j in range(i + 1, n):
+				a = order[i - 1]
+				b = order[i]
+				c = order[j]
+				old = link(a, b)
+				new = link(a, c)
+				if j + 1 < n:
+					d = order[j + 1]
+					old += link(c, d)
+					new += link(b, d)
+				if new >= old - 1e-9:
+					continue
+				#Reversing the stretch only flips its inner links; that's free
+				#for closed curves, but not for open ones
+				if not all(infos[k][1] for k in order[i:j + 1]):
+					new += _innerCost(infos, order, starts, i, j, True)
+					old += _innerCost(infos, order, starts, i, j, False)
+					if new >= old - 1e-9:
+						continue
+				order[i:j + 1] = order[i:j + 1][::-1]
+				improved = True
+	return order
+
+
+#Now that the order is fixed, start each closed curve at the candidate
+#closest to where the previous one left off
+def _pickStarts(infos, order, starts):
+	cur = None
+	for i in order:
+		info = infos[i]
+		if info[1] and cur != None:
+			starts[i] = min(info[2], key=lambda idx: _dist(cur, _entry(info, idx)))
+		cur = _exit(info, starts[i])
+	return starts
+
+
+#Reorders curves (and shifts the start of closed ones) to minimize rapid
+#travel between them, spending at most about timeBudget seconds on it
+#entries: where the tool enters each curve, as (x, y), or None for its start
+#Returns (reordered list of curves, rapid distance before, rapid distance after)
+def orderCurves(curves, timeBudget=DEFAULT_TIME_BUDGET, entries=None):
+	if len(curves) < 2:
+		return (list(curves), 0.0, 0.0)
+	deadline = time.time() + timeBudget
+	
+	if entries == None:
+		entries = [None] * len(curves)
+	infos = [_curveInfo(c, e) for (c, e) in zip(curves, entries)]
+	before = _rapidLength(infos, range(len(infos)), [info[2][0] for info in infos])
+	
+	(order, starts) = _nearestNeighbor(infos, deadline)
+	order = _twoOpt(infos, order, starts, deadline)
+	starts = _pickStarts(infos, order, starts)
+	
+	#Never make things worse than what we were given
+	after = _rapidLength(infos, order, starts)
+	if after >= before:
+		return (list(curves), before, before)
+	
+	for i in order:
+		if starts[i] != 0:
+			curves[i].shiftStart(starts[i])
+	return ([curves[i] for i in order], before, after)
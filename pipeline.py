@@ -0,0 +1,757 @@
+#Importable version of everything dannycam.py does
+#A Job holds the options for turning one DXF into one GCode file, and runs
+#the stages in order:
+#	load -> combine -> pocket -> compact -> order -> emit -> save -> simulate
+#With pipelined, pocket -> compact -> order -> emit are replaced by stream,
+#which overlaps them region by region, where it can.
+#With a rest tool, pocket also works out a second toolpath for a smaller
+#tool over whatever the first one couldn't reach, and the two go into one
+#program with a tool change between them.
+#Each stage can be called on its own (later stages call earlier ones if they
+#haven't run yet), or run() does the lot. Problems are raised as
+#DannyCamError rather than printed, so this can be driven from other code.
+
+import os.path
+import area
+import gcode
+import combine
+import pocket
+import areautil
+import toolpathcache
+import ordering
+import estimate
+import compact
+import curvearray
+import stats
+import simulate
+import toolpathfile
+import dxf
+import writer
+import itertools
+
+#Defaults
+DEFAULT_ZSAFE=25.4
+DEFAULT_FEED=30*25.4
+DEFAULT_FEEDZ=50
+DEFAULT_TOOLD=6.35
+DEFAULT_RPM=10000
+DEFAULT_JOBS=1
+DEFAULT_ZMIN=0
+DEFAULT_ZMAX=1
+DEFAULT_CLEARANCE=1
+DEFAULT_SIMULATE=simulate.DEFAULT_RESOLUTION
+
+
+class DannyCamError(Exception):
+	pass
+
+
+#Default output file: the input filename, with ".dxf" replaced with ".ngc"
+def defaultOutput(inputfile):
+	return inputfile.split(".dxf")[0] + ".ngc"
+
+
+class Job(object):
+	#stepover and cutdepth default (None) to ToolD/2 and ToolD/10
+	#zclear defaults to zmax + DEFAULT_CLEARANCE
+	#machine is an estimate profile (see estimate.makeProfile)
+	#compact is the tolerance (mm) for merging segments and fitting arcs to
+	#the toolpath; None skips that
+	#adaptive is (min, max) multipliers for feed, to scale it per move by how
+	#much the tool is engaged (see adaptive.py); None keeps it constant
+	#resttool is the diameter of a smaller tool to clean up after this one
+	#(rest machining); None for just the one tool. reststepover defaults to
+	#half of it, and restfeed/restrpm to the first tool's. Its depth per
+	#pass is cutdepth scaled down by the ratio of the diameters
+	#simulate is the grid spacing (mm) for checking the program on a
+	#heightmap of the stock afterwards (see simulate.py); None skips that.
+	#With trimair, the air cuts it finds are turned into rapids
+	#array is (columns, rows) of copies of the part to cut, pitch (dx, dy)
+	#apart (default: its size plus a tool diameter); the toolpath is only
+	#worked out (and written) once, and called for each copy
+	#savetoolpath is a file to save the finished toolpath to, so it can be
+	#posted again later without redoing the geometry (see toolpathfile.py)
+	#pipelined writes the GCode a region at a time, as each is pocketed,
+	#rather than waiting for all of them (see stream())
+	#layers/excludelayers/entities: lists of DXF layers to read (None: all),
+	#layers to skip, and entity types to read (None: all); see dxf.py
+	#simplify is the tolerance (mm) for cleaning up and simplifying the DXF's
+	#outlines before anything else is done with them (see
+	#compact.simplifyList); None reads them as they are
+	#collectstats keeps per-stage timings, counts and memory use in
+	#self.stats (see stats.Stats); verbose also turns on progress reports
+	def __init__(self, inputfile, outputfile=None, toold=DEFAULT_TOOLD, stepover=None, cutdepth=None,
+			feed=DEFAULT_FEED, feedz=DEFAULT_FEEDZ, rpm=DEFAULT_RPM, zsafe=DEFAULT_ZSAFE,
+			zmin=DEFAULT_ZMIN, zmax=DEFAULT_ZMAX, zclear=None, climb=False, link=False,
+			jobs=DEFAULT_JOBS, cache=True, cachedir=toolpathcache.DEFAULT_CACHE_DIR,
+			cachesize=toolpathcache.DEFAULT_CACHE_SIZE, ordertime=ordering.DEFAULT_TIME_BUDGET,
+			machine=None, compact=None, adaptive=None, resttool=None, reststepover=None, restfeed=None,
+			restrpm=None, simulate=None, trimair=False, array=None, pitch=None, savetoolpath=None, pipelined=False, layers=None, excludelayers=None, entities=None, simplify=None, collectstats=False, verbose=True):
+		self.inputfile = inputfile
+		if outputfile == None:
+			outputfile = defaultOutput(inputfile)
+		self.outputfile = outputfile
+		self.verbose = verbose
+		self.toold = toold
+		self.feed = feed
+		self.feedz = feedz
+		self.rpm = rpm
+		self.zsafe = zsafe
+		self.zmin = zmin
+		self.zmax = zmax
+		self.climb = climb
+		self.link = link
+		self.jobs = max(1, jobs)
+		self.cache = cache
+		self.cachedir = cachedir
+		self.cachesize = cachesize
+		self.ordertime = ordertime
+		self.machine = estimate.makeProfile(machine)
+		self.compactTol = compact
+		self.adaptive = adaptive
+		if trimair and simulate == None:
+			simulate = DEFAULT_SIMULATE
+		self.simresolution = simulate
+		self.trimair = trimair
+		self.savetoolpath = savetoolpath
+		#The simulator only knows about one copy of the part
+		if array != None and simulate != None:
+			raise DannyCamError("Can't simulate an array of parts; check a single one first")
+		self.array = array
+		self.pitch = pitch
+		self.pipelined = pipelined
+		self.layers = layers
+		self.excludelayers = excludelayers
+		self.entities = entities
+		self.simplifyTol = simplify
+		
+		#Stepover needs special handling- it can't be bigger than the tool
+		if stepover == None or stepover <= 0:
+			self.log("Stepover either not specified or negative; using default ToolD/2 (" + str(toold/2) + " mm)")
+			stepover = toold/2
+		elif stepover > toold:
+			raise DannyCamError("Specified stepover (" + str(stepover) + " mm) is greater than the tool diameter (" + str(toold) + " mm)")
+		self.stepover = stepover
+		
+		#Similarly, cutdepth needs special handling- default based on tool size
+		if cutdepth == None or cutdepth <= 0:
+			self.log("Cut depth either not specified or negative; using default ToolD/10 (" + str(toold/10) + " mm)")
+			cutdepth = toold/10
+		elif cutdepth > toold/2:
+			self.log("########")
+			self.log("WARNING: Specified cut depth (" + str(cutdepth) + " mm) is greater than ToolD/2 (" + str(toold/2) + " mm). This is generally frowned upon unless you're cutting very soft materials!")
+			self.log("########")
+		self.cutdepth = cutdepth
+		
+		#The rest tool has to be the smaller one, or there's nothing for it
+		#to reach
+		self.resttool = resttool
+		(self.reststepover, self.restfeed, self.restrpm, self.restcutdepth) = (None, None, None, None)
+		if resttool != None:
+			if resttool <= 0 or resttool >= toold:
+				raise DannyCamError("Rest tool (" + str(resttool) + " mm) must be smaller than the tool diameter (" + str(toold) + " mm)")
+			if reststepover == None or reststepover <= 0:
+				reststepover = resttool/2
+			elif reststepover > resttool:
+				raise DannyCamError("Specified rest stepover (" + str(reststepover) + " mm) is greater than the rest tool diameter (" + str(resttool) + " mm)")
+			self.reststepover = reststepover
+			self.restfeed = restfeed or feed
+			self.restrpm = restrpm or rpm
+			self.restcutdepth = cutdepth * resttool / toold
+		
+		if zclear == None:
+			zclear = min(zmax + DEFAULT_CLEARANCE, zsafe)
+		self.zclear = zclear
+		
+		#Results, filled in by the stages
+		self.areas = None
+		self.combined = None
+		self.curves = None
+		self.regions = None
+		self.centers = None
+		self.restCurves = None
+		self.restRegions = None
+		self.restCenters = None
+		self.bbox = None
+		self.fromCache = False
+		self.cachekey = None
+		self.rapidBefore = None
+		self.rapidAfter = None
+		self.times = None
+		self.compactStats = None
+		self.simplifyStats = None
+		self.simResult = None
+		self.trimmed = None
+		self.stats = None
+		if collectstats:
+			self.stats = stats.Stats()
+	
+	def log(self, msg):
+		if self.verbose:
+			print msg
+	
+	#Stage timing, if it's being kept
+	def begin(self, name, inputs=None):
+		if self.stats != None:
+			self.stats.begin(name, inputs)
+	
+	def end(self, outputs=None):
+		if self.stats != None:
+			self.stats.end(outputs)
+	
+	#Prints the settings in use
+	def describe(self):
+		self.log("")
+		self.log("Input file is: " + str(self.inputfile))
+		if self.layers != None:
+			self.log("Reading layers: " + ", ".join(self.layers))
+		if self.excludelayers != None:
+			self.log("Skipping layers: " + ", ".join(self.excludelayers))
+		if self.entities != None:
+			self.log("Reading entities: " + ", ".join(self.entities))
+		if self.simplifyTol != None:
+			self.log("Simplifying input to within " + str(self.simplifyTol) + " mm")
+		self.log("Feed rate is: " + str(self.feed) + " mm/min")
+		self.log("ZSafe is: " + str(self.zsafe) + " mm")
+		self.log("Cutting from Z=" + str(self.zmax) + " to Z=" + str(self.zmin) + " mm, " + str(self.cutdepth) + " mm per pass")
+		self.log("ToolD is: " + str(self.toold) + " mm")
+		self.log("Stepover is: " + str(self.stepover) + " mm")
+		self.log("Spindle RPM is: " + str(self.rpm) + " RPM")
+		if self.resttool != None:
+			self.log("Rest tool is: " + str(self.resttool) + " mm, stepover " + str(self.reststepover) + " mm, " + str(self.restcutdepth) + " mm per pass, " + str(self.restfeed) + " mm/min at " + str(self.restrpm) + " RPM")
+		if self.array != None:
+			pitch = "spaced a tool diameter apart"
+			if self.pitch != None:
+				pitch = str(self.pitch[0]) + " x " + str(self.pitch[1]) + " mm apart"
+			self.log("Cutting " + str(self.array[0]) + " x " + str(self.array[1]) + " copies, " + pitch)
+		self.log("")
+	
+	#Reads the DXF (simplifying it, if asked to) and splits it into one area
+	#per polygon
+	#If the toolpath cache already has this job, that's used instead, and
+	#combine/pocket have nothing left to do
+	def load(self):
+		if not os.path.isfile(self.inputfile):
+			raise DannyCamError("Couldn't open file \"" + self.inputfile + "\"")
+		#Before doing too much work, check to see if we can even write the
+		#requested output file
+		if not os.access(os.path.dirname(os.path.abspath(self.outputfile)), os.W_OK):
+			raise DannyCamError("Can't write output file " + self.outputfile)
+		
+		#The geometry stage only depends on the DXF and a few options- if
+		#we've done this exact job before, reuse the toolpath
+		if self.cache:
+			rest = None
+			if self.resttool != None:
+				rest = (self.resttool, self.reststepover)
+			perRegion = self.streams() or self.jobs > 1
+			self.cachekey = toolpathcache.cacheKey(self.inputfile, self.toold, self.stepover, self.climb, rest, self.dxfFilter(), self.simplifyTol, perRegion)
+			cached = toolpathcache.load(self.cachedir, self.cachekey)
+			if cached != None:
+				self.log("Using cached toolpaths")
+				(self.curves, self.bbox, self.regions, self.centers, rest) = cached
+				if rest != None:
+					(self.restCurves, self.restRegions, self.restCenters) = rest
+				self.fromCache = True
+				return
+		
+		self.begin("read")
+		newarea = self.readDxf()
+		self.end(newarea)
+		
+		#Every vertex left out here is one less for the booleans and
+		#pocketing to chew through
+		if self.simplifyTol != None and self.simplifyTol > 0:
+			self.begin("simplify", newarea)
+			(newarea, verts) = compact.simplifyArea(newarea, self.simplifyTol)
+			self.end(newarea)
+			self.simplifyStats = verts
+			fewer = 0
+			if verts[0] > 0:
+				fewer = 100 * (verts[0] - verts[1]) / verts[0]
+			self.log("Simplified input: " + str(verts[0]) + " -> " + str(verts[1]) + " vertices (" + str(fewer) + "% fewer)")
+		
+		#This makes sure curves are set up for climb milling
+		self.begin("reorder", newarea)
+		newarea.Reorder();
+		self.end(newarea)
+		
+		#One area for each polygon
+		self.begin("split", newarea)
+		self.areas = newarea.Split();
+		self.end(self.areas)
+		
+		if len(self.areas) == 0:
+			raise DannyCamError("No areas in DXF file")
+		
+		self.bbox = areautil.areaBox(newarea)
+		self.log("Split read DXF into " + str(len(self.areas)) + " section(s)")
+	
+	#The DXF filters, if any, as a tuple; None if everything is read
+	def dxfFilter(self):
+		if self.layers == None and self.excludelayers == None and self.entities == None:
+			return None
+		return (self.layers, self.excludelayers, self.entities)
+	
+	#Reads the DXF into an area with dxf.py (through its sidecar, if the
+	#cache is on). Without any filters, files it can't fully understand
+	#(entities it can't read, or no outlines at all) go to libarea's own
+	#reader, as they always used to
+	def readDxf(self):
+		try:
+			(curves, info, cached) = dxf.readCached(self.inputfile, self.layers, self.excludelayers, self.entities, self.cache)
+		except ValueError, e:
+			raise DannyCamError(str(e))
+		if cached:
+			self.log("Read geometry from " + dxf.sidecarPath(self.inputfile))
+		filtering = self.dxfFilter() != None
+		if info["unsupported"]:
+			skipped = ", ".join([str(n) + " " + kind for (kind, n) in sorted(info["unsupported"].items())])
+			if not filtering:
+				self.log("DXF has entities that can't be read directly (" + skipped + "); reading it with libarea instead")
+				#set_units doesn't actually seem to do anything
+				#area.set_units(1)
+				return area.AreaFromDxf(self.inputfile)
+			self.log("WARNING: Skipped entities that can't be read: " + skipped)
+		if len(curves) == 0 and not filtering:
+			return area.AreaFromDxf(self.inputfile)
+		
+		if info["filtered"] > 0:
+			self.log("Filtered out " + str(info["filtered"]) + " entities")
+		if info["open"] > 0:
+			self.log("WARNING: Left out " + str(info["open"]) + " outline(s) that don't close")
+		if info["units"] != 1.0:
+			self.log("Scaled DXF units to mm (x" + str(info["units"]) + ")")
+		return areautil.areaFromList(curves)
+	
+	#XOR all of the sub-areas. Kind of hack-y, but should give a good
+	#approximation of what was intended with the DXF
+	def combine(self):
+		if self.areas == None and not self.fromCache:
+			self.load()
+		if self.fromCache:
+			return
+		self.log("Performing XOR operations")
+		self.begin("combine", self.areas)
+		self.combined = combine.xorAll(self.areas, self.jobs, self.verbose)
+		self.end(self.combined)
+	
+	#Pockets each region of the combined area (in parallel, if requested),
+	#and makes sure every curve runs in the right direction
+	def pocket(self):
+		if self.combined == None and not self.fromCache:
+			self.combine()
+		if self.fromCache:
+			return
+		
+		self.log("Generating toolpaths")
+		(self.curves, self.regions, self.centers, rest) = self.toolpaths(self.combined)
+		if rest != None:
+			(self.restCurves, self.restRegions, self.restCenters) = rest
+		if self.cache:
+			toolpathcache.store(self.cachedir, self.cachekey, self.curves, self.bbox, self.regions, self.centers, self.cachesize, rest)
+	
+	#Pockets an area (normally self.combined) with this job's tool, and the
+	#rest tool if there is one, and makes sure every curve runs in the right
+	#direction. Returns (curves, regions, helix centers, rest), where rest is
+	#the same three for the rest tool, or None
+	def toolpaths(self, combined):
+		#Each part of the returned list is a disjoint chunk of the path
+		self.begin("pocket", combined)
+		curves = pocket.pocketRegions(combined, self.toold, self.stepover, self.jobs, self.verbose)
+		self.end(curves)
+		
+		self.begin("direction", curves)
+		pocket.setDirection(curves, self.climb)
+		self.end(curves)
+		
+		self.begin("regions", combined)
+		regions = combined.Split()
+		self.end(regions)
+		#Where each curve can be helixed into doesn't depend on feeds or
+		#depths, so it's worked out here and cached with the toolpath
+		self.begin("plunges", curves)
+		centers = gcode.helixCenters(curves, self.toold)
+		self.end()
+		
+		rest = None
+		if self.resttool != None:
+			rest = self.pocketRest(combined)
+		return (curves, regions, centers, rest)
+	
+	#Rest machining: pockets whatever the first tool couldn't reach in
+	#combined with the rest tool (see pocket.restArea). Returns (curves,
+	#regions, helix centers)
+	def pocketRest(self, combined):
+		self.log("Generating rest toolpaths for " + str(self.resttool) + " mm tool")
+		self.begin("rest", combined)
+		remaining = pocket.restArea(combined, self.toold, self.resttool, gcode.pathTolerance)
+		self.end(remaining)
+		
+		self.begin("restpocket", remaining)
+		curves = []
+		if remaining.num_curves() > 0:
+			curves = pocket.pocketRegions(remaining, self.resttool, self.reststepover, self.jobs, self.verbose)
+			pocket.setDirection(curves, self.climb)
+		self.end(curves)
+		
+		return (curves, remaining.Split(), gcode.helixCenters(curves, self.resttool))
+	
+	#Merges collinear segments and fits arcs to the toolpath, if asked to
+	#Done after the cache, so the tolerance can change without invalidating it
+	def compact(self):
+		if self.curves == None:
+			self.pocket()
+		if self.compactTol == None or self.compactTol <= 0:
+			return
+		self.begin("compact", self.curves)
+		(self.curves, verts, lines) = compact.compactCurves(self.curves, self.compactTol)
+		if self.restCurves:
+			(self.restCurves, restVerts, restLines) = compact.compactCurves(self.restCurves, self.compactTol)
+			verts = (verts[0] + restVerts[0], verts[1] + restVerts[1])
+			lines = (lines[0] + restLines[0], lines[1] + restLines[1])
+		self.end(self.curves)
+		self.compactStats = (verts, lines)
+		self.log("Compacted toolpaths: " + str(verts[0]) + " -> " + str(verts[1]) + " vertices, " + str(lines[0]) + " -> " + str(lines[1]) + " line segments")
+	
+	#Cuts the sections in an order that keeps rapids short
+	def order(self):
+		if self.curves == None:
+			self.pocket()
+		self.log("Found " + str(len(self.curves)) + " discrete section(s) to machine")
+		if self.restCurves != None:
+			self.log("Found " + str(len(self.restCurves)) + " section(s) for the rest tool")
+		if self.ordertime <= 0:
+			return
+		self.log("Ordering sections")
+		self.begin("order", self.curves)
+		(self.curves, self.centers, self.rapidBefore, self.rapidAfter) = self._orderCurves(self.curves, self.centers, self.toold)
+		self.end(self.curves)
+		if self.restCurves:
+			self.begin("restorder", self.restCurves)
+			(self.restCurves, self.restCenters, before, after) = self._orderCurves(self.restCurves, self.restCenters, self.resttool)
+			self.end(self.restCurves)
+			self.rapidBefore += before
+			self.rapidAfter += after
+		self.log("Rapid travel between sections: " + str("%.2f" % self.rapidBefore) + " mm -> " + str("%.2f" % self.rapidAfter) + " mm")
+	
+	#Orders one tool's curves (see ordering.orderCurves), keeping their helix
+	#centers with them, in timeBudget seconds (default ordertime). Returns
+	#(curves, centers, rapid before, rapid after)
+	def _orderCurves(self, curves, centers, toolD, timeBudget=None):
+		#Curves that get a helix are entered at the helix, not their start
+		entries = []
+		for center in centers:
+			if center == None:
+				entries.append(None)
+			else:
+				entries.append(gcode.helixStart(area.Point(center[0], center[1]), toolD))
+		byCurve = dict(zip([id(c) for c in curves], centers))
+		if timeBudget == None:
+			timeBudget = self.ordertime
+		(curves, before, after) = ordering.orderCurves(curves, timeBudget, entries)
+		return (curves, [byCurve[id(c)] for c in curves], before, after)
+	
+	#Saves the ordered toolpath, for repost.py, if asked to
+	def save(self):
+		if self.savetoolpath == None:
+			return
+		if self.curves == None:
+			self.order()
+		parts = [(self.curves, self.toold, self.stepover, self.regions, self.centers)]
+		if self.restCurves:
+			parts.append((self.restCurves, self.resttool, self.reststepover, self.restRegions, self.restCenters))
+		self.log("Saving toolpath to " + self.savetoolpath)
+		self.begin("save", self.curves)
+		try:
+			toolpathfile.save(self.savetoolpath, parts, {"input": self.inputfile, "climb": self.climb, "bbox": self.bbox})
+		except IOError, e:
+			raise DannyCamError("Couldn't save toolpath to " + self.savetoolpath + ": " + str(e))
+		self.end()
+	
+	#Writes the GCode to the output file, then estimates how long it'll take
+	#to run
+	def emit(self):
+		if self.curves == None:
+			self.order()
+		
+		fout = self._openOutput()
+		
+		#Generate actual gcode listing, writing it out to the file as we go
+		self.log("Generating gcode")
+		#Stay-down linking needs to know which region each curve is clearing
+		regions = None
+		restRegions = None
+		if self.link:
+			regions = self.regions
+			restRegions = self.restRegions
+		#With a rest tool, each tool gets its own part of the program, with a
+		#tool change at the start of each
+		parts = [(self.curves, self.toold, self.stepover, self.cutdepth, self.feed, self.rpm, regions, self.centers)]
+		if self.restCurves:
+			parts.append((self.restCurves, self.resttool, self.reststepover, self.restcutdepth, self.restfeed, self.restrpm, restRegions, self.restCenters))
+		placements = None
+		if self.array != None:
+			placements = gcode.arrayPlacements(self.array[0], self.array[1], *self.arrayPitch())
+		#One chunk per curve per layer, plus the start and end of each part
+		progress = None
+		if self.verbose:
+			total = sum([len(part[0]) * len(gcode.depthLevels(self.zmin, part[3], self.zmax)) + 2 for part in parts])
+			progress = stats.Progress("Writing gcode", total)
+		self.begin("gcode", self.curves)
+		try:
+			written = gcode.partsToFile(fout, parts, self.zsafe, self.zmin, self.zmax, self.feedz, self.zclear, progress, self.adaptive, placements)
+		finally:
+			self._closeOutput(fout)
+		self.end()
+		#generate() complains and writes nothing if it doesn't like its
+		#arguments- but with more than one tool, the ones before may have
+		#been written already
+		if written == 0:
+			self._discardOutput()
+			raise DannyCamError("GCode generation failed")
+		self.estimateTime()
+	
+	#Output file, written from a background thread (see writer.py)
+	def _openOutput(self):
+		#Use a generous buffer- GCode is streamed out a curve at a time
+		try:
+			return writer.Writer(open(self.outputfile, 'w', 1 << 16))
+		except IOError, e:
+			raise DannyCamError("Couldn't open output file " + self.outputfile + ": " + str(e))
+	
+	def _closeOutput(self, fout):
+		try:
+			fout.close()
+		except IOError, e:
+			raise DannyCamError("Couldn't write output file " + self.outputfile + ": " + str(e))
+	
+	#Deletes a program that couldn't be finished, so nothing tries to run it
+	def _discardOutput(self):
+		try:
+			os.remove(self.outputfile)
+		except OSError:
+			pass
+	
+	#The time estimate walks the program we just wrote, so it counts every
+	#layer, plunge and rapid, not just the XY path
+	def estimateTime(self):
+		self.begin("estimate")
+		self.times = estimate.estimateFile(self.outputfile, self.machine)
+		self.end()
+	
+	#Pipelined pocket -> compact -> order -> emit: the regions are ordered
+	#first, then pocketed (in the pool, with more than one job) in that order,
+	#and each one is compacted, ordered and written out as soon as it's ready,
+	#while later ones are still being pocketed. The GCode starts appearing
+	#after one region rather than all of them, and with more than one job,
+	#writing overlaps pocketing.
+	#The catch is that sections are only ordered within their own region, and
+	#never linked to another region's, so the program can take a bit longer
+	#to run than a staged one.
+	#Returns False, having done nothing, if the job can't be pipelined (see
+	#streams()), or a cached toolpath left nothing to pocket
+	def stream(self):
+		if self.combined == None and not self.fromCache:
+			self.combine()
+		if self.fromCache or not self.streams():
+			return False
+		
+		self.log("Generating toolpaths and gcode a region at a time")
+		regions = [r for r in self.combined.Split() if r.num_curves() > 0]
+		(self.curves, self.centers, self.regions) = ([], [], regions)
+		#Half the ordering time goes on the regions, and the other half is
+		#shared out between them
+		budget = self.ordertime / 2.
+		if self.ordertime > 0:
+			(self.rapidBefore, self.rapidAfter) = (0., 0.)
+			if len(regions) > 1:
+				self.begin("regionorder", regions)
+				outlines = [r.getCurves()[0] for r in regions]
+				byOutline = dict(zip([id(c) for c in outlines], regions))
+				(outlines, self.rapidBefore, self.rapidAfter) = ordering.orderCurves(outlines, budget)
+				self.regions = regions = [byOutline[id(c)] for c in outlines]
+				self.end(regions)
+		compacting = self.compactTol != None and self.compactTol > 0
+		if compacting:
+			self.compactStats = ((0, 0), (0, 0))
+		#The cache wants the toolpath as it comes out of pocketing
+		(raw, rawCenters) = ([], [])
+		
+		progress = None
+		if self.verbose:
+			progress = stats.Progress("Pocketing and writing " + str(len(regions)) + " region(s)", len(regions))
+		fout = self._openOutput()
+		em = gcode.Emitter(self.feed, self.feedz, self.zsafe)
+		self.begin("stream", self.combined)
+		failed = False
+		try:
+			fout.write(gcode.preamble(self.rpm))
+			for (region, curves) in itertools.izip(regions, pocket.iterRegions(regions, self.toold, self.stepover, self.jobs)):
+				pocket.setDirection(curves, self.climb)
+				centers = gcode.helixCenters(curves, self.toold)
+				if self.cache:
+					raw += [areautil.curveToList(c) for c in curves]
+					rawCenters += centers
+				if compacting:
+					(curves, verts, lines) = compact.compactCurves(curves, self.compactTol)
+					(v, l) = self.compactStats
+					self.compactStats = ((v[0] + verts[0], v[1] + verts[1]), (l[0] + lines[0], l[1] + lines[1]))
+				if self.ordertime > 0:
+					(curves, centers, before, after) = self._orderCurves(curves, centers, self.toold, budget / len(regions))
+					self.rapidBefore += before
+					self.rapidAfter += after
+				
+				zones = None
+				if self.link:
+					zones = [region]
+				chunks = 0
+				for chunk in gcode.generateIter(curves, self.zsafe, self.zmin, self.cutdepth, self.zmax, self.feed, self.feedz, self.toold, self.stepover, self.rpm, zones, self.zclear, centers, self.adaptive, start=False, end=False, sectionBase=len(self.curves), em=em):
+					fout.write(chunk)
+					chunks += 1
+				#generateIter complains and writes nothing if it doesn't like
+				#its arguments
+				if chunks == 0:
+					failed = True
+					break
+				self.curves += curves
+				self.centers += centers
+				if progress != None:
+					progress.advance()
+			if not failed:
+				fout.write("\nM2\n")
+		finally:
+			self._closeOutput(fout)
+		#Earlier regions are already written, so the program's only half there
+		if failed:
+			self._discardOutput()
+			raise DannyCamError("GCode generation failed")
+		self.end(self.curves)
+		self.log("Wrote " + str(len(self.curves)) + " discrete section(s)")
+		
+		if self.cache:
+			toolpathcache.store(self.cachedir, self.cachekey, [areautil.curveFromList(verts) for verts in raw], self.bbox, regions, rawCenters, self.cachesize)
+		self.estimateTime()
+		return True
+	
+	#True if run() pockets and writes a region at a time: pipelined, and
+	#without a rest tool or an array, which need every region's toolpath
+	#before writing anything
+	def streams(self):
+		return self.pipelined and self.resttool == None and self.array == None
+	
+	#Distance (dx, dy) between copies of the part: pitch if it was given,
+	#otherwise the part's size plus a tool diameter
+	def arrayPitch(self):
+		if self.pitch != None:
+			return self.pitch
+		(minx, miny, maxx, maxy) = self.bbox
+		return (maxx - minx + self.toold, maxy - miny + self.toold)
+	
+	#Replays the program on a heightmap of the stock to check it, and turns
+	#air cuts into rapids if asked to
+	def simulate(self):
+		if self.simresolution == None:
+			return
+		if self.times == None:
+			self.emit()
+		if simulate.numpy == None:
+			raise DannyCamError("Simulation needs NumPy")
+		
+		self.log("Simulating")
+		fin = open(self.outputfile, 'r')
+		try:
+			lines = fin.readlines()
+		finally:
+			fin.close()
+		tools = {1: self.toold}
+		if self.resttool != None:
+			tools[2] = self.resttool
+		self.begin("simulate")
+		self.simResult = simulate.simulate(lines, self.toold, self.zmin, self.zmax, self.simresolution, self.regions, tools)
+		self.end()
+		for line in simulate.report(self.simResult):
+			self.log(line)
+		if not self.trimair or len(self.simResult["air"]) == 0:
+			return
+		
+		#Write the new program next to the old one and swap it in
+		(lines, self.trimmed) = simulate.trimAir(lines, self.simResult)
+		before = self.times["total"]
+		tmpPath = self.outputfile + ".tmp"
+		try:
+			fout = open(tmpPath, 'w', 1 << 16)
+			try:
+				fout.writelines(lines)
+			finally:
+				fout.close()
+			os.rename(tmpPath, self.outputfile)
+		except:
+			#The untrimmed program is still there; don't leave half of the
+			#trimmed one next to it
+			try:
+				os.remove(tmpPath)
+			except OSError:
+				pass
+			raise
+		self.times = estimate.estimateFile(self.outputfile, self.machine)
+		self.log("Trimmed " + str(self.trimmed) + " air cut(s): " + estimate.formatTime(before) + " -> " + estimate.formatTime(self.times["total"]))
+	
+	#Length of one pass over all of the toolpaths (both tools')
+	def pathLength(self):
+		curves = self.curves + (self.restCurves or [])
+		return sum([curvearray.length(curvearray.fromCurve(c)) for c in curves])
+	
+	#Plain-data summary of the results
+	def summary(self):
+		result = {
+			"input": self.inputfile,
+			"output": self.outputfile,
+			"cached": self.fromCache,
+		}
+		if self.curves != None:
+			result["sections"] = len(self.curves)
+			if self.restCurves != None:
+				result["restSections"] = len(self.restCurves)
+			result["pathLength"] = self.pathLength()
+		if self.bbox != None:
+			result["bbox"] = list(self.bbox)
+		if self.array != None:
+			result["copies"] = self.array[0] * self.array[1]
+		if self.rapidBefore != None:
+			result["rapidBefore"] = self.rapidBefore
+			result["rapidAfter"] = self.rapidAfter
+		if self.times != None:
+			result["time"] = self.times["total"]
+		if self.simplifyStats != None:
+			result["inputVertices"] = list(self.simplifyStats)
+		if self.compactStats != None:
+			result["vertices"] = list(self.compactStats[0])
+			result["lines"] = list(self.compactStats[1])
+		if self.simResult != None:
+			sim = {}
+			for key in ("resolution", "removed", "airLength", "floorGouge", "leftoverArea", "leftoverVolume", "wallArea"):
+				if key in self.simResult:
+					sim[key] = self.simResult[key]
+			for key in ("air", "gouges", "crashes"):
+				sim[key] = len(self.simResult[key])
+			if self.trimmed != None:
+				sim["trimmed"] = self.trimmed
+			result["simulation"] = sim
+		if self.stats != None:
+			result["stats"] = self.stats.toDict()
+		return result
+	
+	#Runs every stage; returns summary()
+	def run(self):
+		self.describe()
+		self.load()
+		if not (self.pipelined and self.stream()):
+			self.combine()
+			self.pocket()
+			self.compact()
+			self.order()
+			self.emit()
+		self.save()
+		self.simulate()
+		return self.summary()
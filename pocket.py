@@ -0,0 +1,123 @@
+#Pocket toolpath generation
+#The combined area is usually a set of disjoint regions, and libarea pockets
+#each of them independently anyway, so the regions can be farmed out to a
+#process pool and the results stitched back together in region order.
+
+import multiprocessing
+import collections
+import stats
+from areautil import curveToList, curveFromList, areaToList, areaFromList, deepcopy_area
+
+#How many regions per worker iterRegions keeps queued up
+REGIONS_AHEAD = 2
+
+
+#Returns a list of curves that form the pocket. Args:
+#	cutter radius- mm
+#	extra material- mm?
+#	stepover- mm
+#	from center (bool)- doesn't seem to do anything
+#	pocket mode (bool?) (true = zig_zag, false=spiral)
+#	zig angle
+#Each part of the returned list is a disjoint chunk of the path
+def pocketArea(a, toolD, stepover):
+	return list(a.MakePocketToolpath(toolD/2., 0.0, stepover, False, False, 0.0))
+
+
+#Pool worker: pockets one region, passed and returned in list form
+def _pocketList(job):
+	(region, toolD, stepover) = job
+	return [curveToList(c) for c in pocketArea(areaFromList(region), toolD, stepover)]
+
+
+#Pockets every region of an area, using up to jobs worker processes
+#Curves come back grouped by region, in the order Split() returned the
+#regions, so the output doesn't depend on which worker finishes first
+#verbose: report progress as regions finish (only with more than one job)
+def pocketRegions(a, toolD, stepover, jobs=1, verbose=False):
+	if jobs <= 1:
+		return pocketArea(a, toolD, stepover)
+	
+	regions = a.Split()
+	if len(regions) < 2:
+		return pocketArea(a, toolD, stepover)
+	
+	progress = None
+	if verbose:
+		progress = stats.Progress("Pocketing " + str(len(regions)) + " region(s)", len(regions))
+	curves = []
+	for chunk in iterRegions(regions, toolD, stepover, jobs):
+		curves += chunk
+		if progress != None:
+			progress.advance()
+	return curves
+
+
+#Pockets each of a list of regions, yielding each one's curves in turn (in
+#the order given) as soon as they're ready, so the caller can get on with
+#them while later regions are still being worked out
+#With more than one job, the regions are farmed out to a process pool; only
+#a few regions per worker are handed out ahead of the one the caller is
+#waiting on, so finished regions never pile up faster than they're used
+def iterRegions(regions, toolD, stepover, jobs=1):
+	if jobs <= 1 or len(regions) < 2:
+		for r in regions:
+			yield pocketArea(r, toolD, stepover)
+		return
+	
+	pool = multiprocessing.Pool(min(jobs, len(regions)))
+	try:
+		pending = collections.deque()
+		todo = iter(regions)
+		for r in todo:
+			pending.append(pool.apply_async(_pocketList, ((areaToList(r), toolD, stepover),)))
+			if len(pending) >= jobs * REGIONS_AHEAD:
+				break
+		while pending:
+			chunk = pending.popleft().get()
+			for r in todo:
+				pending.append(pool.apply_async(_pocketList, ((areaToList(r), toolD, stepover),)))
+				break
+			yield [curveFromList(verts) for verts in chunk]
+	finally:
+		pool.terminate()
+		pool.join()
+
+
+#Rest machining: what's left of area a for a smaller tool (of diameter restD)
+#after pocketing it with one of diameter toolD
+#The big tool reaches everything a disk of its size can sweep while staying
+#inside a- that's a shrunk by its radius, then grown back. What's left over
+#(inside corners, slots narrower than the tool) is grown by restD and clipped
+#back to a, so that the small tool, which has to stay inside whatever it's
+#given, can still reach every bit of it it could reach in a. Slivers thinner
+#than tol (rounding between the two outlines) are dropped.
+#Returns an area, possibly empty
+def restArea(a, toolD, restD, tol=0.01):
+	reached = deepcopy_area(a)
+	reached.Offset(toolD / 2.)
+	reached.Offset(-toolD / 2.)
+	
+	rest = deepcopy_area(a)
+	rest.Subtract(reached)
+	rest.Offset(tol)
+	rest.Offset(-tol)
+	if rest.num_curves() == 0:
+		return rest
+	
+	rest.Offset(-restD)
+	rest.Intersect(a)
+	return rest
+
+
+#Makes sure curves go in the direction we want
+#We're either cutting full-width slots OR reducing profiles- thus CLOCKWISE
+#is CLIMB milling, and COUNTERCLOCKWISE is CONVENTIONAL milling
+def setDirection(curves, climb):
+	for c in curves:
+		if(climb):
+			if not c.IsClockwise():
+				c.Reverse()
+		else:
+			if c.IsClockwise():
+				c.Reverse()
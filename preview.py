@@ -0,0 +1,157 @@
+#Toolpath previews
+#Each curve is flattened into a single polyline, and points closer together
+#than a pixel are dropped before anything gets drawn, so the cost of a
+#preview depends on the size of the picture rather than the number of
+#segments in the toolpath. Curves are converted to array form (see
+#curvearray) once, and with NumPy the flattening, scaling and thinning are
+#done a whole curve at a time.
+#showTk opens a window (Tkinter is only imported if it's called);
+#renderSvg/renderPng draw to files and work without a display.
+
+import struct
+import zlib
+import curvearray
+
+screenW = 800
+screenH = 600
+#Blank space around the drawing, in pixels
+MARGIN = 10
+
+
+#Works out how to fit all the curves (in array form) into a width x height
+#picture
+#Returns a function mapping (x, y) in mm to (x, y) in pixels (Y pointing
+#down), and the size of a pixel in mm. The function works on whole columns
+#of coordinates too
+def _fit(arrays, width, height):
+	boxes = [curvearray.box(verts) for verts in arrays if len(verts) > 0]
+	if not boxes:
+		return (lambda p: p, 1.0)
+	minx = min([b[0] for b in boxes])
+	maxy = max([b[3] for b in boxes])
+	spanx = max(max([b[2] for b in boxes]) - minx, 1e-6)
+	spany = max(maxy - min([b[1] for b in boxes]), 1e-6)
+	scale = min((width - 2 * MARGIN) / spanx, (height - 2 * MARGIN) / spany)
+	return (lambda p: (MARGIN + (p[0] - minx) * scale, MARGIN + (maxy - p[1]) * scale), 1.0 / scale)
+
+
+#Flattens a curve (in array form) into pixel coordinates, dropping points
+#less than a pixel from the last one kept (the end point is always kept)
+#With NumPy, points are thinned by dropping any that land in the same pixel
+#as the one before, which amounts to the same thing
+def curvePixels(verts, toPixel, pixel):
+	(xs, ys) = curvearray.flatten(verts, pixel / 2.)
+	if curvearray.isArray(verts):
+		numpy = curvearray.numpy
+		(xs, ys) = toPixel((xs, ys))
+		if len(xs) < 2:
+			return zip(xs.tolist(), ys.tolist())
+		(px, py) = (numpy.floor(xs), numpy.floor(ys))
+		keep = numpy.ones(len(xs), dtype=bool)
+		keep[1:] = (px[1:] != px[:-1]) | (py[1:] != py[:-1])
+		keep[-1] = True
+		return zip(xs[keep].tolist(), ys[keep].tolist())
+	
+	pts = [toPixel(p) for p in zip(xs, ys)]
+	if len(pts) < 2:
+		return pts
+	kept = [pts[0]]
+	for p in pts[1:-1]:
+		last = kept[-1]
+		if abs(p[0] - last[0]) >= 1 or abs(p[1] - last[1]) >= 1:
+			kept.append(p)
+	kept.append(pts[-1])
+	return kept
+
+
+#Every curve as a list of pixel coordinates
+def polylines(curves, width, height):
+	arrays = [curvearray.fromCurve(c) for c in curves]
+	(toPixel, pixel) = _fit(arrays, width, height)
+	return [curvePixels(verts, toPixel, pixel) for verts in arrays]
+
+
+def lmouse_callback(event):
+	print "YAY!"
+	
+def rmouse_callback(event):
+	print "BOO!"
+
+#Shows the curves in a window, and blocks until it's closed
+def showTk(curves, width=screenW, height=screenH):
+	from Tkinter import Tk, Canvas
+	root = Tk()
+	canvas = Canvas(root, width=width, height=height)
+	canvas.pack()
+	canvas.bind("<Button-1>", lmouse_callback);
+	canvas.bind("<Button-3>", rmouse_callback);
+	
+	#One canvas item per curve
+	for pts in polylines(curves, width, height):
+		if len(pts) > 1:
+			canvas.create_line(*[coord for p in pts for coord in p])
+	
+	root.mainloop();
+
+
+#Writes the curves out as an SVG file
+def renderSvg(curves, path, width=screenW, height=screenH):
+	fout = open(path, 'w')
+	try:
+		fout.write('<svg xmlns="http://www.w3.org/2000/svg" width="' + str(width) + '" height="' + str(height) + '">\n')
+		fout.write('<rect width="100%" height="100%" fill="white"/>\n')
+		for pts in polylines(curves, width, height):
+			if len(pts) < 2:
+				continue
+			fout.write('<polyline fill="none" stroke="black" stroke-width="1" points="')
+			fout.write(" ".join([str("%.1f,%.1f" % p) for p in pts]))
+			fout.write('"/>\n')
+		fout.write('</svg>\n')
+	finally:
+		fout.close()
+
+
+#Draws a line into a greyscale image (one byte per pixel, 0 = black)
+def _drawLine(img, width, height, p0, p1):
+	(x0, y0) = (int(round(p0[0])), int(round(p0[1])))
+	(x1, y1) = (int(round(p1[0])), int(round(p1[1])))
+	n = max(abs(x1 - x0), abs(y1 - y0), 1)
+	for k in range(n + 1):
+		x = x0 + (x1 - x0) * k / n
+		y = y0 + (y1 - y0) * k / n
+		if 0 <= x < width and 0 <= y < height:
+			img[y * width + x] = 0
+
+
+#Writes the curves out as a greyscale PNG file
+def renderPng(curves, path, width=screenW, height=screenH):
+	img = bytearray("\xff" * (width * height))
+	for pts in polylines(curves, width, height):
+		for i in range(1, len(pts)):
+			_drawLine(img, width, height, pts[i - 1], pts[i])
+	
+	#Every row starts with a filter byte (0 = none)
+	raw = bytearray()
+	for y in range(height):
+		raw.append(0)
+		raw += img[y * width:(y + 1) * width]
+	
+	def chunk(kind, data):
+		return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+	
+	fout = open(path, 'wb')
+	try:
+		fout.write("\x89PNG\r\n\x1a\n")
+		fout.write(chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)))
+		fout.write(chunk("IDAT", zlib.compress(str(raw))))
+		fout.write(chunk("IEND", ""))
+	finally:
+		fout.close()
+
+
+#Writes a preview file, picking the format from the extension
+def render(curves, path, width=screenW, height=screenH):
+	if path.lower().endswith(".png"):
+		renderPng(curves, path, width, height)
+	else:
+		renderSvg(curves, path, width, height)
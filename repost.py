@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+#Turns a toolpath saved with dannycam.py --save-toolpath back into GCode
+#The geometry (pocketing, ordering, plunge sites, linking zones) is all in
+#the file already, so this only needs to redo the part that depends on the
+#cutting settings: feeds, speeds, depth per pass, heights and linking. That
+#makes it quick to try a different material or machine, and it doesn't need
+#libarea at all.
+#
+#Usage: python repost.py part.dctp [out.ngc] [-f FEED] [-w RPM] [-c DEPTH] ...
+
+import argparse
+import os
+import gcode
+import estimate
+import adaptive
+import toolpathfile
+
+#Same defaults as dannycam.py (see pipeline.py, which needs libarea)
+DEFAULT_ZSAFE=25.4
+DEFAULT_FEED=30*25.4
+DEFAULT_FEEDZ=50
+DEFAULT_RPM=10000
+DEFAULT_ZMIN=0
+DEFAULT_ZMAX=1
+DEFAULT_CLEARANCE=1
+
+
+#--adaptive's argument; see adaptive.parseLimits
+def feedLimits(s):
+	try:
+		return adaptive.parseLimits(s)
+	except ValueError, e:
+		raise argparse.ArgumentTypeError(str(e))
+
+
+#Default output file: the toolpath filename, with its suffix replaced with
+#".ngc"
+def defaultOutput(inputfile):
+	return inputfile.split(toolpathfile.SUFFIX)[0] + ".ngc"
+
+
+parser=argparse.ArgumentParser(description="Generate GCode from a toolpath saved by dannycam.py --save-toolpath")
+parser.add_argument("inputfile", metavar="IN" + toolpathfile.SUFFIX, type=str, help="Saved toolpath")
+parser.add_argument("outputfile", metavar="OUT.ngc", nargs="?", default=None, type=str, help=("GCode file to write. Default IN.ngc"))
+parser.add_argument("--adaptive", metavar="MIN,MAX", nargs="?", const=(adaptive.DEFAULT_MIN_SCALE, adaptive.DEFAULT_MAX_SCALE), default=None, type=feedLimits, help="Scale the XY feed for each move by how much of the tool is cutting, between MIN and MAX times FEED (see dannycam.py)")
+parser.add_argument("-c","--cutdepth", metavar="DEPTH", default=None, type=float, help=("Sets the cut depth of each pass (mm). Default ToolD/10 mm"))
+parser.add_argument("-f","--feed", metavar="FEED", default=DEFAULT_FEED, type=float, help=("Sets the feed rate (mm/min) in the XY plane. Default " + str(DEFAULT_FEED) + " mm/min"))
+parser.add_argument("--feedz", metavar="FEED", default=DEFAULT_FEEDZ, type=float, help=("Sets the feed rate (mm/min) for plunging. Default " + str(DEFAULT_FEEDZ) + " mm/min"))
+parser.add_argument("--link", dest="link", action="store_true", help="Stay down between cuts in the same pocket when the move stays inside it (see dannycam.py)")
+parser.add_argument("--rest-feed", dest="restfeed", metavar="FEED", default=None, type=float, help="Sets the XY feed rate (mm/min) for the rest tool, if the toolpath has one. Default FEED")
+parser.add_argument("--rest-rpm", dest="restrpm", metavar="RPM", default=None, type=int, help="Sets the spindle speed (RPM) for the rest tool, if the toolpath has one. Default RPM")
+parser.add_argument("-w","--rpm", metavar="RPM", default=DEFAULT_RPM, type=int, help=("Sets the spindle angular velocity (RPM). Default " + str(DEFAULT_RPM) + " RPM"))
+parser.add_argument("--zmin", metavar="HEIGHT", default=DEFAULT_ZMIN, type=float, help=("Sets the height (mm) of the bottom of the pocket. Default " + str(DEFAULT_ZMIN) + " mm"))
+parser.add_argument("--zmax", metavar="HEIGHT", default=DEFAULT_ZMAX, type=float, help=("Sets the height (mm) of the top of the stock. Default " + str(DEFAULT_ZMAX) + " mm"))
+parser.add_argument("--zclear", metavar="HEIGHT", default=None, type=float, help=("Sets the height (mm) for short moves between cuts. Default zmax + " + str(DEFAULT_CLEARANCE) + " mm"))
+parser.add_argument("-z","--zsafe", metavar="HEIGHT", default=DEFAULT_ZSAFE, type=float, help=("Sets the safe height (mm) for rapid travel. Default " + str(DEFAULT_ZSAFE) + " mm"))
+
+
+#Builds gcode.partsToFile's parts from a loaded toolpath: the first tool
+#gets the main settings, and a rest tool (if any) its own feed and speed,
+#and a depth per pass scaled down by the ratio of the diameters
+def buildParts(toolpath, args):
+	main = toolpath.tools[0]
+	cutdepth = args.cutdepth
+	if cutdepth == None or cutdepth <= 0:
+		cutdepth = main["diameter"] / 10
+	settings = [(cutdepth, args.feed, args.rpm)]
+	for t in toolpath.tools[1:]:
+		settings.append((cutdepth * t["diameter"] / main["diameter"], args.restfeed or args.feed, args.restrpm or args.rpm))
+	
+	parts = []
+	for (t, (zstep, feed, rpm)) in zip(toolpath.tools, settings):
+		zones = None
+		if args.link:
+			zones = t["zones"]
+		parts.append((t["curves"], t["diameter"], t["stepover"], zstep, feed, rpm, zones, t["centers"]))
+	return parts
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	outputfile = args.outputfile or defaultOutput(args.inputfile)
+	try:
+		toolpath = toolpathfile.load(args.inputfile)
+	except (IOError, ValueError), e:
+		print "ERROR: Couldn't load " + args.inputfile + ": " + str(e) + ". Aborting!"
+		exit(-1)
+	
+	zclear = args.zclear
+	if zclear == None:
+		zclear = min(args.zmax + DEFAULT_CLEARANCE, args.zsafe)
+	print "Posting " + str(sum([len(t["curves"]) for t in toolpath.tools])) + " section(s) for " + str(len(toolpath.tools)) + " tool(s) to " + outputfile
+	fout = open(outputfile, 'w', 1 << 16)
+	try:
+		written = gcode.partsToFile(fout, buildParts(toolpath, args), args.zsafe, args.zmin, args.zmax, args.feedz, zclear, None, args.adaptive)
+	finally:
+		fout.close()
+	if written == 0:
+		#With more than one tool, the ones before may have been written
+		try:
+			os.remove(outputfile)
+		except OSError:
+			pass
+		print "ERROR: GCode generation failed. Aborting!"
+		exit(-1)
+	
+	print ""
+	for line in estimate.report(estimate.estimateFile(outputfile)):
+		print line
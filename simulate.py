@@ -0,0 +1,420 @@
+#Material removal simulation
+#Replays a GCode program (as written by gcode.generate) on a heightmap of the
+#stock: a grid of cells, each holding the height of the top of the material
+#there, starting at zmax. Each move lowers every cell the tool sweeps over to
+#the bottom of the tool (a flat end mill), worked out for a whole move's worth
+#of cells at once with NumPy. Arcs and helixes are cut as chords.
+#Along the way it notes:
+#	gouges: moves that go below zmin
+#	air cuts: feed moves that don't remove anything
+#	crashes: rapids that would remove material
+#and at the end, how much material is left inside the regions that were
+#meant to be cleared, and how much got cut outside them.
+#trimAir then rewrites the air cuts: a run of them becomes a single rapid if
+#the straight line between its ends is clear, otherwise each straight move
+#becomes a rapid along the same path.
+#Unlike the rest of the program, this needs NumPy.
+
+import math
+import re
+import gcode
+from areautil import curveToList, flattenList, areaBox
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+#Grid spacing (mm)
+DEFAULT_RESOLUTION = 0.2
+#Biggest grid to allocate; coarser than asked for if the job is too big
+MAX_CELLS = 4000000
+#A move has to take off more than this (mm) to count as cutting
+AIR_TOLERANCE = 0.001
+#How far (mm) below zmin counts as a gouge, or above it as material left
+FLOOR_TOLERANCE = 0.01
+
+_wordRe = re.compile(r"([A-Z])\s*([-+]?[0-9]*\.?[0-9]+)")
+_commentRe = re.compile(r"\([^)]*\)")
+
+
+#The words on a line, as (letter, value string), without comments
+def _words(line):
+	return _wordRe.findall(_commentRe.sub("", line.upper()))
+
+
+#Signed sweep of an arc from angle a0 to a1; CCW (G03) is positive. Start ==
+#end is a full circle
+def _sweep(ccw, a0, a1):
+	sweep = a1 - a0
+	if ccw:
+		if sweep <= 1e-9:
+			sweep += 2 * math.pi
+	else:
+		if sweep >= -1e-9:
+			sweep -= 2 * math.pi
+	return sweep
+
+
+#Works out where every line of a program moves
+#Returns a list with an entry per line: None for lines that don't move, or
+#(mode, tool, points), where mode is 0-3, tool is the tool number in use
+#(None before any tool change) and points is the path as a list of (x, y, z)-
+#just the start and end for a straight move, the ends of each chord for an
+#arc. Axes that haven't been given yet are None
+def parseLines(lines, tol=0.01):
+	entries = []
+	pos = [None, None, None]
+	mode = 0
+	tool = None
+	for line in lines:
+		target = list(pos)
+		offset = [0.0, 0.0]
+		moved = False
+		change = None
+		for (letter, value) in _words(line):
+			v = float(value)
+			if letter == "G":
+				if v in (0, 1, 2, 3):
+					mode = int(v)
+			elif letter == "T":
+				change = int(v)
+			elif letter == "M" and v == 6 and change != None:
+				tool = change
+			elif letter in "XYZ":
+				target["XYZ".index(letter)] = v
+				moved = True
+			elif letter == "I":
+				offset[0] = v
+			elif letter == "J":
+				offset[1] = v
+		if not moved:
+			entries.append(None)
+			continue
+		
+		start = pos
+		pos = target
+		points = [tuple(start), tuple(target)]
+		if (mode == 2 or mode == 3) and None not in start[:2]:
+			(cx, cy) = (start[0] + offset[0], start[1] + offset[1])
+			r = math.hypot(start[0] - cx, start[1] - cy)
+			a0 = math.atan2(start[1] - cy, start[0] - cx)
+			sweep = _sweep(mode == 3, a0, math.atan2(target[1] - cy, target[0] - cx))
+			n = 1
+			if r > tol:
+				n = max(1, int(math.ceil(abs(sweep) / (2 * math.acos(1 - tol / r)))))
+			(z0, z1) = (start[2], target[2])
+			points = [tuple(start)]
+			for k in range(1, n):
+				a = a0 + sweep * k / n
+				z = z0
+				if z0 != None and z1 != None:
+					z = z0 + (z1 - z0) * k / n
+				points.append((cx + r * math.cos(a), cy + r * math.sin(a), z))
+			points.append(tuple(target))
+		entries.append((mode, tool, points))
+	return entries
+
+
+#Material as a grid of heights
+#Cell (j, i) covers x0 + i*res to x0 + (i+1)*res, and likewise for y; its
+#height is sampled at its center
+class Heightmap(object):
+	def __init__(self, box, res, top):
+		(minx, miny, maxx, maxy) = box
+		self.res = float(res)
+		nx = max(1, int(math.ceil((maxx - minx) / self.res)))
+		ny = max(1, int(math.ceil((maxy - miny) / self.res)))
+		self.xs = minx + (numpy.arange(nx) + 0.5) * self.res
+		self.ys = miny + (numpy.arange(ny) + 0.5) * self.res
+		self.h = numpy.empty((ny, nx))
+		self.h.fill(top)
+	
+	#Index ranges of the cells within r of the box around two points
+	def _window(self, p0, p1, r):
+		i0 = numpy.searchsorted(self.xs, min(p0[0], p1[0]) - r)
+		i1 = numpy.searchsorted(self.xs, max(p0[0], p1[0]) + r, "right")
+		j0 = numpy.searchsorted(self.ys, min(p0[1], p1[1]) - r)
+		j1 = numpy.searchsorted(self.ys, max(p0[1], p1[1]) + r, "right")
+		return (j0, j1, i0, i1)
+	
+	#Cuts a straight move from p0 to p1 (x, y, z) with a flat end mill of
+	#radius r; with apply=False, only works out what it would do
+	#A cell is under the tool for an interval of the move, and z is linear
+	#along it, so the lowest the tool gets over that cell is at one end of the
+	#interval
+	#Returns the most it takes off any one cell, and the volume it removes
+	def cut(self, p0, p1, r, apply=True):
+		(j0, j1, i0, i1) = self._window(p0, p1, r)
+		if j0 >= j1 or i0 >= i1:
+			return (0.0, 0.0)
+		(px, py) = numpy.meshgrid(self.xs[i0:i1] - p0[0], self.ys[j0:j1] - p0[1])
+		(dx, dy, dz) = (p1[0] - p0[0], p1[1] - p0[1], p1[2] - p0[2])
+		l2 = dx * dx + dy * dy
+		
+		if l2 < 1e-12:
+			covered = px * px + py * py <= r * r
+			z = numpy.where(covered, min(p0[2], p1[2]), numpy.inf)
+		else:
+			t = (px * dx + py * dy) / l2
+			perp2 = px * px + py * py - t * t * l2
+			covered = perp2 <= r * r
+			h = numpy.sqrt(numpy.maximum(r * r - perp2, 0.0) / l2)
+			lo = numpy.maximum(t - h, 0.0)
+			hi = numpy.minimum(t + h, 1.0)
+			covered &= lo <= hi
+			lowest = lo
+			if dz < 0:
+				lowest = hi
+			z = numpy.where(covered, p0[2] + dz * lowest, numpy.inf)
+		
+		window = self.h[j0:j1, i0:i1]
+		removed = numpy.maximum(window - z, 0.0)
+		if apply:
+			numpy.minimum(window, z, window)
+		return (float(removed.max()), float(removed.sum()) * self.res * self.res)
+	
+	#Cuts a path (list of (x, y, z)) one piece at a time
+	#Returns the same as cut, for the whole path
+	def cutPath(self, points, r, apply=True):
+		deepest = 0.0
+		volume = 0.0
+		for k in range(1, len(points)):
+			(d, v) = self.cut(points[k - 1], points[k], r, apply)
+			deepest = max(deepest, d)
+			volume += v
+		return (deepest, volume)
+	
+	#Mask of the cells inside a list of areas (by the even-odd rule, so
+	#islands are outside)
+	def inside(self, areas, tol=0.01):
+		edges = []
+		for a in areas:
+			for c in a.getCurves():
+				pts = flattenList(curveToList(c), tol)
+				for k in range(1, len(pts)):
+					edges.append((pts[k - 1][0], pts[k - 1][1], pts[k][0], pts[k][1]))
+		(ny, nx) = self.h.shape
+		if len(edges) == 0:
+			return numpy.zeros((ny, nx), dtype=bool)
+		
+		#Every edge crosses the rows whose centers are in [min y, max y);
+		#count crossings to the left of each cell
+		e = numpy.array(edges)
+		lo = numpy.searchsorted(self.ys, numpy.minimum(e[:, 1], e[:, 3]))
+		hi = numpy.searchsorted(self.ys, numpy.maximum(e[:, 1], e[:, 3]))
+		counts = hi - lo
+		edge = numpy.repeat(numpy.arange(len(e)), counts)
+		row = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + lo[edge]
+		(x0, y0, x1, y1) = (e[edge, 0], e[edge, 1], e[edge, 2], e[edge, 3])
+		x = x0 + (x1 - x0) * (self.ys[row] - y0) / (y1 - y0)
+		col = numpy.searchsorted(self.xs, x, "right")
+		crossings = numpy.zeros((ny, nx + 1), dtype=int)
+		numpy.add.at(crossings, (row, col), 1)
+		return numpy.cumsum(crossings, axis=1)[:, :nx] % 2 == 1
+
+
+#Bounding box of everything the program moves over, as (minx, miny, maxx,
+#maxy), or None
+def _pathBox(entries):
+	xs = []
+	ys = []
+	for entry in entries:
+		if entry == None:
+			continue
+		for p in entry[2]:
+			if p[0] != None and p[1] != None:
+				xs.append(p[0])
+				ys.append(p[1])
+	if len(xs) == 0:
+		return None
+	return (min(xs), min(ys), max(xs), max(ys))
+
+
+#Ends a run of air cuts (see simulate): if the straight line from its start
+#to its end is clear, it can all be one rapid. Nothing in the run cut
+#anything, so the heightmap's the same as it was at the start of it
+def _closeRun(hm, run, merges):
+	if run == None or run[0] == run[1]:
+		return
+	if hm.cut(run[2], run[3], run[4], False)[0] <= AIR_TOLERANCE:
+		merges.append((run[0], run[1]))
+
+
+#Replays a program (a list of lines) on a block of stock from zmax down
+#toolD: diameter of the tool it starts with; tools maps tool numbers to
+#diameters for any tool changes (see gcode.toolChange)
+#res: grid spacing (mm); made coarser if the grid would be too big
+#regions: list of areas that were meant to be cleared, for checking what's
+#left; without them, only gouges, air cuts and crashes are checked
+#Returns a dict of the results; line numbers in it start from 0
+def simulate(lines, toolD, zmin, zmax, res=DEFAULT_RESOLUTION, regions=None, tools=None):
+	entries = parseLines(lines, res / 4.)
+	radii = [toolD / 2.] + [d / 2. for d in (tools or {}).values()]
+	box = _pathBox(entries)
+	if box == None:
+		box = (0.0, 0.0, 0.0, 0.0)
+	if regions:
+		boxes = [b for b in [areaBox(a) for a in regions] if b != None]
+		for b in boxes:
+			box = (min(box[0], b[0]), min(box[1], b[1]), max(box[2], b[2]), max(box[3], b[3]))
+	margin = max(radii) + res
+	box = (box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin)
+	cells = (box[2] - box[0]) * (box[3] - box[1]) / (res * res)
+	if cells > MAX_CELLS:
+		res = math.sqrt((box[2] - box[0]) * (box[3] - box[1]) / MAX_CELLS)
+	hm = Heightmap(box, res, zmax)
+	
+	air = []
+	airLength = 0.0
+	crashes = []
+	gouges = []
+	merges = []
+	chords = []
+	removed = 0.0
+	#Air cuts in a row, as [first line, last line, start, end, tool radius]
+	run = None
+	for (i, entry) in enumerate(entries):
+		points = None
+		if entry != None:
+			points = entry[2]
+			if None in points[0] or None in points[-1]:
+				points = None
+		if points == None:
+			_closeRun(hm, run, merges)
+			run = None
+			continue
+		
+		(mode, tool) = entry[:2]
+		r = toolD / 2.
+		if tool != None and tools != None and tool in tools:
+			r = tools[tool] / 2.
+		
+		#Anything but another air cut ends a run, and has to be checked
+		#against the heightmap before it cuts anything
+		if run != None and (mode == 0 or hm.cutPath(points, r, False)[0] > AIR_TOLERANCE):
+			_closeRun(hm, run, merges)
+			run = None
+		
+		(deepest, volume) = hm.cutPath(points, r)
+		removed += volume
+		if min([p[2] for p in points]) < zmin - FLOOR_TOLERANCE:
+			gouges.append(i)
+		if mode == 0:
+			if deepest > AIR_TOLERANCE:
+				crashes.append(i)
+			continue
+		if deepest > AIR_TOLERANCE:
+			continue
+		
+		air.append(i)
+		airLength += sum([math.sqrt(sum([(a - b)**2 for (a, b) in zip(points[k - 1], points[k])])) for k in range(1, len(points))])
+		#An arc can only turn into a rapid if its chord is clear
+		if mode != 1 and hm.cut(points[0], points[-1], r, False)[0] <= AIR_TOLERANCE:
+			chords.append(i)
+		if run == None:
+			run = [i, i, points[0], points[-1], r]
+		else:
+			(run[1], run[3]) = (i, points[-1])
+	_closeRun(hm, run, merges)
+	
+	result = {
+		"resolution": res,
+		"removed": removed,
+		"air": air,
+		"airLength": airLength,
+		"crashes": crashes,
+		"gouges": gouges,
+		"merges": merges,
+		"chords": chords,
+		"floorGouge": max(0.0, zmin - float(hm.h.min())),
+	}
+	if regions:
+		inside = hm.inside(regions, res / 4.)
+		cell = res * res
+		left = numpy.maximum(hm.h - zmin, 0.0)
+		leftover = inside & (left > FLOOR_TOLERANCE)
+		result["leftoverArea"] = float(leftover.sum()) * cell
+		result["leftoverVolume"] = float(left[leftover].sum()) * cell
+		#Cells outside the regions (and not just on the edge of them) that
+		#got cut into
+		outside = ~inside
+		outside[1:, :] &= ~inside[:-1, :]
+		outside[:-1, :] &= ~inside[1:, :]
+		outside[:, 1:] &= ~inside[:, :-1]
+		outside[:, :-1] &= ~inside[:, 1:]
+		result["wallArea"] = float((outside & (hm.h < zmax - FLOOR_TOLERANCE)).sum()) * cell
+	return result
+
+
+#Human-readable version of simulate's results, as a list of lines
+def report(result):
+	lines = ["Simulation (" + str("%.3f" % result["resolution"]) + " mm grid): removed " + str("%.1f" % result["removed"]) + " mm^3"]
+	lines.append("\tAir cuts: " + str(len(result["air"])) + " move(s), " + str("%.1f" % result["airLength"]) + " mm")
+	if result["gouges"]:
+		lines.append("\tWARNING: " + str(len(result["gouges"])) + " move(s) go below zmin, the first on line " + str(result["gouges"][0] + 1))
+	if result["crashes"]:
+		lines.append("\tWARNING: " + str(len(result["crashes"])) + " rapid(s) go through material, the first on line " + str(result["crashes"][0] + 1))
+	if "leftoverArea" in result:
+		lines.append("\tMaterial left above zmin: " + str("%.2f" % result["leftoverArea"]) + " mm^2, " + str("%.2f" % result["leftoverVolume"]) + " mm^3")
+		if result["wallArea"] > 0:
+			lines.append("\tWARNING: " + str("%.2f" % result["wallArea"]) + " mm^2 cut outside the pocket")
+	return lines
+
+
+#Rewrites the air cuts simulate found as rapids
+#Runs of air cuts whose ends have a clear straight line between them become
+#one rapid; otherwise straight moves (and arcs whose chord is clear) become
+#rapids along the same line, and other arcs stay as they are. The words the
+#following lines relied on (motion mode, feed) are put back where needed
+#Returns (new lines, number of lines rewritten or dropped)
+def trimAir(lines, result):
+	air = set(result["air"])
+	chords = set(result["chords"])
+	merges = dict([(first, last) for (first, last) in result["merges"]])
+	
+	out = []
+	trimmed = 0
+	#Modal state as the original program has it, and as written so far
+	(mode, feed) = (None, None)
+	(outMode, outFeed) = (None, None)
+	i = 0
+	while i < len(lines):
+		words = _words(lines[i])
+		last = merges.get(i, i)
+		#Catch up on the state through any lines being merged away
+		axes = {}
+		for k in range(i, last + 1):
+			for (letter, value) in _words(lines[k]):
+				if letter == "G" and float(value) in (0, 1, 2, 3):
+					mode = "G%02d" % int(float(value))
+				elif letter == "F":
+					feed = value
+				elif letter in "XYZ":
+					axes[letter] = value
+		
+		if i in merges or (i in air and (mode in ("G00", "G01") or i in chords)):
+			out.append(" ".join(["G00"] + [a + axes[a] for a in "XYZ" if a in axes]) + "\n")
+			outMode = "G00"
+			trimmed += last - i + 1
+			i = last + 1
+			continue
+		
+		#Anything else that moves gets back whatever mode and feed it's
+		#missing
+		line = lines[i]
+		if axes:
+			letters = [w[0] for w in words]
+			prefix = []
+			if outMode != mode and not [w for w in words if w[0] == "G" and float(w[1]) in (0, 1, 2, 3)]:
+				prefix.append(mode)
+			if mode != "G00" and outFeed != feed and "F" not in letters:
+				prefix.append("F" + feed)
+			if prefix:
+				line = " ".join(prefix) + " " + line
+			outMode = mode
+			if mode != "G00":
+				outFeed = feed
+		out.append(line)
+		i += 1
+	return (out, trimmed)
@@ -6,7 +6,32 @@ def rpmFromSfm(sfm, toolD_in):
 
 #Feed in inches/minute, given imperial inputs, or mm/minute, given metric units
 def feedFromRpmUpt(rpm, Upt, teeth):
-	return ipt * rpm * teeth
+	return Upt * rpm * teeth
+
+#Radial engagement angle (radians) of a cutter of diameter toolD taking a
+#cut woc wide: pi/2 at half the diameter, pi for a full-width slot
+def engagementAngle(toolD, woc):
+	woc = min(max(woc, 0.), toolD)
+	return math.acos(1 - 2. * woc / toolD)
+
+#Radial chip thinning: with a cut narrower than half the diameter, the chip
+#is thinner than the feed per tooth, so the feed can go up by this factor to
+#keep the same chip load
+def chipThinning(toolD, woc):
+	if woc >= toolD / 2.:
+		return 1.
+	return toolD / (2 * math.sqrt(woc * (toolD - woc)))
+
+#How much to scale the feed for a cut woc wide, relative to a cut half the
+#diameter wide. Narrower cuts get chip thinning; wider ones keep the same
+#chip, but each tooth is in the cut for longer, so the feed comes down in
+#proportion (to half, for a slot)
+def feedScale(toolD, woc):
+	if woc <= 0:
+		return float("inf")
+	if woc <= toolD / 2.:
+		return chipThinning(toolD, woc)
+	return (math.pi / 2) / engagementAngle(toolD, woc)
 
 #Material removal volume/minute, in mm**3 or in**3, depending on input units
 def removalFromFeed(toolD, feed, cutDepth):
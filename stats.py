@@ -0,0 +1,129 @@
+#Instrumentation: where a run spends its time and memory
+#A Stats collects, for each stage of a job, the wall and CPU time it took,
+#how many curves and vertices went into and came out of it, and the peak
+#memory use once it was done, and hands it all back as plain data for JSON.
+#Progress prints "n of total" lines with an ETA for long loops, at most every
+#few seconds, so a big job shows it's alive without flooding the terminal.
+
+import sys
+import time
+import json
+import resource
+import area
+import estimate
+
+#Minimum time (s) between progress lines
+PROGRESS_INTERVAL = 2.0
+
+
+#(curves, vertices) in an area, a list of areas or a list of curves (libarea
+#or list/array form); (None, None) for anything else
+def counts(x):
+	if isinstance(x, area.Area):
+		curves = x.getCurves()
+		return (len(curves), sum([c.getNumVertices() for c in curves]))
+	if isinstance(x, list):
+		if len(x) > 0 and isinstance(x[0], area.Area):
+			each = [counts(a) for a in x]
+			return (sum([c[0] for c in each]), sum([c[1] for c in each]))
+		if len(x) > 0 and isinstance(x[0], area.Curve):
+			return (len(x), sum([c.getNumVertices() for c in x]))
+		return (len(x), sum([len(c) for c in x]))
+	return (None, None)
+
+
+#Peak resident memory of this process so far, in KB (Linux reports KB; OS X
+#reports bytes)
+def maxrss():
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":
+		rss /= 1024
+	return rss
+
+
+class Stats(object):
+	def __init__(self):
+		self.stages = []
+		self.current = None
+		self.wall = time.time()
+		self.cpu = time.clock()
+	
+	#Starts timing a stage; inputs is whatever it's working on (see counts)
+	def begin(self, name, inputs=None):
+		(curves, verts) = counts(inputs)
+		self.current = {"stage": name, "curvesIn": curves, "verticesIn": verts, "wall": time.time(), "cpu": time.clock()}
+	
+	#Finishes the stage begun last; outputs is what it produced
+	def end(self, outputs=None):
+		s = self.current
+		s["wall"] = time.time() - s["wall"]
+		s["cpu"] = time.clock() - s["cpu"]
+		(s["curvesOut"], s["verticesOut"]) = counts(outputs)
+		s["maxrss"] = maxrss()
+		self.stages.append(s)
+		self.current = None
+	
+	#Everything collected so far, as plain data
+	def toDict(self):
+		return {
+			"stages": self.stages,
+			"wall": time.time() - self.wall,
+			"cpu": time.clock() - self.cpu,
+			"maxrss": maxrss(),
+		}
+	
+	#Writes toDict() to path as JSON
+	def write(self, path):
+		fout = open(path, 'w')
+		try:
+			json.dump(self.toDict(), fout, indent=1, sort_keys=True)
+		finally:
+			fout.close()
+	
+	#Human-readable version, as a list of lines
+	def report(self):
+		lines = ["Stage        wall (s)  cpu (s)   curves in/out     vertices in/out  peak RSS (KB)"]
+		for s in self.stages:
+			lines.append(s["stage"].ljust(12) + str("%9.3f" % s["wall"]) + str("%9.3f" % s["cpu"]) + (str(s["curvesIn"]) + "/" + str(s["curvesOut"])).rjust(16) + (str(s["verticesIn"]) + "/" + str(s["verticesOut"])).rjust(20) + str(s["maxrss"]).rjust(15))
+		return lines
+
+
+#Rate-limited progress reporting for a loop over total items
+#Call update() with the number done so far (or advance() as each one gets
+#done) as often as is convenient; it only prints every interval seconds (and
+#when everything's done)
+class Progress(object):
+	def __init__(self, label, total, interval=PROGRESS_INTERVAL, out=None):
+		self.label = label
+		self.total = total
+		self.interval = interval
+		self.out = out or sys.stdout
+		self.started = time.time()
+		self.last = self.started
+		self.finished = False
+		self.done = 0
+	
+	def advance(self, n=1):
+		self.update(self.done + n)
+	
+	def update(self, done):
+		self.done = done
+		if self.finished:
+			return
+		now = time.time()
+		if done < self.total and now - self.last < self.interval:
+			return
+		self.last = now
+		self.finished = done >= self.total
+		
+		line = self.label + ": " + str(done) + " of " + str(self.total)
+		if self.total > 0:
+			line += " (" + str(100 * done / self.total) + "%)"
+		elapsed = now - self.started
+		if 0 < done < self.total:
+			line += ", about " + estimate.formatTime(elapsed * (self.total - done) / done) + " left"
+		elif self.finished:
+			line += ", took " + estimate.formatTime(elapsed)
+		self.out.write(line + "\n")
+		#Flush the buffer so we know something is happening without waiting
+		self.out.flush()
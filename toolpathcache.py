@@ -0,0 +1,161 @@
+#On-disk cache of generated toolpaths
+#The expensive part of a run (reading the DXF, combining areas and pocketing)
+#only depends on the DXF itself and a handful of options, so its result is
+#stored under a hash of exactly those. Re-posting a job with a different
+#feed, RPM or depth then skips straight to GCode generation. Helix plunge
+#sites are stored too, since they only depend on the toolpath, as is the
+#rest-machining toolpath for a second tool, if there is one.
+#Entries are pickled dicts in the cache directory, one file per key. Each hit
+#touches its file, so evicting oldest-mtime-first gives LRU behavior.
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+from areautil import curveToList, curveFromList, areaToList, areaFromList
+
+#Bump this whenever the geometry stage changes in a way that would make old
+#entries wrong
+CACHE_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dannycam")
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+SUFFIX = ".toolpath"
+
+
+#Hash of the DXF contents plus every option that changes the toolpath
+#rest is (diameter, stepover) of the rest-machining tool, if any
+#dxfFilter is the layers/entities the DXF was read with (see
+#pipeline.Job.dxfFilter), if any
+#simplify is the tolerance the DXF's outlines were simplified to, if any
+#perRegion is True if the toolpath is pocketed a region at a time (pipelined,
+#see pipeline.Job.stream, or with more than one job, see
+#pocket.pocketRegions), which can come out differently from pocketing it all
+#at once
+def cacheKey(dxfPath, toolD, stepover, climb, rest=None, dxfFilter=None, simplify=None, perRegion=False):
+	h = hashlib.sha1()
+	fin = open(dxfPath, 'rb')
+	try:
+		while True:
+			block = fin.read(1 << 20)
+			if not block:
+				break
+			h.update(block)
+	finally:
+		fin.close()
+	h.update(repr((CACHE_VERSION, float(toolD), float(stepover), bool(climb))))
+	if rest != None:
+		h.update(repr(("rest", float(rest[0]), float(rest[1]))))
+	if dxfFilter != None:
+		h.update(repr(("filter", dxfFilter)))
+	if simplify != None:
+		h.update(repr(("simplify", float(simplify))))
+	if perRegion:
+		h.update(repr(("perregion",)))
+	return h.hexdigest()
+
+
+def _entryPath(cacheDir, key):
+	return os.path.join(cacheDir, key + SUFFIX)
+
+
+#Looks up a cached toolpath
+#Returns (curves, bounding box, regions, helix centers, rest), or None on a
+#miss; rest is (curves, regions, helix centers) for the rest-machining tool,
+#or None. A corrupt entry counts as a miss and is thrown away
+def load(cacheDir, key):
+	path = _entryPath(cacheDir, key)
+	if not os.path.isfile(path):
+		return None
+	try:
+		fin = open(path, 'rb')
+		try:
+			entry = pickle.load(fin)
+		finally:
+			fin.close()
+		curves = [curveFromList(verts) for verts in entry["curves"]]
+		box = entry["box"]
+		regions = [areaFromList(r) for r in entry["regions"]]
+		centers = entry["centers"]
+		rest = None
+		if entry.get("rest") != None:
+			(restCurves, restRegions, restCenters) = entry["rest"]
+			rest = ([curveFromList(verts) for verts in restCurves], [areaFromList(r) for r in restRegions], restCenters)
+	except Exception:
+		print "WARNING: Discarding unreadable cache entry " + path
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+		return None
+	
+	#Mark as recently used
+	try:
+		os.utime(path, None)
+	except OSError:
+		pass
+	return (curves, box, regions, centers, rest)
+
+
+#Stores a toolpath (a list of curves), the bounding box of the input, the
+#pocketed regions (a list of areas) and the helix center for each curve
+#(see gcode.helixCenters) under key, along with rest (as returned by load),
+#then trims the cache back down to maxBytes
+#Failing to write the cache is never fatal- it just prints a warning
+def store(cacheDir, key, curves, box, regions, centers, maxBytes=DEFAULT_CACHE_SIZE, rest=None):
+	entry = {"curves": [curveToList(c) for c in curves], "box": box, "regions": [areaToList(r) for r in regions], "centers": centers}
+	if rest != None:
+		(restCurves, restRegions, restCenters) = rest
+		entry["rest"] = ([curveToList(c) for c in restCurves], [areaToList(r) for r in restRegions], restCenters)
+	try:
+		if not os.path.isdir(cacheDir):
+			os.makedirs(cacheDir)
+		#Write to a temporary file and rename it into place, so a reader
+		#never sees half an entry
+		(fd, tmpPath) = tempfile.mkstemp(dir=cacheDir, suffix=".tmp")
+		try:
+			fout = os.fdopen(fd, 'wb')
+			try:
+				pickle.dump(entry, fout, pickle.HIGHEST_PROTOCOL)
+			finally:
+				fout.close()
+			os.rename(tmpPath, _entryPath(cacheDir, key))
+		except:
+			#evict() only looks at entries, so nothing else would ever
+			#clean this up
+			try:
+				os.remove(tmpPath)
+			except OSError:
+				pass
+			raise
+	except (IOError, OSError), e:
+		print "WARNING: Couldn't write toolpath cache: " + str(e)
+		return
+	evict(cacheDir, maxBytes)
+
+
+#Deletes least-recently-used entries until the cache fits in maxBytes
+def evict(cacheDir, maxBytes):
+	entries = []
+	total = 0
+	for name in os.listdir(cacheDir):
+		if not name.endswith(SUFFIX):
+			continue
+		path = os.path.join(cacheDir, name)
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		entries.append((st.st_mtime, st.st_size, path))
+		total += st.st_size
+	
+	entries.sort()
+	for (mtime, size, path) in entries:
+		if total <= maxBytes:
+			break
+		try:
+			os.remove(path)
+		except OSError:
+			continue
+		total -= size
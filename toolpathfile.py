@@ -0,0 +1,196 @@
+#Saved toolpaths, for re-posting without redoing the geometry
+#A toolpath file holds everything GCode generation needs that took libarea
+#to work out: every section's vertices (in the array form from curvearray,
+#already starting where its plunge wants it to), its helix center, which
+#tool cuts it, and the linking zones for each tool. repost.py
+#turns one back into GCode with whatever feeds, speeds, depths and linking
+#it's given, without libarea.
+#Layout: an 8 byte magic string, the length of a JSON header (4 bytes, little
+#endian), the header, then raw little-endian arrays, each starting on a 64
+#byte boundary. The header has the job's settings and where each array is.
+#With NumPy, the arrays are memory-mapped on load, so sections are read
+#straight off the disk as they're needed; without it, they're unpacked into
+#the list form instead.
+#Arrays:
+#	vertices: every section's vertices, one after the other (VERTEX)
+#	sections: where each section's vertices are, its tool (0 for the first)
+#		and its helix center (NaN if it has none)
+#	zonepoints: every zone polygon's points, one after the other
+#	zonepolys: where each polygon's points are, and which tool, zone and
+#		part of the zone (0: region outline, 1: tool-center area) it's in
+
+import json
+import struct
+import math
+import linking
+import gcode
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+MAGIC = "DCTPATH\0"
+VERSION = 1
+SUFFIX = ".dctp"
+ALIGN = 64
+
+#Record layouts, as (NumPy dtype, struct format); both are packed
+VERTEX = ([("type", "<i1"), ("x", "<f8"), ("y", "<f8"), ("cx", "<f8"), ("cy", "<f8")], "<bdddd")
+SECTION = ([("start", "<i8"), ("count", "<i8"), ("tool", "<i1"), ("hx", "<f8"), ("hy", "<f8")], "<qqbdd")
+POINT = ([("x", "<f8"), ("y", "<f8")], "<dd")
+POLY = ([("start", "<i8"), ("count", "<i8"), ("tool", "<i1"), ("zone", "<i4"), ("part", "<i1")], "<qqbib")
+
+
+#A loaded (or about to be saved) toolpath
+#tools is a list with a dict per tool, in cutting order: "diameter",
+#"stepover", "curves" (array form, or list form without NumPy), "centers"
+#(helix center or None per curve) and "zones" (as from linking.safeZones).
+#The curves and centers can go straight to gcode.generate- with the centers
+#given, planning the plunges again doesn't need libarea, and comes out the
+#same
+#info has the rest of the job's settings (input file, climb, bounding box)
+class Toolpath(object):
+	def __init__(self, tools, info=None):
+		self.tools = tools
+		self.info = info or {}
+
+
+def _pad(fout):
+	extra = -fout.tell() % ALIGN
+	fout.write("\0" * extra)
+
+
+#Writes records (a list of tuples) in the given layout; returns where they
+#start
+def _writeRecords(fout, layout, records):
+	_pad(fout)
+	offset = fout.tell()
+	if numpy != None:
+		numpy.array(records, dtype=layout[0]).tofile(fout)
+	else:
+		fmt = struct.Struct(layout[1])
+		for r in records:
+			fout.write(fmt.pack(*r))
+	return offset
+
+
+#Reads count records in the given layout from offset: a read-only
+#memory-mapped array with NumPy, a list of tuples without
+def _readRecords(path, layout, offset, count):
+	if numpy != None:
+		if count == 0:
+			return numpy.zeros(0, dtype=layout[0])
+		return numpy.memmap(path, dtype=layout[0], mode="r", offset=offset, shape=(count,))
+	fmt = struct.Struct(layout[1])
+	fin = open(path, "rb")
+	try:
+		fin.seek(offset)
+		data = fin.read(fmt.size * count)
+	finally:
+		fin.close()
+	return [fmt.unpack_from(data, k * fmt.size) for k in xrange(count)]
+
+
+#Saves a toolpath
+#parts is a list with a tuple per tool, in cutting order: (curves, tool
+#diameter, stepover, regions, helix centers), the same as the pipeline ends
+#up with. Curves are planned (gcode.planPlunges) and regions turned into
+#linking zones before they're written, so loading needs neither libarea nor
+#the regions
+def save(path, parts, info=None):
+	vertices = []
+	sections = []
+	points = []
+	polys = []
+	tools = []
+	for (tool, (curves, toolD, stepover, regions, centers)) in enumerate(parts):
+		tools.append({"diameter": toolD, "stepover": stepover})
+		for ((plan, verts), center) in zip(gcode.planPlunges(list(curves), toolD, centers), centers):
+			(hx, hy) = (float("nan"), float("nan"))
+			if center != None:
+				(hx, hy) = center
+			sections.append((len(vertices), len(verts), tool, hx, hy))
+			vertices.extend([tuple(v) for v in curveList(verts)])
+		for (zone, (outline, box, safe)) in enumerate(linking.safeZones(regions or [], toolD, gcode.pathTolerance)):
+			for (part, polygons) in ((0, outline), (1, safe)):
+				for poly in polygons:
+					polys.append((len(points), len(poly), tool, zone, part))
+					points.extend(poly)
+	
+	header = {"version": VERSION, "tools": tools, "info": info or {}, "arrays": {}}
+	counts = {"vertices": len(vertices), "sections": len(sections), "zonepoints": len(points), "zonepolys": len(polys)}
+	#The header says where the arrays are, so it has to be written last;
+	#leave room for it by writing it once with dummy offsets, padded out
+	for name in counts:
+		header["arrays"][name] = [0, counts[name]]
+	headerSize = len(json.dumps(header)) + 64 + 20 * len(counts)
+	
+	fout = open(path, "wb")
+	try:
+		fout.write(MAGIC)
+		fout.write(struct.pack("<I", headerSize))
+		fout.write(" " * headerSize)
+		for (name, layout, records) in (("vertices", VERTEX, vertices), ("sections", SECTION, sections), ("zonepoints", POINT, points), ("zonepolys", POLY, polys)):
+			header["arrays"][name][0] = _writeRecords(fout, layout, records)
+		text = json.dumps(header)
+		fout.seek(len(MAGIC) + 4)
+		fout.write(text.ljust(headerSize))
+	finally:
+		fout.close()
+
+
+#List form of a curve in array or list form
+def curveList(verts):
+	if numpy != None and isinstance(verts, numpy.ndarray):
+		return verts.tolist()
+	return verts
+
+
+#Loads a toolpath saved by save()
+#Raises ValueError if it isn't a toolpath file this version understands
+def load(path):
+	fin = open(path, "rb")
+	try:
+		if fin.read(len(MAGIC)) != MAGIC:
+			raise ValueError(path + " isn't a toolpath file")
+		(headerSize,) = struct.unpack("<I", fin.read(4))
+		header = json.loads(fin.read(headerSize))
+	finally:
+		fin.close()
+	if header["version"] != VERSION:
+		raise ValueError(path + " is a version " + str(header["version"]) + " toolpath file; expected version " + str(VERSION))
+	
+	arrays = {}
+	for (name, layout) in (("vertices", VERTEX), ("sections", SECTION), ("zonepoints", POINT), ("zonepolys", POLY)):
+		(offset, count) = header["arrays"][name]
+		arrays[name] = _readRecords(path, layout, offset, count)
+	
+	tools = header["tools"]
+	for t in tools:
+		(t["curves"], t["centers"], t["zones"]) = ([], [], [])
+	vertices = arrays["vertices"]
+	for (start, count, tool, hx, hy) in _rows(arrays["sections"]):
+		center = None
+		if not math.isnan(hx):
+			center = (hx, hy)
+		tools[tool]["curves"].append(vertices[start:start + count])
+		tools[tool]["centers"].append(center)
+	
+	#Zones go back to the (outline, box, tool-center area) form linking uses
+	points = arrays["zonepoints"]
+	for (start, count, tool, zone, part) in _rows(arrays["zonepolys"]):
+		zones = tools[tool]["zones"]
+		while len(zones) <= zone:
+			zones.append(([], []))
+		zones[zone][part].append([(float(p[0]), float(p[1])) for p in points[start:start + count]])
+	for t in tools:
+		t["zones"] = [(outline, linking.polysBox(outline), safe) for (outline, safe) in t["zones"]]
+	return Toolpath(tools, header["info"])
+
+
+#Rows of records as plain tuples
+def _rows(records):
+	if numpy != None and isinstance(records, numpy.ndarray):
+		return records.tolist()
+	return records
@@ -0,0 +1,171 @@
+#Watch mode: regenerates the GCode whenever the DXF changes
+#Keeps the pipeline resident and polls the DXF's modification time. After a
+#change, the Split() pieces are grouped into clusters: pieces whose bounding
+#boxes overlap, directly or through other pieces. XOR only mixes pieces that
+#overlap, so each cluster can be combined and pocketed on its own, and its
+#toolpath depends on nothing else. Clusters are keyed by a hash of their
+#geometry (and the options that shape the toolpath); any seen on the last
+#run get their toolpaths back as they were, and only new or changed ones are
+#combined and pocketed. The whole program is then ordered and written out as
+#usual, since sections from any cluster can end up next to each other.
+
+import os
+import time
+import hashlib
+import pipeline
+import combine
+import preview
+import estimate
+from areautil import areaBox, boxesOverlap, areaToList, curveToList, curveFromList
+
+#How often (s) to check the DXF
+DEFAULT_INTERVAL = 1.0
+#The DXF has to sit unchanged this long (s) before it's read, so we don't
+#catch an editor halfway through writing it
+SETTLE_TIME = 0.5
+
+
+#Groups areas whose bounding boxes overlap (directly or through others)
+#Returns a list of clusters, each a sorted list of indices into areas, in
+#order of their first index
+def clusterAreas(areas):
+	boxes = [areaBox(a) for a in areas]
+	parent = range(len(areas))
+	def find(i):
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+	
+	#Sweep across in X, only comparing against boxes that reach this far
+	active = []
+	for i in sorted([i for i in range(len(areas)) if boxes[i] != None], key=lambda i: boxes[i][0]):
+		active = [j for j in active if boxes[j][2] >= boxes[i][0]]
+		for j in active:
+			if boxesOverlap(boxes[i], boxes[j]):
+				parent[find(i)] = find(j)
+		active.append(i)
+	
+	clusters = {}
+	for i in range(len(areas)):
+		clusters.setdefault(find(i), []).append(i)
+	return sorted(clusters.values())
+
+
+#Hash of a cluster of areas plus anything else its toolpath depends on
+#(options: a tuple of them). The pieces' order doesn't matter
+def clusterKey(areas, options):
+	h = hashlib.sha1()
+	h.update(repr(options))
+	for piece in sorted([repr(areaToList(a)) for a in areas]):
+		h.update(piece)
+	return h.hexdigest()
+
+
+#Job.toolpaths' result, with the curves (and rest curves) in list form
+def _freeze(result):
+	(curves, regions, centers, rest) = result
+	if rest != None:
+		rest = ([curveToList(c) for c in rest[0]], rest[1], rest[2])
+	return ([curveToList(c) for c in curves], regions, centers, rest)
+
+
+class Watcher(object):
+	#options are the keyword arguments for pipeline.Job; previewfile is
+	#redrawn after every run, if given
+	def __init__(self, inputfile, outputfile=None, options=None, interval=DEFAULT_INTERVAL, previewfile=None):
+		self.inputfile = inputfile
+		self.outputfile = outputfile
+		#Every run is built from what's kept here, so the on-disk cache
+		#would only slow it down
+		self.options = dict(options or {})
+		self.options["cache"] = False
+		self.interval = interval
+		self.previewfile = previewfile
+		#Toolpaths from the last run, by cluster key, as returned by
+		#Job.toolpaths but with the curves in list form- later stages
+		#(ordering) change where curves start, so each run gets fresh ones
+		self.known = {}
+		self.runs = 0
+	
+	#Options that change a cluster's toolpath
+	def _optionsKey(self, job):
+		return (job.toold, job.stepover, job.climb, job.resttool, job.reststepover)
+	
+	#Runs the job once, reusing the toolpaths of any cluster that hasn't
+	#changed. Returns (job, number of clusters, number recomputed)
+	def build(self):
+		#Only the first run says everything it's doing; after that, it's
+		#just the one line per run from run()
+		options = dict(self.options)
+		if self.runs > 0:
+			options["verbose"] = False
+		job = pipeline.Job(self.inputfile, self.outputfile, **options)
+		if self.runs == 0:
+			job.describe()
+		self.runs += 1
+		job.load()
+		
+		curves = []
+		regions = []
+		centers = []
+		rest = ([], [], [])
+		known = {}
+		clusters = clusterAreas(job.areas)
+		for cluster in clusters:
+			pieces = [job.areas[i] for i in cluster]
+			key = clusterKey(pieces, self._optionsKey(job))
+			result = self.known.get(key) or known.get(key)
+			if result == None:
+				result = _freeze(job.toolpaths(combine.xorAll(pieces, 1, False)))
+			known[key] = result
+			
+			curves += [curveFromList(verts) for verts in result[0]]
+			regions += result[1]
+			centers += result[2]
+			if result[3] != None:
+				rest[0].extend([curveFromList(verts) for verts in result[3][0]])
+				rest[1].extend(result[3][1])
+				rest[2].extend(result[3][2])
+		recomputed = len([k for k in known if k not in self.known])
+		self.known = known
+		
+		(job.curves, job.regions, job.centers) = (curves, regions, centers)
+		if job.resttool != None:
+			(job.restCurves, job.restRegions, job.restCenters) = rest
+		job.compact()
+		job.order()
+		job.emit()
+		job.simulate()
+		if self.previewfile != None:
+			preview.render(job.curves + (job.restCurves or []), self.previewfile)
+		return (job, len(clusters), recomputed)
+	
+	#Builds whenever the DXF changes, until interrupted
+	def run(self):
+		print "Watching " + self.inputfile + " (Ctrl-C to stop)"
+		last = None
+		while True:
+			try:
+				mtime = os.stat(self.inputfile).st_mtime
+			except OSError:
+				mtime = None
+			if mtime != None and mtime != last:
+				time.sleep(SETTLE_TIME)
+				try:
+					settled = os.stat(self.inputfile).st_mtime == mtime
+				except OSError:
+					settled = False
+				if settled:
+					last = mtime
+					started = time.time()
+					try:
+						(job, clusters, recomputed) = self.build()
+						print time.strftime("%H:%M:%S") + " Wrote " + job.outputfile + ": " + str(recomputed) + " of " + str(clusters) + " region cluster(s) recomputed in " + str("%.2f" % (time.time() - started)) + " s; estimated run time " + estimate.formatTime(job.times["total"])
+					#A DXF caught halfway through being saved can trip up the
+					#reader or libarea in all sorts of ways; none of them
+					#should stop the watching
+					except (pipeline.DannyCamError, ValueError, RuntimeError, EnvironmentError), e:
+						print "ERROR: " + str(e) + ". Waiting for the next change"
+					continue
+			time.sleep(self.interval)
@@ -0,0 +1,67 @@
+#Background file writer
+#GCode is generated a chunk at a time; rather than stopping to write each
+#one, chunks are batched up and handed to a thread that does the writing, so
+#the disk works while the next chunks are being generated. The queue to the
+#thread is bounded, so if the disk can't keep up, generation waits for it
+#instead of piling up the whole program in memory.
+
+import threading
+import Queue
+
+#Batches handed to the writer thread are about this big (characters)
+BATCH_SIZE = 1 << 16
+#How many batches can wait for the writer thread
+QUEUE_SIZE = 16
+
+
+#File-like wrapper around fout (only write() and close()) that writes from a
+#background thread
+#Errors from the thread are raised by close()
+class Writer(object):
+	def __init__(self, fout, batchSize=BATCH_SIZE, queueSize=QUEUE_SIZE):
+		self.fout = fout
+		self.batchSize = batchSize
+		self.queue = Queue.Queue(queueSize)
+		self.batch = []
+		self.batchLen = 0
+		self.error = None
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+	
+	def _run(self):
+		while True:
+			data = self.queue.get()
+			if data == None:
+				return
+			#Keep draining the queue after an error, so write() never blocks
+			if self.error != None:
+				continue
+			#Anything that stops the thread would leave write() blocked on a
+			#full queue, so every error is kept for close() to raise
+			try:
+				self.fout.write(data)
+			except Exception, e:
+				self.error = e
+	
+	def write(self, s):
+		self.batch.append(s)
+		self.batchLen += len(s)
+		if self.batchLen >= self.batchSize:
+			self.flush()
+	
+	#Hands whatever's been written so far to the thread
+	def flush(self):
+		if self.batch:
+			self.queue.put("".join(self.batch))
+			self.batch = []
+			self.batchLen = 0
+	
+	#Waits for everything to be written, then closes fout
+	def close(self):
+		self.flush()
+		self.queue.put(None)
+		self.thread.join()
+		self.fout.close()
+		if self.error != None:
+			raise self.error